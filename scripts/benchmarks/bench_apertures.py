@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# Time spent turning pad flashes into polygons, with and without GerberGeometryContext's aperture shape cache.  The
+# synthetic layer is all flashes from a handful of apertures, some with holes, the way pad heavy layers look.  Only
+# the shapes are timed - the union is left out (see bench_gerber_union.py).
+
+import optparse
+import random
+
+import common
+
+apertures = [
+    '%ADD10C,0.0600*%',
+    '%ADD11R,0.0600X0.0400*%',
+    '%ADD12C,0.0750X0.0300*%',
+    '%ADD13R,0.0800X0.0800X0.0350*%',
+    '%ADD14C,0.0250*%',
+]
+
+
+def synthetic_pads(count, width=4.0, height=3.0, seed=1):
+    r = random.Random(seed)
+    lines = ['%FSLAX24Y24*%', '%MOIN*%'] + apertures + ['%LPD*%']
+    for k in range(count):
+        lines += ['D%d*' % (10 + k % len(apertures)), 'X%06dY%06dD03*' % (
+            round(r.uniform(0, width) * 10000), round(r.uniform(0, height) * 10000),
+        )]
+
+    lines.append('M02*')
+    return '\n'.join(lines) + '\n'
+
+
+def make_context(cached):
+    from lib.campy.operations.pcb import GerberGeometryContext, _place, _template
+
+    class ShapesContext(GerberGeometryContext):
+        def __init__(self):
+            super(ShapesContext, self).__init__()
+            self.shapes = []
+
+        def update_running(self, p, add=True):
+            self.shapes.append(p)
+
+        def flush_running(self):
+            pass
+
+        def _flash(self, key, make, center):
+            if cached:
+                return super(ShapesContext, self)._flash(key, make, center)
+            return _place(_template(make()), *center)
+
+    return ShapesContext()
+
+
+if __name__ == '__main__':
+    from lib.campy.operations.pcb import pcb_layer
+
+    parser = optparse.OptionParser()
+    parser.add_option('--pads', help='Number of flashes', type=int, default=20000)
+    options, args = parser.parse_args()
+
+    layer = pcb_layer(gerber_data=synthetic_pads(options.pads), gerber_file='synthetic.gbr')
+
+    results = {}
+    for cached in [False, True]:
+        ctx = make_context(cached)
+        with common.Timer() as t:
+            for prim in layer.primitives:
+                ctx.render(prim)
+
+        results[cached] = ctx.shapes
+        print "cached=%-5s flashes=%d shapes=%d time=%.3fs" % (cached, len(layer.primitives), len(ctx.templates), t.elapsed)
+
+    for a, b in zip(results[False], results[True]):
+        assert a.symmetric_difference(b).area < 1e-9, "cached shape doesn't match"
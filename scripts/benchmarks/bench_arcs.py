@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# File size and simulated cycle time of an isolation job with and without arc fitting.
+#
+# Cycle times come from lib.campy.estimate with the machine's feedrates and accelerations.
+
+import optparse
+import os
+import shutil
+import tempfile
+
+import common
+
+
+def run(outdir, geom, arc_tolerance):
+    from lib.campy import pcb_isolation_mill
+
+    m = common.setup_machine()
+    file_name = os.path.join(outdir, 'iso_{}.ngc'.format(arc_tolerance))
+    m.set_file(file_name)
+    m.set_tool(common.iso_bit())
+    with common.Timer() as t:
+        pcb_isolation_mill(gerber_geometry=geom, outline_separation=0.020, depth=0.005, arc_tolerance=arc_tolerance)
+        m.close_file(file_name)
+
+    return file_name, t.elapsed, m
+
+
+if __name__ == '__main__':
+    from lib.campy import estimate
+
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=1000)
+    parser.add_option('--tolerance', help='Arc fitting tolerance', type=float, default=0.0005)
+    parser.add_option('--accel', help='X/Y acceleration for the cycle time estimate, in/s^2', type=float)
+    options, args = parser.parse_args()
+
+    geom = common.synthetic_copper(count=options.features)
+    outdir = tempfile.mkdtemp()
+    try:
+        for tolerance in [None, options.tolerance]:
+            file_name, elapsed, m = run(outdir, geom, tolerance)
+            lines = open(file_name).read().splitlines()
+            arcs = sum(1 for l in lines if l.lstrip().startswith(('G2', 'G3')))
+
+            accelerations = list(m.accelerations)
+            if options.accel:
+                accelerations[:2] = [options.accel, options.accel]
+            estimator = estimate.Estimator(m.max_feedrates, accelerations)
+            estimator.add_lines(lines)
+
+            print "arc_tolerance=%-8s size=%-9d lines=%-8d arcs=%-7d generate=%.3fs estimated cycle time=%.1fmin" % (
+                tolerance, os.path.getsize(file_name), len(lines), arcs, elapsed, estimator.report()['seconds'] / 60.,
+            )
+    finally:
+        shutil.rmtree(outdir)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Writes the same synthetic job with GCodePost and CompactGCodePost, reports file sizes and checks with
+# gcode.compare that every file still moves the machine the same way.
+
+import optparse
+import os
+import shutil
+import tempfile
+
+import common
+
+
+def run(outdir, post, geom, holes, zprobe_radius=None):
+    from lib.campy import pcb_isolation_mill, pcb_drill, constants
+
+    m = common.setup_machine(post=post)
+    results = []
+    for name, tool, fn in [
+        ('iso.ngc', common.iso_bit(), lambda: pcb_isolation_mill(
+            gerber_geometry=geom, outline_separation=0.020, depth=0.005, zprobe_radius=zprobe_radius,
+        )),
+        ('drill.ngc', common.drill_bit(), lambda: pcb_drill(gerber_geometry=holes, depth=1.7*constants.MM)),
+    ]:
+        file_name = os.path.join(outdir, name)
+        m.set_file(file_name)
+        m.set_tool(tool)
+        with common.Timer() as t:
+            fn()
+            m.close_file(file_name)
+        results.append((name, file_name, t.elapsed))
+
+    return results
+
+
+if __name__ == '__main__':
+    from lib.campy import gcode
+    from lib.campy.post import GCodePost, CompactGCodePost
+
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=1000)
+    parser.add_option('--holes', help='Number of holes on the synthetic board', type=int, default=1000)
+    parser.add_option('--zprobe', help='Probe radius, adds expressions to every cut', default=None)
+    options, args = parser.parse_args()
+
+    geom = common.synthetic_copper(count=options.features)
+    holes = common.synthetic_holes(count=options.holes)
+    zprobe_radius = float(options.zprobe) if options.zprobe else None
+    outdir = tempfile.mkdtemp()
+    try:
+        compact = CompactGCodePost()
+        plain = run(os.path.join(outdir, 'plain'), GCodePost(), geom, holes, zprobe_radius)
+        small = run(os.path.join(outdir, 'compact'), compact, geom, holes, zprobe_radius)
+
+        failed = False
+        for (name, plain_name, plain_time), (_, small_name, small_time) in zip(plain, small):
+            plain_size = os.path.getsize(plain_name)
+            small_size = os.path.getsize(small_name)
+            # half a unit in the last place kept, plus a little for the 6 places GCodePost rounds to
+            differences = gcode.compare(
+                open(plain_name).read().splitlines(), open(small_name).read().splitlines(),
+                tolerance=0.5 * 10 ** -compact.precision['inch'] + 1e-6,
+                feed_tolerance=0.5 * 10 ** -compact.feed_precision['inch'] + 1e-6,
+            )
+            print "%-10s plain=%-10d compact=%-10d (%.1f%%) time plain=%.3fs compact=%.3fs round trip %s" % (
+                name, plain_size, small_size, 100. * small_size / plain_size, plain_time, small_time,
+                'ok' if not differences else 'FAILED',
+            )
+            for d in differences:
+                print "    ", d
+            failed = failed or bool(differences)
+
+        print "post reported", compact.stats()
+        assert not failed, "compacted G-code moves differently"
+    finally:
+        shutil.rmtree(outdir)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+# Rapid travel between drill hits in file order, serpentine order and nearest neighbour + 2-opt order, on a synthetic
+# board full of vias.  Holes are ordered per size (one group per drill bit) and all together.
+
+import optparse
+
+import common
+
+
+if __name__ == '__main__':
+    from lib.campy import optimize
+
+    parser = optparse.OptionParser()
+    parser.add_option('--holes', help='Number of holes on the synthetic board', type=int, default=2000)
+    options, args = parser.parse_args()
+
+    holes = [h.coords[0] for h in common.synthetic_holes(count=options.holes)]
+
+    for method in ['serpentine', 'tsp']:
+        for group in [False, True]:
+            with common.Timer() as t:
+                groups, stats = optimize.order_holes(holes, method=method, group=group)
+
+            visited = sorted(i for size, indexes in groups for i in indexes)
+            assert visited == range(len(holes)), "every hole should be visited exactly once"
+
+            print "%-10s grouped=%-5s holes=%d groups=%d travel before=%.3f after=%.3f saved=%.1f%% time=%.3fs" % (
+                method, group, stats['points'], len(groups), stats['travel_before'], stats['travel_after'],
+                100. * stats['travel_saved'] / stats['travel_before'], t.elapsed,
+            )
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Compares write-through (write + flush per line, the old behaviour) against the buffered G-code writer on a large
+# isolation job.  Syscalls are counted by wrapping the output file, every write/flush that reaches it is one.
+# Most of the job is spent offsetting geometry, so time spent in Environment._write_post/flush is reported separately.
+
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+import common
+
+
+class CountingFile(object):
+    def __init__(self, f):
+        self.f = f
+        self.writes = 0
+        self.flushes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.f.write(data)
+
+    def flush(self):
+        self.flushes += 1
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def run(geom, outdir, **machine_kwargs):
+    from lib.campy import pcb_isolation_mill
+
+    m = common.setup_machine(**machine_kwargs)
+    file_name = os.path.join(outdir, 'iso.ngc')
+    m.set_file(file_name)
+    counter = CountingFile(m.f)
+    m.files[file_name] = m.f = counter
+
+    output_time = [0]
+
+    def timed(fn):
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            retval = fn(*args, **kwargs)
+            output_time[0] += time.time() - start
+            return retval
+        return wrapper
+
+    m._write_post = timed(m._write_post)
+    m.flush = timed(m.flush)
+
+    m.set_tool(common.iso_bit())
+    with common.Timer() as t:
+        pcb_isolation_mill(gerber_geometry=geom, outline_separation=0.020, depth=0.005)
+        m.close_file(file_name)
+
+    return t.elapsed, output_time[0], counter, os.path.getsize(file_name)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=3000)
+    parser.add_option('--buffer-size', help='Buffer size in bytes', type=int, default=64*1024)
+    options, args = parser.parse_args()
+
+    geom = common.synthetic_copper(count=options.features)
+    outdir = tempfile.mkdtemp()
+    try:
+        for label, kwargs in [
+            ('write-through', {'write_through': True}),
+            ('buffered', {'buffer_size': options.buffer_size}),
+        ]:
+            elapsed, output_time, counter, size = run(geom, outdir, **kwargs)
+            print "%-14s total=%8.3fs output=%7.3fs writes=%-8d flushes=%-8d bytes=%d" % (
+                label, elapsed, output_time, counter.writes, counter.flushes, size
+            )
+    finally:
+        shutil.rmtree(outdir)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Time to turn a copper layer into geometry with the old running union (one union per primitive) and the batched
+# union in GerberGeometryContext, for boards with more and more primitives.  The synthetic gerber has a ground pour,
+# clear polarity cut-outs around every pad and then the pads and traces, so polarity ordering is exercised too.
+
+import optparse
+import random
+
+import common
+
+
+# traces go from every third pad to the pad before it, or somewhere within trace_length of it if that's given
+def synthetic_gerber(count, width=4.0, height=3.0, seed=1, trace_length=None):
+    r = random.Random(seed)
+
+    def _xy(x, y):
+        return 'X%06dY%06d' % (round(x * 10000), round(y * 10000))
+
+    pads = [(r.uniform(0.1, width - 0.1), r.uniform(0.1, height - 0.1)) for i in range(count)]
+    lines = [
+        '%FSLAX24Y24*%', '%MOIN*%',
+        '%ADD10C,0.0600*%', '%ADD11R,0.0600X0.0400*%', '%ADD12C,0.0100*%',
+        '%LPD*%', 'G36*', _xy(0, 0) + 'D02*', _xy(width, 0) + 'D01*', _xy(width, height) + 'D01*',
+        _xy(0, height) + 'D01*', _xy(0, 0) + 'D01*', 'G37*',
+        '%LPC*%',
+    ]
+
+    for x, y in pads:
+        lines += ['G36*', _xy(x - 0.05, y - 0.05) + 'D02*', _xy(x + 0.05, y - 0.05) + 'D01*',
+                  _xy(x + 0.05, y + 0.05) + 'D01*', _xy(x - 0.05, y + 0.05) + 'D01*', _xy(x - 0.05, y - 0.05) + 'D01*',
+                  'G37*']
+
+    lines.append('%LPD*%')
+    for k, (x, y) in enumerate(pads):
+        if k % 3 == 2:
+            x2, y2 = pads[k - 1]
+            if trace_length:
+                x2 = min(max(x + r.uniform(-trace_length, trace_length), 0), width)
+                y2 = min(max(y + r.uniform(-trace_length, trace_length), 0), height)
+            lines += ['D12*', _xy(x, y) + 'D02*', _xy(x2, y2) + 'D01*']
+        else:
+            lines += ['D10*' if k % 3 == 0 else 'D11*', _xy(x, y) + 'D03*']
+
+    lines.append('M02*')
+    return '\n'.join(lines) + '\n'
+
+
+def make_running_context():
+    from lib.campy.operations.pcb import GerberGeometryContext
+
+    # what GerberGeometryContext used to do
+    class RunningUnionContext(GerberGeometryContext):
+        def update_running(self, p, add=True):
+            if add:
+                self.running_poly = self.running_poly.union(p) if self.running_poly else p
+            else:
+                self.running_poly = self.running_poly.difference(p)
+
+        def flush_running(self):
+            pass
+
+    return RunningUnionContext()
+
+
+if __name__ == '__main__':
+    from lib.campy.operations.pcb import GerberGeometryContext, pcb_layer
+
+    parser = optparse.OptionParser()
+    parser.add_option('--counts', help='Comma separated pad counts', default='100,250,500,1000')
+    parser.add_option('--skip-running', help='Only time the batched union (the running union is O(n^2))', action='store_true')
+    options, args = parser.parse_args()
+
+    for count in [int(c) for c in options.counts.split(',')]:
+        layer = pcb_layer(gerber_data=synthetic_gerber(count), gerber_file='synthetic.gbr')
+        primitives = len(layer.primitives)
+
+        with common.Timer() as batched_time:
+            batched = GerberGeometryContext().render_layer(layer)
+
+        if options.skip_running:
+            print "pads=%-6d primitives=%-6d batched=%.3fs" % (count, primitives, batched_time.elapsed)
+            continue
+
+        with common.Timer() as running_time:
+            running = make_running_context().render_layer(layer)
+
+        difference = batched.symmetric_difference(running).area
+        print "pads=%-6d primitives=%-6d running=%.3fs batched=%.3fs (%.1fx) area=%.6f difference=%.2e" % (
+            count, primitives, running_time.elapsed, batched_time.elapsed,
+            running_time.elapsed / batched_time.elapsed, batched.area, difference,
+        )
+        assert difference < 1e-6 * batched.area, "batched union doesn't match the running union"
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Z compensation for a lot of cut vertices: finding each point's triangle with a linear search and working out its
+# weights one at a time (what pcb_isolation_mill used to do), and HeightMap.expressions doing the whole lot at once.
+# Random probe values are substituted into the expressions to check they come out at the same heights.
+
+import optparse
+import random
+import re
+
+import common
+
+
+def probe_grid(width, height, spacing):
+    import shapely.geometry
+
+    points = []
+    var = 500
+    rows = int(height / (spacing / 2 ** .5)) + 1
+    for row in range(rows):
+        offset = 0 if row % 2 == 0 else spacing / 2.
+        for column in range(int(width / spacing) + (1 if row % 2 == 0 else 0)):
+            points.append(shapely.geometry.Point(offset + column * spacing, row * spacing / 2 ** .5, var))
+            var += 1
+
+    return points
+
+
+def linear_heights(points, coords, values):
+    import shapely.geometry
+    import shapely.ops
+
+    triangles = shapely.ops.triangulate(shapely.geometry.MultiPoint(points), edges=False)
+    heights = []
+    for x, y in coords:
+        pt = shapely.geometry.Point(x, y)
+        match = next(t for t in triangles if t.intersects(pt))
+        (x1, y1, z1), (x2, y2, z2), (x3, y3, z3) = match.exterior.coords[:3]
+        d = (y2 - y3) * (x1 - x3) + (x3 - x2) * (y1 - y3)
+        w1 = ((y2 - y3) * (x - x3) + (x3 - x2) * (y - y3)) / d
+        w2 = ((y3 - y1) * (x - x3) + (x1 - x3) * (y - y3)) / d
+        heights.append(w1 * values[int(z1)] + w2 * values[int(z2)] + (1 - w1 - w2) * values[int(z3)])
+
+    return heights
+
+
+def evaluate(expression, values):
+    return eval(re.sub(r'#(\d+)', lambda m: repr(values[int(m.group(1))]), expression.replace('[', '(').replace(']', ')')))
+
+
+if __name__ == '__main__':
+    import shapely.geometry
+    from lib.campy.heightmap import HeightMap
+
+    parser = optparse.OptionParser()
+    parser.add_option('--points', help='Number of cut vertices', type=int, default=5000)
+    parser.add_option('--spacing', help='Probe spacing', type=float, default=0.325)
+    options, args = parser.parse_args()
+
+    r = random.Random(1)
+    probes = probe_grid(6, 4, options.spacing)
+    values = dict((int(p.z), r.uniform(-0.01, 0.01)) for p in probes)
+    hull = shapely.geometry.MultiPoint(probes).convex_hull
+    coords = []
+    while len(coords) < options.points:
+        c = (r.uniform(0, 6), r.uniform(0, 4))
+        if hull.contains(shapely.geometry.Point(c)):
+            coords.append(c)
+
+    with common.Timer() as linear_time:
+        expected = linear_heights(probes, coords, values)
+
+    with common.Timer() as map_time:
+        expressions = HeightMap(probes).expressions(coords)
+
+    error = max(abs(evaluate(e, values) - z) for e, z in zip(expressions, expected))
+    print "probes=%d points=%d linear=%.3fs heightmap=%.3fs (%.1fx) max error=%.2e" % (
+        len(probes), len(coords), linear_time.elapsed, map_time.elapsed, linear_time.elapsed / map_time.elapsed, error,
+    )
+    assert error < 1e-5, "heights don't match"
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Loading a board from a zip the old way - every member read into memory and every layer parsed, silkscreen and
+# mask included - against PCBProject reading only the layers it makes geometry for, one at a time, straight out of
+# the zip.  Each run is in its own process so the peak memory (ru_maxrss) means something.
+
+import multiprocessing
+import optparse
+import os
+import resource
+import shutil
+import tempfile
+import zipfile
+
+import common
+from bench_gerber_union import synthetic_gerber
+from bench_process_layers import synthetic_drill, synthetic_outline
+
+
+def eager(zip_name):
+    from lib.campy import PCBProject
+
+    # what PCBProject.load used to do with a zip
+    pcb = PCBProject()
+    z = zipfile.ZipFile(zip_name)
+    for i in z.infolist():
+        ftype = pcb.identify_file(i.filename)
+        if ftype is not None:
+            pcb.layers[ftype] = {'filename': i.filename, 'data': z.read(i.filename)}
+
+    pcb.cam_layers = sorted(set(k[1] for k in pcb.layers))
+    pcb.process_layers()
+    return pcb
+
+
+def lazy(zip_name):
+    from lib.campy import PCBProject
+
+    return PCBProject(gerber_input=zip_name)
+
+
+def measure(args):
+    fn, zip_name = args
+    from lib.campy import layercache
+
+    with common.Timer() as t:
+        pcb = fn(zip_name)
+
+    held = sum(len(v.get('data', '')) for v in pcb.layers.values())
+    return (
+        t.elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(layercache.default.layers), held,
+        pcb.bounds, dict((k, v['geometry'].wkb) for k, v in pcb.layers.items() if k[1] in ('copper', 'drill', 'outline')),
+    )
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--pads', help='Number of pads on each layer', type=int, default=1000)
+    parser.add_option('--holes', help='Number of holes', type=int, default=1000)
+    options, args = parser.parse_args()
+
+    files = [
+        ('gerbers/board.gko', synthetic_outline(4, 3)),
+        ('gerbers/board.drl', synthetic_drill(options.holes, 4, 3)),
+        ('gerbers/board.gtl', synthetic_gerber(options.pads, 4, 3, seed=1)),
+        ('gerbers/board.gbl', synthetic_gerber(options.pads, 4, 3, seed=2)),
+    ]
+    for seed, name in enumerate(['board.gts', 'board.gbs', 'board.gto', 'board.gbo']):
+        files.append(('gerbers/' + name, synthetic_gerber(options.pads, 4, 3, seed=seed + 3)))
+
+    directory = tempfile.mkdtemp()
+    try:
+        zip_name = os.path.join(directory, 'board.zip')
+        with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as z:
+            for name, data in files:
+                z.writestr(name, data)
+
+        results = {}
+        for name, fn in [('read everything', eager), ('lazy', lazy)]:
+            pool = multiprocessing.Pool(1)
+            results[name] = pool.apply(measure, [(fn, zip_name)])
+            pool.close()
+            pool.join()
+
+            elapsed, maxrss, parsed, held = results[name][:4]
+            print "%-16s time=%.3fs max rss=%dKB layers parsed=%d bytes held=%d" % (name, elapsed, maxrss, parsed, held)
+
+        a, b = results['read everything'], results['lazy']
+        assert a[4] == b[4], "bounds don't match"
+        assert a[5] == b[5], "geometry doesn't match"
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# What the layer cache saves: parsing a board's gerbers again for every preview against parsing them once, and
+# PCBProject.process_layers making the geometry against reading it back off disk.  Also checks the geometry comes
+# back the same and that the cache directory stays under max_bytes.
+
+import optparse
+import os
+import shutil
+import StringIO
+import tempfile
+
+import common
+from bench_gerber_union import synthetic_gerber
+from bench_process_layers import synthetic_drill, synthetic_outline
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(directory) for name in names)
+
+
+def process(files):
+    from lib.campy import PCBProject
+
+    pcb = PCBProject()
+    for file_name, data in files:
+        pcb.load_layer(file_name, StringIO.StringIO(data))
+
+    with common.Timer() as t:
+        pcb.process_layers()
+    return t.elapsed, pcb
+
+
+if __name__ == '__main__':
+    import gerber
+    from lib.campy import layercache
+
+    parser = optparse.OptionParser()
+    parser.add_option('--pads', help='Number of pads on each copper layer', type=int, default=1000)
+    parser.add_option('--holes', help='Number of holes', type=int, default=1000)
+    parser.add_option('--previews', help='Number of previews', type=int, default=5)
+    options, args = parser.parse_args()
+
+    files = [
+        ('board.gko', synthetic_outline(4, 3)),
+        ('board.drl', synthetic_drill(options.holes, 4, 3)),
+        ('board.gtl', synthetic_gerber(options.pads, 4, 3, seed=1)),
+        ('board.gbl', synthetic_gerber(options.pads, 4, 3, seed=2)),
+    ]
+
+    with common.Timer() as t:
+        for k in range(options.previews):
+            layers = [gerber.load_layer_data(data, file_name) for file_name, data in files]
+    uncached = t.elapsed
+
+    with common.Timer() as t:
+        for k in range(options.previews):
+            layers = [layercache.default.layer(data, file_name) for file_name, data in files]
+    print "previews=%d parse every time=%.3fs cached=%.3fs (%.1fx)" % (options.previews, uncached, t.elapsed, uncached / t.elapsed)
+
+    directory = tempfile.mkdtemp()
+    try:
+        layercache.default.directory = directory
+        layercache.default.layers.clear()
+        cold, a = process(files)
+        size = directory_size(directory)
+        warm, b = process(files)
+        print "process_layers cold=%.3fs warm=%.3fs (%.1fx) on disk=%d bytes" % (cold, warm, cold / warm, size)
+
+        assert a.bounds == b.bounds, "cached layers have different bounds"
+        for k in a.layers:
+            assert a.layers[k]['geometry'].equals_exact(b.layers[k]['geometry'], 0), "%r doesn't match" % (k,)
+
+        # only room for some of it
+        layercache.default.max_bytes = size / 2
+        shutil.rmtree(directory)
+        process(files)
+        print "max_bytes=%d on disk=%d bytes" % (layercache.default.max_bytes, directory_size(directory))
+        assert directory_size(directory) <= layercache.default.max_bytes, "cache grew past max_bytes"
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# Time pcb_isolation_geometry takes to make every isolation pass for a wide outline_separation, re-offsetting the
+# copper for every pass and growing each pass out of the one before, and a check that no pass comes any closer to
+# the copper than it's meant to (less the error of approximating the arcs with 64 segments to a circle).
+
+import multiprocessing
+import optparse
+
+import common
+
+
+if __name__ == '__main__':
+    from lib.campy.operations.pcb import pcb_isolation_geometry
+    from lib.campy.tools import StraightRouterBit
+
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=500)
+    parser.add_option('--separation', help='outline_separation', type=float, default=0.2)
+    parser.add_option('--stepover', help='Percentage of the tool diameter', default='40%')
+    parser.add_option('--tool', help='Tool diameter', type=float, default=0.025)
+    parser.add_option('--tolerance', help='Simplify the copper this much first', type=float, default=0.0005)
+    parser.add_option('--processes', help='Worker processes', type=int, default=multiprocessing.cpu_count())
+    options, args = parser.parse_args()
+
+    m = common.setup_machine()
+    m.set_tool(StraightRouterBit(diameter=options.tool, tool_material='hss', flutes=2))
+    copper = common.synthetic_copper(count=options.features)
+
+    failed = False
+    full_time = None
+    for incremental, tolerance, processes in [
+        (False, None, None), (True, None, None), (True, options.tolerance, None), (True, options.tolerance, options.processes),
+    ]:
+        with common.Timer() as t:
+            geom, passes = pcb_isolation_geometry(
+                gerber_geometry=copper, stepover=options.stepover, outline_separation=options.separation, tool_radius=0,
+                incremental=incremental, tolerance=tolerance, processes=processes,
+            )
+
+        full_time = full_time or t.elapsed
+        step = options.separation / len(passes)
+        ok = all(p.boundary.distance(copper) >= (k + 1) * step * 0.998 for k, p in enumerate(passes))
+        failed = failed or not ok
+        print "incremental=%-5s tolerance=%-6s processes=%-4s passes=%d time=%.3fs (%.2fx) %s" % (
+            incremental, tolerance, processes, len(passes), t.elapsed, full_time / t.elapsed, 'ok' if ok else 'TOO CLOSE',
+        )
+
+    assert not failed, "a pass is closer to the copper than it should be"
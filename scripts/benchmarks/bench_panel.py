@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Time and output size of a panelized pcb_job when every board in the panel is made from scratch (the default),
+# when the first board's moves are copied for the rest, and when the first board is written as a subroutine
+# that's called for every board.  The subroutine files made in worker processes have to match the serial ones,
+# subroutine numbers included.
+
+import hashlib
+import optparse
+import os
+import shutil
+import tempfile
+
+import common
+
+
+def run(outdir, geom, holes, bounds, panel, subroutine=False, copy=False, processes=None):
+    from lib.campy import PCBProject, constants
+    from lib.campy.tools import StraightRouterBit
+
+    m = common.setup_machine()
+    pcb = PCBProject()
+    pcb.layers = {
+        ('top', 'copper'): {'geometry': geom},
+        ('both', 'drill'): {'geometry': holes},
+    }
+    pcb.bounds = bounds
+
+    with common.Timer() as t:
+        pcb.pcb_job(
+            output_directory=outdir, side='top', drill='top', cutout='top', posts='none',
+            iso_bit=common.iso_bit(), drill_bit=common.drill_bit(),
+            cutout_bit=StraightRouterBit(diameter=1/16., tool_material='hss', flutes=2),
+            outline_depth=0.005, outline_separation=0.020, panelx=panel, panely=panel,
+            thickness=1.7*constants.MM, panel_subroutine=subroutine, panel_copy=copy, processes=processes,
+        )
+
+    for file_name in m.files.keys():
+        m.close_file(file_name)
+
+    return t.elapsed, sum(os.path.getsize(os.path.join(outdir, name)) for name in os.listdir(outdir))
+
+
+def file_hashes(outdir):
+    return dict((name, hashlib.md5(open(os.path.join(outdir, name)).read()).hexdigest()) for name in os.listdir(outdir))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=500)
+    parser.add_option('--holes', help='Number of holes on the synthetic board', type=int, default=500)
+    parser.add_option('--panel', help='Boards in each direction', type=int, default=4)
+    options, args = parser.parse_args()
+
+    geom = common.synthetic_copper(count=options.features)
+    holes = common.synthetic_holes(count=options.holes)
+    minx, miny, maxx, maxy = geom.bounds
+    bounds = [minx, miny, maxx, maxy]
+
+    outdir = tempfile.mkdtemp()
+    try:
+        single, single_size = run(os.path.join(outdir, 'single'), geom, holes, bounds, 1)
+        print "single board             time=%.3fs size=%d" % (single, single_size)
+
+        every, every_size = run(os.path.join(outdir, 'every'), geom, holes, bounds, options.panel)
+        print "%dx%d, every board made   time=%.3fs size=%d" % (options.panel, options.panel, every, every_size)
+
+        copied, copied_size = run(os.path.join(outdir, 'copied'), geom, holes, bounds, options.panel, copy=True)
+        print "%dx%d, copied             time=%.3fs size=%d (%.1fx)" % (
+            options.panel, options.panel, copied, copied_size, every / copied,
+        )
+
+        sub, sub_size = run(os.path.join(outdir, 'subroutine'), geom, holes, bounds, options.panel, subroutine=True)
+        print "%dx%d, subroutine         time=%.3fs size=%d (%.1fx, %.1fx smaller)" % (
+            options.panel, options.panel, sub, sub_size, every / sub, every_size / float(sub_size),
+        )
+
+        run(os.path.join(outdir, 'parallel'), geom, holes, bounds, options.panel, subroutine=True, processes=2)
+        assert file_hashes(os.path.join(outdir, 'parallel')) == file_hashes(os.path.join(outdir, 'subroutine')), \
+            "subroutine files made in parallel don't match"
+    finally:
+        shutil.rmtree(outdir)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Wall time of a whole two sided, panelized pcb_job made serially and with worker processes, and a check that both
+# write exactly the same files.  Speedup is bounded by the number of cores and the biggest file.
+
+import hashlib
+import multiprocessing
+import optparse
+import os
+import shutil
+import tempfile
+
+import common
+
+
+def run(outdir, geom, holes, bounds, panel, processes):
+    from lib.campy import PCBProject, constants
+    from lib.campy.tools import StraightRouterBit
+
+    m = common.setup_machine()
+    pcb = PCBProject()
+    pcb.layers = {
+        ('top', 'copper'): {'geometry': geom},
+        ('bottom', 'copper'): {'geometry': geom},
+        ('both', 'drill'): {'geometry': holes},
+    }
+    pcb.bounds = bounds
+
+    with common.Timer() as t:
+        pcb.pcb_job(
+            output_directory=outdir, side='both', drill='top', cutout='top',
+            iso_bit=common.iso_bit(), drill_bit=common.drill_bit(),
+            cutout_bit=StraightRouterBit(diameter=1/16., tool_material='hss', flutes=2),
+            post_bit=StraightRouterBit(diameter=1/8., tool_material='hss', flutes=2),
+            outline_depth=0.005, outline_separation=0.020, panelx=panel, panely=panel, flip='x', posts='x',
+            fixture_width=10, thickness=1.7*constants.MM, processes=processes,
+        )
+
+    for file_name in m.files.keys():
+        m.close_file(file_name)
+
+    hashes = dict(
+        (name, hashlib.md5(open(os.path.join(outdir, name)).read()).hexdigest()) for name in os.listdir(outdir)
+    )
+    return t.elapsed, hashes
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=500)
+    parser.add_option('--holes', help='Number of holes on the synthetic board', type=int, default=500)
+    parser.add_option('--panel', help='Boards in each direction', type=int, default=2)
+    parser.add_option('--processes', help='Worker processes', type=int, default=multiprocessing.cpu_count())
+    options, args = parser.parse_args()
+
+    geom = common.synthetic_copper(count=options.features)
+    holes = common.synthetic_holes(count=options.holes)
+    minx, miny, maxx, maxy = geom.bounds
+    bounds = [minx, miny, maxx, maxy]
+
+    outdir = tempfile.mkdtemp()
+    try:
+        serial, serial_hashes = run(os.path.join(outdir, 'serial'), geom, holes, bounds, options.panel, None)
+        parallel, parallel_hashes = run(
+            os.path.join(outdir, 'parallel'), geom, holes, bounds, options.panel, options.processes,
+        )
+
+        print "files=%d serial=%.3fs processes=%d parallel=%.3fs (%.2fx)" % (
+            len(serial_hashes), serial, options.processes, parallel, serial / parallel,
+        )
+        assert serial_hashes == parallel_hashes, "parallel job wrote different files"
+    finally:
+        shutil.rmtree(outdir)
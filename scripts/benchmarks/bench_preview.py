@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Size and time of the toolpath preview render_cam makes, for panels with more and more moves: one <polyline> per
+# move (what it used to draw) against one path per kind of move drawn to the nearest pixel.  Also checks, for the
+# first (smallest) panel, that every move's ends are within half a pixel of the new path - the check is slow.
+
+import optparse
+import os
+import re
+import shutil
+import tempfile
+
+import common
+
+
+def record_job(outdir, geom, holes, bounds, panel):
+    from lib.campy import PCBProject, constants
+    from lib.campy.tools import StraightRouterBit
+
+    m = common.setup_machine(save_geoms=True)
+    pcb = PCBProject()
+    pcb.layers = {
+        ('top', 'copper'): {'geometry': geom},
+        ('both', 'drill'): {'geometry': holes},
+    }
+    pcb.bounds = bounds
+    pcb.pcb_job(
+        output_directory=outdir, side='top', drill='top', cutout='top', posts='none',
+        iso_bit=common.iso_bit(), drill_bit=common.drill_bit(),
+        cutout_bit=StraightRouterBit(diameter=1/16., tool_material='hss', flutes=2),
+        outline_depth=0.005, outline_separation=0.020, panelx=panel, panely=panel, thickness=1.7*constants.MM,
+    )
+    for file_name in m.files.keys():
+        m.close_file(file_name)
+
+    return m.geometry
+
+
+def polylines(dwg, segments, foreground):
+    # what geometry.segments_add_to_dwg used to do
+    flipped = segments * (1, -1, 1, -1) + 0.
+    for x1, y1, x2, y2 in flipped.tolist():
+        dwg.add(dwg.polyline([(x1, y1), (x2, y2)], stroke=foreground, stroke_width=0.001))
+
+
+def preview(svg_file, recorder, width, height, old=False):
+    from lib.campy import geometry
+
+    bounds = geometry.segments_svg_bounds(recorder.segments())
+    dwg = geometry.shapely_get_dwg(svg_file=svg_file, bounds=bounds, marginpct=0, width=width, height=height, debug=old)
+    pixel = max(bounds['box_width'] / width, bounds['box_height'] / height)
+    for kind, color in [('goto', 'green'), ('cut', 'blue')]:
+        if old:
+            polylines(dwg, recorder.segments(kind), color)
+        else:
+            geometry.segments_add_to_dwg(
+                dwg, recorder.segments(kind), foreground=color, pixel=pixel, origin=(bounds['minx'], bounds['miny']),
+            )
+    dwg.save()
+    return os.path.getsize(svg_file)
+
+
+def check(recorder, width, height, tolerance=0.5):
+    import numpy
+    import shapely.geometry
+    from shapely.strtree import STRtree
+    from lib.campy import geometry
+
+    bounds = geometry.segments_svg_bounds(recorder.segments())
+    pixel = max(bounds['box_width'] / width, bounds['box_height'] / height)
+    origin = (bounds['minx'], bounds['miny'])
+    segments = recorder.segments('cut')
+
+    lines, x, y = [], 0, 0
+    path = geometry.segments_path_data(segments, pixel, origin, tolerance=tolerance)
+    for move, dx, dy in re.findall(r'(m?)(-?\d+) (-?\d+)', path):
+        x, y = x + int(dx), y + int(dy)
+        if move:
+            lines.append([])
+        lines[-1].append((x, y))
+    drawn = [shapely.geometry.LineString(pair) for l in lines for pair in zip(l[:-1], l[1:])]
+    tree = STRtree(drawn)
+
+    # every end of a move on the pixel grid is within tolerance of something drawn
+    q = numpy.rint((segments * (1, -1, 1, -1) - origin * 2) / pixel)
+    q = q[(q[:, :2] != q[:, 2:]).any(axis=1)]
+    missing = 0
+    for x, y in numpy.unique(q.reshape(-1, 2), axis=0):
+        pt = shapely.geometry.Point(x, y)
+        missing += not any(line.distance(pt) <= tolerance + 1e-9 for line in tree.query(pt.buffer(tolerance * 2)))
+    assert not missing, "%d points aren't drawn" % (missing,)
+    return len(segments), len(path.split(' ')) / 2
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=300)
+    parser.add_option('--holes', help='Number of holes on the synthetic board', type=int, default=300)
+    parser.add_option('--panels', help='Panel sizes to try', default='1,2,4')
+    parser.add_option('--size', help='Preview width and height', type=int, default=800)
+    options, args = parser.parse_args()
+
+    geom = common.synthetic_copper(count=options.features, width=2, height=1.5)
+    holes = common.synthetic_holes(count=options.holes, width=2, height=1.5)
+    minx, miny, maxx, maxy = geom.bounds
+    bounds = [minx, miny, maxx, maxy]
+
+    outdir = tempfile.mkdtemp()
+    try:
+        for k, panel in enumerate([int(x) for x in options.panels.split(',')]):
+            recorder = record_job(os.path.join(outdir, 'job%d' % panel), geom, holes, bounds, panel)
+            svg_file = os.path.join(outdir, 'preview%d.svg' % panel)
+
+            with common.Timer() as old_time:
+                old_size = preview(svg_file, recorder, options.size, options.size, old=True)
+            with common.Timer() as new_time:
+                new_size = preview(svg_file, recorder, options.size, options.size)
+
+            print "panel=%dx%d moves=%d polylines=%.3fs %dKB paths=%.3fs %dKB (%.0fx smaller)" % (
+                panel, panel, len(recorder), old_time.elapsed, old_size / 1024, new_time.elapsed, new_size / 1024,
+                old_size / float(new_size),
+            )
+
+            if k == 0:
+                check(recorder, options.size, options.size)
+    finally:
+        shutil.rmtree(outdir)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# Time for PCBProject.process_layers to turn a board's gerbers (outline, drills, both copper layers) into geometry,
+# one layer at a time and with worker processes, and a check that both give the same layers and bounds.  Speedup is
+# bounded by the number of cores and the slowest layer, usually the busier copper layer.
+
+import multiprocessing
+import optparse
+import random
+import StringIO
+
+import common
+from bench_gerber_union import synthetic_gerber
+
+
+def synthetic_outline(width, height):
+    return '\n'.join([
+        '%FSLAX24Y24*%', '%MOIN*%', '%ADD10C,0.0100*%', 'D10*',
+        'X000000Y000000D02*', 'X%06dY000000D01*' % (width * 10000), 'X%06dY%06dD01*' % (width * 10000, height * 10000),
+        'X000000Y%06dD01*' % (height * 10000), 'X000000Y000000D01*', 'M02*',
+    ]) + '\n'
+
+
+def synthetic_drill(count, width, height, seed=1):
+    r = random.Random(seed)
+    lines = ['M48', 'INCH', 'T1C0.0300', 'T2C0.0400', '%']
+    for tool in ('T1', 'T2'):
+        lines.append(tool)
+        lines += ['X%.4fY%.4f' % (r.uniform(0, width), r.uniform(0, height)) for i in range(count / 2)]
+
+    lines.append('M30')
+    return '\n'.join(lines) + '\n'
+
+
+def load(files, processes):
+    from lib.campy import PCBProject
+
+    pcb = PCBProject()
+    for file_name, data in files:
+        pcb.load_layer(file_name, StringIO.StringIO(data))
+
+    with common.Timer() as t:
+        pcb.process_layers(processes=processes)
+    return t.elapsed, pcb
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--pads', help='Number of pads on each copper layer', type=int, default=1000)
+    parser.add_option('--holes', help='Number of holes', type=int, default=1000)
+    parser.add_option('--processes', help='Worker processes', type=int, default=multiprocessing.cpu_count())
+    options, args = parser.parse_args()
+
+    width, height = 4.0, 3.0
+    files = [
+        ('board.gko', synthetic_outline(width, height)),
+        ('board.drl', synthetic_drill(options.holes, width, height)),
+        ('board.gtl', synthetic_gerber(options.pads, width, height, seed=1)),
+        ('board.gbl', synthetic_gerber(options.pads / 2, width, height, seed=2)),
+    ]
+
+    serial, a = load(files, None)
+    parallel, b = load(files, options.processes)
+    print "layers=%d serial=%.3fs processes=%d parallel=%.3fs (%.2fx)" % (
+        len(a.layers), serial, options.processes, parallel, serial / parallel,
+    )
+
+    assert a.bounds == b.bounds, "parallel layers have different bounds"
+    for k in a.layers:
+        assert a.layers[k]['geometry'].equals_exact(b.layers[k]['geometry'], 1e-9), "%r doesn't match" % (k,)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# What single flight saves when a board is first opened and several previews ask for the same thing at once: every
+# caller that misses running the function itself (lock_wait=0 - what CacheBase used to do) against one caller per
+# key running it and the rest waiting for what it cached.  Callers are threads in one process and then processes
+# sharing a PickleCache directory, like gunicorn workers.
+
+import multiprocessing
+import optparse
+import shutil
+import tempfile
+import threading
+import time
+
+import common
+
+calls = multiprocessing.Value('i', 0)
+
+
+def make_cached(directory, seconds, lock_wait):
+    from lib import cache
+
+    @cache.PickleCache(prefix='bench', timeout=60, basedir=directory, lock_wait=lock_wait, lock_poll=0.05)
+    def preview(board=None):
+        with calls.get_lock():
+            calls.value += 1
+        # stands in for rendering - sleeping rather than busy so callers overlap on one CPU too
+        time.sleep(seconds)
+        return 'svg for board %d' % board
+
+    return preview
+
+
+def process_caller(args):
+    directory, seconds, lock_wait, board = args
+    return make_cached(directory, seconds, lock_wait)(board=board)
+
+
+def run(callers, boards, seconds, lock_wait, processes=False):
+    directory = tempfile.mkdtemp()
+    calls.value = 0
+    try:
+        work = [k % boards for k in range(callers)]
+        with common.Timer() as t:
+            if processes:
+                pool = multiprocessing.Pool(callers)
+                results = pool.map(process_caller, [(directory, seconds, lock_wait, board) for board in work])
+                pool.close()
+                pool.join()
+            else:
+                preview = make_cached(directory, seconds, lock_wait)
+                results = [None] * callers
+
+                def caller(k):
+                    results[k] = preview(board=work[k])
+
+                threads = [threading.Thread(target=caller, args=(k,)) for k in range(callers)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+        assert results == ['svg for board %d' % board for board in work], "callers got the wrong previews"
+        return t.elapsed, calls.value
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--callers', help='Number of callers at once', type=int, default=8)
+    parser.add_option('--boards', help='Number of different boards they ask for', type=int, default=2)
+    parser.add_option('--seconds', help='How long making each preview takes', type=float, default=1.0)
+    options, args = parser.parse_args()
+
+    for processes in [False, True]:
+        for name, lock_wait in [('every caller', 0), ('single flight', 300)]:
+            elapsed, made = run(options.callers, options.boards, options.seconds, lock_wait, processes=processes)
+            print "%-9s %-13s callers=%d boards=%d time=%.3fs previews made=%d" % (
+                'processes' if processes else 'threads', name, options.callers, options.boards, elapsed, made,
+            )
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# What pcb_job stages save when a job is run again with one parameter changed: every file made from scratch (what
+# pcb_job used to do) against only remaking the files, and isolation offsets, that the parameter goes into.  The
+# files have to come out the same either way, and when a serial run uses what a parallel one kept or the other way
+# round.
+
+import hashlib
+import optparse
+import os
+import shutil
+import tempfile
+
+import common
+
+
+def run(outdir, geom, holes, bounds, stages=None, **kwargs):
+    from lib.campy import PCBProject, constants
+    from lib.campy.tools import StraightRouterBit
+
+    m = common.setup_machine()
+    pcb = PCBProject()
+    pcb.layers = {
+        ('top', 'copper'): {'geometry': geom},
+        ('both', 'drill'): {'geometry': holes},
+    }
+    pcb.bounds = bounds
+
+    job = dict(
+        output_directory=outdir, side='top', drill='top', cutout='top', posts='none',
+        iso_bit=common.iso_bit(), drill_bit=common.drill_bit(),
+        cutout_bit=StraightRouterBit(diameter=1/16., tool_material='hss', flutes=2),
+        outline_depth=0.005, outline_separation=0.020, thickness=1.7*constants.MM, optimize_travel=True,
+    )
+    job.update(kwargs)
+
+    with common.Timer() as t:
+        pcb.pcb_job(stages=stages, **job)
+
+    for file_name in m.files.keys():
+        m.close_file(file_name)
+
+    return t.elapsed, dict((name, hashlib.md5(open(os.path.join(outdir, name)).read()).hexdigest()) for name in os.listdir(outdir))
+
+
+if __name__ == '__main__':
+    from lib.campy.stages import StageCache
+    from lib.campy.tools import StraightRouterBit
+
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=1000)
+    parser.add_option('--holes', help='Number of holes on the synthetic board', type=int, default=1000)
+    options, args = parser.parse_args()
+
+    geom = common.synthetic_copper(count=options.features)
+    holes = common.synthetic_holes(count=options.holes)
+    minx, miny, maxx, maxy = geom.bounds
+    bounds = [minx, miny, maxx, maxy]
+
+    changes = [
+        ('same parameters', {}),
+        ('new drill bit', dict(drill_bit=StraightRouterBit(diameter=0.035, tool_material='hss', flutes=2))),
+        ('arcs fitted', dict(arc_tolerance=0.0005)),
+        # the iso bit is a V so this changes the offsets too
+        ('new outline_depth', dict(outline_depth=0.004)),
+    ]
+
+    outdir = tempfile.mkdtemp()
+    try:
+        stages = StageCache()
+        first, files = run(os.path.join(outdir, 'first'), geom, holes, bounds, stages=stages)
+        print "%-20s time=%.3fs" % ('first run', first)
+
+        for k, (name, kwargs) in enumerate(changes):
+            plain, expected = run(os.path.join(outdir, 'plain%d' % k), geom, holes, bounds, **kwargs)
+            hits = dict(stages.hits)
+            staged, files = run(os.path.join(outdir, 'staged%d' % k), geom, holes, bounds, stages=stages, **kwargs)
+            print "%-20s every stage=%.3fs staged=%.3fs (%.1fx) reused %s" % (
+                name, plain, staged, plain / staged,
+                ", ".join("%s=%d" % (s, stages.hits[s] - hits.get(s, 0)) for s in sorted(stages.hits)),
+            )
+            assert files == expected, "%s: staged files don't match" % (name,)
+
+        plain, expected = run(os.path.join(outdir, 'plain'), geom, holes, bounds)
+        for name, first, second in [('parallel then serial', 2, None), ('serial then parallel', None, 2)]:
+            stages = StageCache()
+            run(os.path.join(outdir, name + ' 1'), geom, holes, bounds, stages=stages, processes=first)
+            staged, files = run(os.path.join(outdir, name + ' 2'), geom, holes, bounds, stages=stages, processes=second)
+            print "%-20s reused %s" % (name, ", ".join("%s=%d" % (s, stages.hits[s]) for s in sorted(stages.hits)))
+            assert files == expected, "%s: files don't match" % (name,)
+    finally:
+        shutil.rmtree(outdir)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Time and size of shapely_to_svg for more and more geometries - pads with holes, traces and points: flipping every
+# geometry with shapely.affinity and adding an svg element for every polygon, hole, line and point (what it used to
+# do) against what it does by default now, reading all the coordinates into arrays at once and drawing one path for
+# the fills and one for the lines.  Also times shapely_svg_bounds, which unbatched drawing still uses, against
+# flipping every geometry first, and checks the bounds come out the same and nothing is left out of the paths.
+
+import optparse
+import os
+import random
+import shutil
+import tempfile
+
+import common
+
+
+def synthetic_geoms(count, width=4.0, height=3.0, seed=1):
+    import shapely.geometry
+
+    r = random.Random(seed)
+    geoms = []
+    for k in range(count):
+        x, y = r.uniform(0, width), r.uniform(0, height)
+        if k % 3 == 0:
+            geoms.append(shapely.geometry.Point(x, y).buffer(0.03, 4).difference(shapely.geometry.Point(x, y).buffer(0.01, 2)))
+        elif k % 3 == 1:
+            geoms.append(shapely.geometry.LineString([(x, y), (x + r.uniform(-0.2, 0.2), y + r.uniform(-0.2, 0.2))]))
+        else:
+            geoms.append(shapely.geometry.Point(x, y, 0.01))
+    return geoms
+
+
+def old_svg_bounds(geoms):
+    import shapely.affinity
+
+    # what shapely_svg_bounds used to do
+    geoms = [shapely.affinity.scale(g, yfact=-1, origin=(0, 0)) for g in geoms]
+    minx, miny, maxx, maxy = geoms[0].bounds
+    for g in geoms[1:]:
+        tminx, tminy, tmaxx, tmaxy = g.bounds
+        minx, miny, maxx, maxy = min(minx, tminx), min(miny, tminy), max(maxx, tmaxx), max(maxy, tmaxy)
+    return {'minx': minx, 'miny': miny, 'maxx': maxx, 'maxy': maxy, 'box_width': maxx - minx, 'box_height': maxy - miny}
+
+
+def to_svg(svg_file, geoms, old=False):
+    from lib.campy import geometry
+
+    if not old:
+        geometry.shapely_to_svg(svg_file, geoms, batch=True)
+        return os.path.getsize(svg_file)
+
+    dwg = geometry.shapely_get_dwg(svg_file=svg_file, bounds=old_svg_bounds(geoms), marginpct=10, width=1000, height=1000)
+    geometry.shapely_add_to_dwg(dwg=dwg, geoms=geoms)
+    dwg.save()
+    return os.path.getsize(svg_file)
+
+
+if __name__ == '__main__':
+    from lib.campy import geometry
+
+    parser = optparse.OptionParser()
+    parser.add_option('--counts', help='Numbers of geometries to try', default='1000,10000,100000')
+    parser.add_option('--old-limit', help="Don't time the old way past this many geometries", type=int, default=100000)
+    options, args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        for count in [int(x) for x in options.counts.split(',')]:
+            geoms = synthetic_geoms(count)
+            svg_file = os.path.join(directory, 'geoms%d.svg' % count)
+
+            with common.Timer() as new_time:
+                new_size = to_svg(svg_file, geoms)
+            line = "geometries=%d arrays=%.3fs %dKB" % (count, new_time.elapsed, new_size / 1024)
+
+            if count <= options.old_limit:
+                with common.Timer() as old_time:
+                    old_size = to_svg(svg_file, geoms, old=True)
+                line += " element each=%.3fs %dKB (%.1fx faster)" % (
+                    old_time.elapsed, old_size / 1024, old_time.elapsed / new_time.elapsed,
+                )
+            with common.Timer() as bounds_time:
+                bounds = geometry.shapely_svg_bounds(geoms)
+            line += " bounds=%.3fs" % bounds_time.elapsed
+            if count <= options.old_limit:
+                with common.Timer() as old_bounds_time:
+                    old_bounds = old_svg_bounds(geoms)
+                line += " flipped first=%.3fs" % old_bounds_time.elapsed
+                assert bounds == old_bounds, "bounds don't match"
+            print line
+
+            # a subpath for every ring and point, and for every line
+            fill, lines = geometry.shapely_path_data(geoms)
+            rings = sum(1 + len(g.interiors) for g in geoms if g.geom_type == 'Polygon')
+            points = sum(1 for g in geoms if g.geom_type == 'Point')
+            assert fill.count('M') == rings + points, "%d rings and points but %d subpaths" % (rings + points, fill.count('M'))
+            assert lines.count('M') == sum(1 for g in geoms if g.geom_type == 'LineString'), "lines are missing"
+    finally:
+        shutil.rmtree(directory)
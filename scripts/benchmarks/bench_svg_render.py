@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# Time and size of the board preview render_svg makes: an svg element for every primitive, written to a temporary
+# file and read back (what it used to do), against GerberSVGContext(batch=True) putting each run of same coloured
+# primitives into one path and making the svg in memory.  Also checks every primitive made it into a path, painted
+# in the same order of colours.
+
+import base64
+import optparse
+import re
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+import common
+from bench_gerber_union import synthetic_gerber
+from bench_process_layers import synthetic_drill, synthetic_outline
+
+
+def render(layers, size, batch=False):
+    from gerber.render import theme
+    from lib.campy.operations.pcb import GerberSVGContext
+
+    if not batch:
+        with tempfile.NamedTemporaryFile(delete=True) as tf:
+            ctx = GerberSVGContext(svg_file=tf.name, width=size, height=size)
+            ctx.render_layers(layers, theme=theme.THEMES['default'])
+            ctx.save()
+            return base64.b64encode(open(tf.name).read())
+
+    ctx = GerberSVGContext(width=size, height=size, batch=True)
+    ctx.render_layers(layers, theme=theme.THEMES['default'])
+    return base64.b64encode(ctx.tostring())
+
+
+def masks(data):
+    svg = ElementTree.fromstring(base64.b64decode(data))
+    return [m for m in svg.iter() if m.tag.endswith('mask')]
+
+
+def check(old, new):
+    for a, b in zip(masks(old), masks(new)):
+        colors = [e.get('fill') if e.get('fill') not in (None, 'none') else e.get('stroke') for e in list(a)[1:]]
+        runs = [c for k, c in enumerate(colors) if k == 0 or colors[k - 1] != c]
+        # a run can be a fill path and a stroke path
+        new_colors = [e.get('fill') if e.get('fill') != 'none' else e.get('stroke') for e in list(b)[1:]]
+        new_runs = [c for k, c in enumerate(new_colors) if k == 0 or new_colors[k - 1] != c]
+        assert runs == new_runs, "colours are painted in a different order"
+
+        subpaths = sum(len(re.findall('M', e.get('d'))) for e in list(b)[1:])
+        assert subpaths == len(a) - 1, "%d primitives but %d subpaths" % (len(a) - 1, subpaths)
+
+
+if __name__ == '__main__':
+    import gerber
+
+    parser = optparse.OptionParser()
+    parser.add_option('--pads', help='Numbers of pads on the copper layer to try', default='1000,4000')
+    parser.add_option('--size', help='Preview width and height', type=int, default=700)
+    options, args = parser.parse_args()
+
+    for pads in [int(x) for x in options.pads.split(',')]:
+        layers = [
+            gerber.load_layer_data(synthetic_outline(4, 3), 'board.gko'),
+            gerber.load_layer_data(synthetic_gerber(pads, 4, 3, seed=1), 'board.gtl'),
+            gerber.load_layer_data(synthetic_drill(pads, 4, 3), 'board.drl'),
+        ]
+
+        with common.Timer() as old_time:
+            old = render(layers, options.size)
+        with common.Timer() as new_time:
+            new = render(layers, options.size, batch=True)
+
+        print "pads=%d element each=%.3fs %dKB batched=%.3fs %dKB (%.1fx faster, %.1fx smaller)" % (
+            pads, old_time.elapsed, len(old) / 1024, new_time.elapsed, len(new) / 1024,
+            old_time.elapsed / new_time.elapsed, len(old) / float(len(new)),
+        )
+        check(old, new)
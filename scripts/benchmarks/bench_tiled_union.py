@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Renders a large synthetic copper layer with the serial batched union and with tiled unions of a few tile sizes,
+# and checks the tiled results are valid and the same shape as the serial one: the areas have to match to within
+# --tolerance (relative) and random points have to land inside both or neither.  A symmetric difference would be a
+# more direct check, but on layers this big it takes longer than the unions.
+
+import multiprocessing
+import optparse
+import random
+
+import common
+from bench_gerber_union import synthetic_gerber
+
+
+def same_shape(a, b, tolerance, samples=20000, seed=1):
+    from shapely.geometry import Point
+    from shapely.prepared import prep
+
+    if not b.is_valid or abs(a.area - b.area) > tolerance * a.area:
+        return False
+
+    r = random.Random(seed)
+    minx, miny, maxx, maxy = a.bounds
+    pa, pb = prep(a), prep(b)
+    for i in range(samples):
+        p = Point(r.uniform(minx, maxx), r.uniform(miny, maxy))
+        if pa.contains(p) != pb.contains(p):
+            return False
+
+    return True
+
+
+if __name__ == '__main__':
+    from lib.campy.operations.pcb import GerberGeometryContext, pcb_layer
+
+    parser = optparse.OptionParser()
+    parser.add_option('--pads', help='Number of pads', type=int, default=3000)
+    parser.add_option('--size', help='Board width in inches, height is 3/4 of that', type=float, default=16)
+    parser.add_option('--tiles', help='Comma separated tile sizes', default='8,4,2')
+    parser.add_option('--processes', help='Worker processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_option('--tolerance', help='Allowed difference, relative to the area', type=float, default=1e-9)
+    options, args = parser.parse_args()
+
+    layer = pcb_layer(
+        gerber_data=synthetic_gerber(options.pads, width=options.size, height=options.size * .75, trace_length=0.5),
+        gerber_file='synthetic.gbr',
+    )
+
+    with common.Timer() as t:
+        serial = GerberGeometryContext().render_layer(layer)
+    print "serial                      primitives=%d time=%.3fs area=%.6f" % (
+        len(layer.primitives), t.elapsed, serial.area,
+    )
+
+    failed = False
+    for tile_size in [float(s) for s in options.tiles.split(',')]:
+        with common.Timer() as t:
+            tiled = GerberGeometryContext(tile_size=tile_size, processes=options.processes).render_layer(layer)
+
+        ok = same_shape(serial, tiled, options.tolerance)
+        failed = failed or not ok
+        print "tile_size=%-5s processes=%-3d time=%.3fs area=%.6f %s" % (
+            tile_size, options.processes, t.elapsed, tiled.area, 'ok' if ok else 'FAILED',
+        )
+
+    assert not failed, "tiled union doesn't match the serial union"
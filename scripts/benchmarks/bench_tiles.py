@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# What the tile pyramid saves on repeat views: rendering the whole board to a PNG for every view (what PCBApi.render
+# does) against tiles made on first view and read back after, at a few zoom levels.  Needs cairo.  Also times what
+# a band costs once it's been rendered - every tile of every level cut out of the image and written as a PNG, halving
+# it between levels - on a board-like image, which doesn't need cairo and is all that's run without it.
+
+import optparse
+import random
+import shutil
+import tempfile
+
+import common
+from bench_gerber_union import synthetic_gerber
+from bench_process_layers import synthetic_drill, synthetic_outline
+
+
+def full_render(layers):
+    from gerber.render import RenderSettings, theme
+    from gerber.render.cairo_backend import GerberCairoContext
+
+    rtheme = theme.THEMES['OSH Park']
+    ctx = GerberCairoContext()
+    for layer in layers:
+        ctx.render_layer(layer, settings=rtheme.get(layer.layer_class, RenderSettings()), bgsettings=rtheme['background'])
+    return len(ctx.dump_str())
+
+
+# background, with pads_per_tile copper and drill coloured rectangles to a tile_size tile, and the size a band is
+# rendered at
+def board_image(size, tile_size, pads_per_tile, seed=1):
+    import numpy
+
+    r = random.Random(seed)
+    image = numpy.empty((size, size, 3), numpy.uint8)
+    image[:] = (60, 18, 100)
+    for k in range(pads_per_tile * (size // tile_size) ** 2):
+        x, y, w, h = r.randrange(size), r.randrange(size), r.randint(2, 24), r.randint(2, 24)
+        image[y:y + h, x:x + w] = (190, 140, 60) if k % 4 else (0, 0, 0)
+    return image
+
+
+# what TilePyramid._render_band does with its render, returns the bytes of PNG written
+def cut_band(image, tile_size):
+    from lib.campy import tiles
+
+    written = 0
+    while True:
+        count = image.shape[0] // tile_size
+        for x in range(count):
+            for y in range(count):
+                written += len(tiles._crop(image, x * tile_size, y * tile_size, tile_size))
+        if count == 1:
+            return written
+        image = tiles._halve(image)
+
+
+def view(pyramid, key, layers, z):
+    # the tiles a viewer at level z shows: all of them, up to 4x4
+    count = min(2 ** z, 4)
+    return sum(len(pyramid.tile(key, z, x, y, lambda: layers)) for x in range(count) for y in range(count))
+
+
+if __name__ == '__main__':
+    import gerber
+    from lib.campy import tiles
+
+    parser = optparse.OptionParser()
+    parser.add_option('--pads', help='Number of pads on the copper layer', type=int, default=2000)
+    parser.add_option('--views', help='Number of times each view is looked at', type=int, default=5)
+    parser.add_option('--bands', help='Comma separated band levels to time cutting up', default='1,2,3,4')
+    options, args = parser.parse_args()
+
+    for band_levels in [int(b) for b in options.bands.split(',')]:
+        image = board_image(256 * 2 ** (band_levels - 1), 256, 20)
+        with common.Timer() as t:
+            written = cut_band(image, 256)
+        tile_count = sum(4 ** level for level in range(band_levels))
+        print "band of %d levels, %dpx: cut into %d tiles in %.3fs, %.1fms a tile, %d bytes of PNG" % (
+            band_levels, image.shape[0], tile_count, t.elapsed, 1000 * t.elapsed / tile_count, written,
+        )
+
+    try:
+        tiles._cairo()
+    except (ImportError, OSError) as e:
+        print "no cairo (%s), not timing renders" % e
+        raise SystemExit(0)
+
+    layers = [
+        gerber.load_layer_data(synthetic_gerber(options.pads, 4, 3, seed=1), 'board.gtl'),
+        gerber.load_layer_data(synthetic_drill(options.pads, 4, 3), 'board.drl'),
+        gerber.load_layer_data(synthetic_outline(4, 3), 'board.gko'),
+    ]
+
+    with common.Timer() as t:
+        for k in range(options.views):
+            full_render(layers)
+    print "whole board every view: %.3fs a view" % (t.elapsed / options.views)
+
+    directory = tempfile.mkdtemp()
+    try:
+        pyramid = tiles.TilePyramid(directory=directory)
+        key = pyramid.key('bench', options.pads)
+        for z in [0, 1, 2, 3, 4]:
+            with common.Timer() as first:
+                view(pyramid, key, layers, z)
+            with common.Timer() as again:
+                for k in range(options.views - 1):
+                    view(pyramid, key, layers, z)
+            print "level %d: first view=%.3fs after that=%.4fs a view" % (
+                z, first.elapsed, again.elapsed / max(options.views - 1, 1),
+            )
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+# Rapid travel between isolation rings with and without optimize.order_rings.  Rings are the exteriors and interiors
+# of a synthetic copper layer, which is what pcb_isolation_mill ends up cutting (one set per offset pass).
+
+import optparse
+
+import common
+
+
+def rings_for(geom):
+    rings = []
+    for p in geom:
+        rings.append(list(p.exterior.coords))
+        for i in p.interiors:
+            rings.append(list(i.coords))
+    return rings
+
+
+if __name__ == '__main__':
+    from lib.campy import optimize
+
+    parser = optparse.OptionParser()
+    parser.add_option('--features', help='Number of pads/traces on the synthetic board', type=int, default=3000)
+    parser.add_option('--passes', help='2-opt passes', type=int, default=10)
+    options, args = parser.parse_args()
+
+    rings = rings_for(common.synthetic_copper(count=options.features))
+
+    with common.Timer() as t:
+        ordered, stats = optimize.order_rings(rings, two_opt_passes=options.passes)
+
+    with common.Timer() as t2:
+        again, stats2 = optimize.order_rings(rings, two_opt_passes=options.passes)
+
+    print "rings=%d travel before=%.3f after=%.3f saved=%.3f (%.1f%%)" % (
+        stats['rings'], stats['travel_before'], stats['travel_after'], stats['travel_saved'],
+        100. * stats['travel_saved'] / stats['travel_before'] if stats['travel_before'] else 0,
+    )
+    print "order_rings %.3fs, repeat %.3fs, deterministic=%s" % (t.elapsed, t2.elapsed, again == ordered)
@@ -0,0 +1,75 @@
+# Shared helpers for the benchmark scripts in this directory.  Everything here builds synthetic boards so the
+# benchmarks can run without any real gerber files lying around.
+
+import os
+import random
+import sys
+import time
+
+basedir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src')
+sys.path.append(basedir)
+
+import shapely.geometry
+import shapely.ops
+
+
+def synthetic_copper(count=500, width=4.0, height=3.0, seed=1):
+    """Random mix of round pads, rectangular pads and traces, unioned like a rendered copper layer"""
+    r = random.Random(seed)
+    polys = []
+    for i in range(count):
+        x, y = r.uniform(0, width), r.uniform(0, height)
+        if i % 3 == 0:
+            polys.append(shapely.geometry.Point(x, y).buffer(0.03, resolution=16))
+        elif i % 3 == 1:
+            polys.append(shapely.geometry.box(x, y, x + 0.06, y + 0.04))
+        else:
+            x2 = min(max(x + r.uniform(-.4, .4), 0), width)
+            y2 = min(max(y + r.uniform(-.4, .4), 0), height)
+            polys.append(shapely.geometry.LineString([(x, y), (x2, y2)]).buffer(0.01, resolution=16))
+
+    geom = shapely.ops.unary_union(polys)
+    if isinstance(geom, shapely.geometry.Polygon):
+        geom = shapely.geometry.MultiPolygon([geom])
+
+    return geom
+
+
+def synthetic_holes(count=1000, width=4.0, height=3.0, sizes=(0.012, 0.015, 0.02, 0.035), seed=1):
+    """MultiPoint of holes in the same format as GerberDrillContext - (x, y, radius)"""
+    r = random.Random(seed)
+    return shapely.geometry.MultiPoint([
+        (r.uniform(0, width), r.uniform(0, height), r.choice(sizes)) for i in range(count)
+    ])
+
+
+def setup_machine(**kwargs):
+    from lib.campy import set_machine, Environment, machines
+
+    args = dict(machines['k2cnc'])
+    args.update(kwargs)
+    m = set_machine(Environment(**args))
+    m.set_material('fr4-1oz')
+    m.max_rpm = m.min_rpm = 15000
+    return m
+
+
+def iso_bit():
+    from lib.campy import constants
+    from lib.campy.tools import VRouterBit
+    return VRouterBit(included_angle=30.0, diameter=1/8., tip_diameter=0.1*constants.MM, tool_material='hss', flutes=1)
+
+
+def drill_bit():
+    from lib.campy import constants
+    from lib.campy.tools import StraightRouterBit
+    return StraightRouterBit(diameter=0.9*constants.MM, tool_material='hss', flutes=2)
+
+
+class Timer(object):
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.time() - self.start
@@ -1,9 +1,10 @@
 import base64
-from gerber.render.cairo_backend import GerberCairoContext
+import functools
 import json
 import tempfile
 from lib.api_framework import api_register, Api, FileResponse, api_bool, api_list, api_int, api_float
 from lib.campy import *
+from lib.campy import estimate, layercache, stages, tiles
 import shutil
 import time
 from lib.api_framework import OurJSONEncoder
@@ -12,7 +13,27 @@ from . import queries, projects
 
 logger = logging.getLogger(__name__)
 
-from lib import cache
+from lib import cache, config
+
+# worker processes for parsing and rendering gerber layers, unset does them one at a time
+layer_processes = int(config.get_config_key('layer_processes') or 0) or None
+
+# worker processes pcb_job makes a job's files in, unset makes them one at a time.  render_cam's processes overrides it
+job_processes = int(config.get_config_key('job_processes') or 0) or None
+
+# parsed layers and their geometry, by file contents - see lib.campy.layercache
+layercache.default.directory = config.get_config_key('layer_cache_dir') or '/srv/data/file_cache/layers'
+layercache.default.max_bytes = int(config.get_config_key('layer_cache_bytes') or layercache.default.max_bytes)
+
+# raster tiles of boards, by project, date modified, side and layers - see lib.campy.tiles
+tiles.default.directory = config.get_config_key('tile_cache_dir') or '/srv/data/file_cache/tiles'
+tiles.default.max_bytes = int(config.get_config_key('tile_cache_bytes') or tiles.default.max_bytes)
+
+# pcb_job's files and isolation offsets, by what each of them depends on - see lib.campy.stages.  A job that only
+# changes some of the parameters only remakes the files those parameters go into
+pcb_stages = stages.StageCache(
+    store=cache.PickleCache(prefix='pcb_stages', timeout=60*60*24*7, basedir='/srv/data/file_cache'),
+)
 
 
 @cache.PickleCache(
@@ -64,19 +85,18 @@ def render_svg_generator(
 
         render_layers.append(mapkey)
 
-    with tempfile.NamedTemporaryFile(delete=True) as tf:
-        ctx = GerberSVGContext(svg_file=tf.name, width=max_width, height=max_height, flipx=side == 'bottom')
-        ctx.render_layers([pcb.get_layer(x) for x in render_layers], theme=theme.THEMES[theme_name])
-        ctx.save()
-
-        if encode:
-            data = base64.b64encode(open(tf.name).read())
-            return data
-        else:
-            return FileResponse(
-                content=open(tf.name),
-                content_type='image/svg+xml',
-            )
+    # one path per colour and stroke width rather than an element per primitive, made in memory
+    ctx = GerberSVGContext(width=max_width, height=max_height, flipx=side == 'bottom', batch=True)
+    ctx.render_layers([pcb.get_layer(x) for x in render_layers], theme=theme.THEMES[theme_name])
+    svg = ctx.tostring()
+
+    if encode:
+        return base64.b64encode(svg)
+    else:
+        return FileResponse(
+            content=svg,
+            content_type='image/svg+xml',
+        )
 
 
 @cache.PickleCache(
@@ -109,7 +129,7 @@ def pcb_load_and_process(project_id=None, date_modified=None, files=None):
         logger.warn("loading %r", mapkey)
         pcb.load_layer(fmap[mapkey]['file_name'], projects.project_files.get_fobj(project_file=fmap[mapkey]))
 
-    pcb.process_layers()
+    pcb.process_layers(processes=layer_processes)
     return pcb
 
 
@@ -142,7 +162,7 @@ class PCBApi(Api):
                 # fixture_width=fixture_width,
             )
 
-        machine = set_machine('k2cnc')
+        machine = Environment(**machines['k2cnc'])
         machine.set_material('fr4-1oz')
         machine.max_rpm = machine.min_rpm = 15000
 
@@ -156,6 +176,7 @@ class PCBApi(Api):
         outdir = tempfile.mkdtemp()
 
         pcb.pcb_job(
+            _machine=machine,
             drill='top',
             cutout='top',
             # iso_bit='engrave-0.01in-15',
@@ -224,7 +245,7 @@ class PCBApi(Api):
             posts=posts,
         )
 
-        machine = set_machine('k2cnc')
+        machine = Environment(**machines['k2cnc'])
         machine.set_material('fr4-1oz')
         machine.max_rpm = machine.min_rpm = 15000
 
@@ -238,6 +259,7 @@ class PCBApi(Api):
         outdir = tempfile.mkdtemp()
 
         pcb.pcb_job(
+            _machine=machine,
             drill='top',
             cutout='top',
             # iso_bit='engrave-0.01in-15',
@@ -290,6 +312,8 @@ class PCBApi(Api):
         if not p:
             raise cls.NotFound()
 
+        # only here, so the rest of the api doesn't need cairo
+        from gerber.render.cairo_backend import GerberCairoContext
         ctx = GerberCairoContext()
 
         files = queries.project_files(project_id=p['project_id'], is_deleted=False)
@@ -319,7 +343,8 @@ class PCBApi(Api):
 
             frow = fmap[mapkey]
             file_name = projects.project_files.get(project_file=frow)
-            layer = gerber.load_layer(file_name)
+            with open(file_name) as f:
+                layer = pcb_layer(gerber_data=f.read(), gerber_file=frow['file_name'])
             rendered = True
             ctx.render_layer(
                 layer,
@@ -339,6 +364,71 @@ class PCBApi(Api):
                 )
 
 
+    # the layers render draws, bottom first, made from the project's files
+    @classmethod
+    def _render_layers(cls, project_id=None, side='top', layers=None):
+        fmap = {}
+        for frow in queries.project_files(project_id=project_id, is_deleted=False):
+            file_type = PCBProject.identify_file(frow['file_name'])
+            if file_type:
+                fmap[file_type] = frow
+
+        render_layers = []
+        for mapkey in [
+            (side, 'copper'),
+            (side, 'solder-mask'),
+            (side, 'silk-screen'),
+            ('both', 'drill'),
+            ('both', 'outline'),
+        ]:
+            if mapkey not in fmap or mapkey[1] not in layers:
+                continue
+
+            frow = fmap[mapkey]
+            with projects.project_files.get_fobj(project_file=frow) as fobj:
+                render_layers.append(pcb_layer(gerber_data=fobj.read(), gerber_file=frow['file_name']))
+
+        return render_layers
+
+    # Tiles of what render draws, made once each and then only read back: tile x, y of zoom level z, with level 0
+    # the whole board in one tile and each level after doubling the resolution - see lib.campy.tiles.  Without z
+    # it's the pyramid's bounds, tile_size and max_level
+    @classmethod
+    @Api.config(require_login=False)
+    def render_tile(cls, username=None, project_key=None, layers=None, side='top', z=None, x=0, y=0, encode=True, _user=None):
+        if project_key is None:
+            raise cls.BadRequest("project_key is a required field")
+
+        layers = sorted(set(api_list(layers))) if layers else ['copper', 'drill', 'outline', 'solder-mask']
+        encode = api_bool(encode)
+        p = queries.project(
+            project_key=project_key,
+            username=username,
+            viewing_user_id=_user.user_id,
+            allow_public=True,
+        )
+        if not p:
+            raise cls.NotFound()
+
+        key = tiles.TilePyramid.key(p['project_id'], p['date_modified'], side, layers)
+        make_layers = functools.partial(cls._render_layers, project_id=p['project_id'], side=side, layers=layers)
+        if z is None:
+            return tiles.default.info(key, make_layers)
+
+        z, x, y = api_int(z), api_int(x), api_int(y)
+        info = tiles.default.info(key, make_layers)
+        if not (0 <= z <= info['max_level'] and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise cls.NotFound()
+
+        data = tiles.default.tile(key, z, x, y, make_layers, theme=theme.THEMES['OSH Park'])
+        if encode:
+            return base64.b64encode(data)
+        else:
+            return FileResponse(
+                content=data,
+                content_type='image/png',
+            )
+
     @classmethod
     @Api.config(require_login=False)
     def render_svg(
@@ -424,8 +514,8 @@ class PCBApi(Api):
         cls, project_key=None, username=None, side='top',
         depth=0.005, separation=0.020, border=0, thickness=1.7*constants.MM, panelx=1, panely=1, zprobe_type='auto',
         posts='x', drill='top', cutout='top', iso_bit=None, drill_bit=None,
-        cutout_bit=None, post_bit=None,
-        max_width=800, max_height=800, _user=None,
+        cutout_bit=None, post_bit=None, optimize_travel=False, compact_gcode=False, arc_tolerance=None,
+        max_width=800, max_height=800, processes=None, _user=None,
     ):
         depth = api_float(depth)
         separation = api_float(separation)
@@ -435,6 +525,7 @@ class PCBApi(Api):
         panely = api_int(panely)
         max_width = api_int(max_width)
         max_height = api_int(max_height)
+        processes = api_int(processes) or job_processes
 
         if project_key is None:
             raise cls.BadRequest("project_key is a required field")
@@ -476,22 +567,42 @@ class PCBApi(Api):
             'side': side,
         }
 
+        # only part of the hash when it's on, so existing jobs keep their hashes
+        if api_bool(optimize_travel):
+            job_kwargs['optimize_travel'] = True
+        if api_bool(compact_gcode):
+            job_kwargs['compact_gcode'] = True
+        if arc_tolerance:
+            job_kwargs['arc_tolerance'] = api_float(arc_tolerance)
+
         job_hash = cache.arg_hash(**job_kwargs)
         job = queries.project_job(project_id=p['project_id'], job_hash=job_hash)
         logger.warn("looking for job, id=%r, hash=%r job=%r", p['project_id'], job_hash, job)
         if False or not job:
             job_id = cls._render_cam_internal(
-                project=p, job_kwargs=job_kwargs, max_width=max_width, max_height=max_height, job=job
+                project=p, job_kwargs=job_kwargs, max_width=max_width, max_height=max_height, job=job,
+                processes=processes,
             )
             job = queries.project_job(project_job_id=job_id)
         else:
             job_id = job['project_job_id'] if job else None
 
         job['files'] = queries.project_files(project_job_id=job_id, sort='file_name')
+
+        # cycle time estimate, older jobs won't have one
+        job['estimate'] = None
+        for f in job['files']:
+            if f['file_name'] == 'estimate.json':
+                with projects.project_files.get_fobj(project_file=f) as fobj:
+                    job['estimate'] = json.load(fobj)
+
         return job
 
     @classmethod
-    def _render_cam_internal(cls, project=None, job_kwargs=None, max_width=None, max_height=None, job=None):
+    # processes isn't in job_kwargs, the files come out the same however many processes make them
+    def _render_cam_internal(
+        cls, project=None, job_kwargs=None, max_width=None, max_height=None, job=None, processes=None,
+    ):
         if job:
             job_id = job['project_job_id']
         else:
@@ -502,9 +613,15 @@ class PCBApi(Api):
 
         files = queries.project_files(project_id=project['project_id'])
 
-        machine = set_machine('k2cnc')
+        # deferred so the estimator sees each file's moves (with the operations that made them) before they're written
+        machine = Environment(deferred=True, **machines['k2cnc'])
         machine.set_material('fr4-1oz')
         machine.max_rpm = machine.min_rpm = 1000
+        if job_kwargs.pop('compact_gcode', False):
+            machine.set_post(CompactGCodePost())
+
+        estimator = estimate.Estimator.for_machine(machine)
+        machine.add_pass(estimator.watch(machine))
 
         pcb = pcb_load_and_process(
             project_id=project['project_id'], date_modified=project['date_modified'],
@@ -522,22 +639,28 @@ class PCBApi(Api):
         for side in sides:
             outdir = tempfile.mkdtemp()
             machine.set_save_geoms(True)
-            pcb.pcb_job(output_directory=outdir, side=side, **job_kwargs)
+            pcb.pcb_job(
+                output_directory=outdir, side=side, _machine=machine, stages=pcb_stages, processes=processes, **job_kwargs
+            )
 
             with tempfile.NamedTemporaryFile(delete=True) as tf:
-                bounds = geometry.shapely_svg_bounds([x[0] for x in machine.geometry])
+                bounds = geometry.segments_svg_bounds(machine.geometry.segments())
 
                 dwg = geometry.shapely_get_dwg(svg_file=tf.name, bounds=bounds, marginpct=0, width=max_width,
-                                               height=max_height)
+                                               height=max_height, debug=False)
+
+                # drawn to the nearest pixel of the max_width x max_height image, one path for each kind of move
+                pixel = max(bounds['box_width'] / max_width, bounds['box_height'] / max_height) or 1
+                origin = (bounds['minx'], bounds['miny'])
 
                 # goto
-                geometry.shapely_add_to_dwg(
-                    dwg, geoms=[x[0] for x in machine.geometry if x[1] == 'goto'], foreground='green'
+                geometry.segments_add_to_dwg(
+                    dwg, machine.geometry.segments('goto'), foreground='green', pixel=pixel, origin=origin,
                 )
 
                 # cut
-                geometry.shapely_add_to_dwg(
-                    dwg, geoms=[x[0] for x in machine.geometry if x[1] == 'cut'], foreground='blue'
+                geometry.segments_add_to_dwg(
+                    dwg, machine.geometry.segments('cut'), foreground='blue', pixel=pixel, origin=origin,
                 )
 
                 dwg.save()
@@ -553,6 +676,14 @@ class PCBApi(Api):
 
             shutil.rmtree(outdir)
 
+        if isinstance(machine.post, CompactGCodePost):
+            logger.warn("compact G-code: %r", machine.post.stats())
+
+        projects.project_files.add(
+            project=project, project_job_id=job_id, contents=json.dumps(estimator.report(), cls=OurJSONEncoder),
+            file_name='estimate.json'
+        )
+
         projects.project_files.add(
             project=project, project_job_id=job_id, contents=json.dumps(job_kwargs, cls=OurJSONEncoder), file_name='params.json'
         )
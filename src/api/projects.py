@@ -1,8 +1,10 @@
 import boto3
 import datetime
+import hashlib
 import logging
 import os
 import pytz
+import tempfile
 import zipfile
 
 from lib.api_framework import api_register, Api, FileResponse
@@ -22,10 +24,14 @@ s3 = boto3.client(
 
 
 class FileStore(object):
+    # uploads and zip members are copied this much at a time, never read in whole
+    chunk_size = 1024*1024
+
     def __init__(self, basedir=None, use_s3=False):
         self.use_s3 = use_s3
         self.basedir = os.path.abspath(basedir)
 
+    # returns the SHA-256 of what was saved
     def _save(self, storage_key, fobj, contents):
         file_name = os.path.abspath(os.path.join(self.basedir, storage_key))
         if not file_name.startswith(self.basedir):
@@ -35,17 +41,35 @@ class FileStore(object):
         if not os.path.exists(dir):
             os.makedirs(dir)
 
-        logger.warn("Uploading %r to %r", file_name, storage_key)
-        with open(file_name, 'wb+') as f:
-            if contents:
-                f.write(contents)
-            else:
-                f.write(fobj.read())
+        # written to the side and moved into place, nobody reading the file sees half of it
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if contents:
+                    h.update(contents)
+                    f.write(contents)
+                    size = len(contents)
+                else:
+                    for chunk in iter(lambda: fobj.read(self.chunk_size), b''):
+                        h.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, file_name)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+        logger.warn("Uploaded %r to %r, size=%r sha256=%s", file_name, storage_key, size, h.hexdigest())
 
         # s3.put_object(Body=fobj, Bucket=bucket, Key=storage_key)
         if self.use_s3:
             s3.upload_file(file_name, Bucket=bucket, Key=storage_key)
 
+        return h.hexdigest()
+
     def get(self, project_file_id=None, project_file=None):
         if project_file:
             pf = project_file.copy()
@@ -92,10 +116,14 @@ class FileStore(object):
             source_project_file_id=None,
         )
 
+        # members come out of the copy we just saved, one at a time and a chunk at a time
         if os.path.splitext(file_name)[-1].lower() == '.zip' and split_zip:
-            with zipfile.ZipFile(fobj) as z:
+            with zipfile.ZipFile(os.path.join(self.basedir, storage_key)) as z:
                 for i in z.infolist():
                     file_name = os.path.split(i.filename)[-1]
+                    if not file_name:
+                        continue
+
                     storage_key = '{}/{}/{}'.format(user_id, project_key, file_name)
                     with z.open(i) as zf:
                         self._save(storage_key, zf, None)
@@ -0,0 +1,95 @@
+import base64
+import contextlib
+import datetime
+import io
+import os
+import struct
+import sys
+
+import numpy
+import pytest
+
+# the api imports itself as api, the same as it does in the api container where src is the working directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from lib.campy import layercache, tiles
+
+# importing the api points the layer and tile caches at the server's directories, the other tests keep theirs
+_directories = layercache.default.directory, tiles.default.directory
+from api import pcb, projects, queries
+layercache.default.directory, tiles.default.directory = _directories
+
+# a trace and a pad, an inch by half an inch
+board_gerber = b"""%FSLAX24Y24*%
+%MOIN*%
+%ADD10C,0.0100*%
+%ADD11R,0.0600X0.0400*%
+D10*
+X0Y0D02*
+X10000Y5000D01*
+D11*
+X5000Y2500D03*
+M02*
+"""
+
+
+class User(object):
+    user_id = 1
+
+
+# a project with one copper layer, counting the renders and the times its file is read.  The band render is a flat
+# image the size it was asked for, cairo isn't needed to test what's around it
+@pytest.fixture
+def project(tmpdir, monkeypatch):
+    p = {'project_id': 7, 'date_modified': datetime.datetime(2020, 1, 1)}
+    reads, renders = [], []
+
+    @contextlib.contextmanager
+    def _get_fobj(project_file=None):
+        reads.append(project_file['file_name'])
+        yield io.BytesIO(board_gerber)
+
+    def _render(layers, theme, bounds, scale, size):
+        renders.append((len(layers), size))
+        return numpy.zeros((size, size, 3), numpy.uint8)
+
+    monkeypatch.setattr(queries, 'project', lambda **kwargs: dict(p))
+    monkeypatch.setattr(queries, 'project_files', lambda **kwargs: [{'file_name': 'board.gtl'}])
+    monkeypatch.setattr(projects.project_files, 'get_fobj', _get_fobj)
+    monkeypatch.setattr(tiles, '_render', _render)
+    monkeypatch.setattr(tiles, 'default', tiles.TilePyramid(str(tmpdir), tile_size=64, band_levels=2, max_scale=600))
+    return p, reads, renders
+
+
+def _png_size(data):
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    return struct.unpack('>II', data[16:24])
+
+
+def test_render_tile(project):
+    p, reads, renders = project
+
+    info = pcb.PCBApi.render_tile(project_key='board', _user=User())
+    assert info['tile_size'] == 64 and info['max_level'] == 3
+    assert reads == ['board.gtl'] and renders == []
+
+    # the first tile renders its band, the layers read through pcb_layer
+    data = base64.b64decode(pcb.PCBApi.render_tile(project_key='board', z=1, x=1, y=0, _user=User()))
+    assert _png_size(data) == (64, 64)
+    assert renders == [(1, 128)] and reads == ['board.gtl'] * 2
+
+    # a tile in the same band is already made, and nothing's read for it
+    response = pcb.PCBApi.render_tile(project_key='board', z='0', x='0', y='0', encode='false', _user=User())
+    assert response.content_type == 'image/png' and _png_size(response.get_data()) == (64, 64)
+    assert renders == [(1, 128)] and reads == ['board.gtl'] * 2
+
+    with pytest.raises(pcb.PCBApi.NotFound):
+        pcb.PCBApi.render_tile(project_key='board', z=4, x=0, y=0, _user=User())
+
+    # tiles are kept by project, date modified, side and layers, so changing the project makes new ones
+    key = tiles.TilePyramid.key(7, p['date_modified'], 'top', ['copper', 'drill', 'outline', 'solder-mask'])
+    assert os.path.exists(tiles.default._path(key, 1, 1, 0))
+
+    p['date_modified'] = datetime.datetime(2020, 1, 2)
+    pcb.PCBApi.render_tile(project_key='board', z=1, x=1, y=0, _user=User())
+    assert renders == [(1, 128)] * 2
@@ -0,0 +1,95 @@
+import hashlib
+import io
+import os
+import stat
+import sys
+import zipfile
+
+import pytest
+
+# the api imports itself as api, the same as it does in the api container where src is the working directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from api import projects, queries
+
+
+# reads like an upload stream - a bit at a time, and no going back
+class Upload(object):
+    def __init__(self, data, fail_after=None):
+        self.data = io.BytesIO(data)
+        self.fail_after = fail_after
+        self.reads = []
+
+    def read(self, size=-1):
+        if self.fail_after is not None and sum(self.reads) >= self.fail_after:
+            raise IOError("connection reset")
+        chunk = self.data.read(size)
+        self.reads.append(len(chunk))
+        return chunk
+
+
+@pytest.fixture
+def store(tmpdir, monkeypatch):
+    monkeypatch.setattr(projects.FileStore, 'chunk_size', 1000)
+    return projects.FileStore(basedir=str(tmpdir.join('files')))
+
+
+def _files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory) for root, dirs, names in os.walk(directory) for name in names)
+
+
+def test_save_in_chunks(store):
+    data = os.urandom(3500)
+    upload = Upload(data)
+    assert store._save('1/board/board.gtl', upload, None) == hashlib.sha256(data).hexdigest()
+    assert max(upload.reads) == 1000
+
+    file_name = os.path.join(store.basedir, '1/board/board.gtl')
+    assert open(file_name, 'rb').read() == data
+    assert stat.S_IMODE(os.stat(file_name).st_mode) == 0o644
+    assert _files(store.basedir) == ['1/board/board.gtl']
+
+    # contents are saved the same
+    assert store._save('1/board/board.gbl', None, data) == hashlib.sha256(data).hexdigest()
+    assert open(os.path.join(store.basedir, '1/board/board.gbl'), 'rb').read() == data
+
+
+def test_failed_save_leaves_the_old_file(store):
+    store._save('1/board/board.gtl', None, b'old')
+    with pytest.raises(IOError):
+        store._save('1/board/board.gtl', Upload(os.urandom(3500), fail_after=2000), None)
+
+    assert open(os.path.join(store.basedir, '1/board/board.gtl'), 'rb').read() == b'old'
+    assert _files(store.basedir) == ['1/board/board.gtl']
+
+    with pytest.raises(Exception):
+        store._save('../outside', None, b'data')
+
+
+def test_split_zip_reads_the_saved_copy(store, monkeypatch):
+    members = {'gerbers/board.gtl': os.urandom(2500), 'gerbers/board.gbl': b'bottom', 'board.drl': b''}
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('gerbers/', b'')
+        for name, data in sorted(members.items()):
+            z.writestr(name, data)
+
+    added = []
+
+    def _add(**kwargs):
+        added.append(kwargs)
+        return len(added)
+
+    monkeypatch.setattr(queries, 'add_or_update_project_file', _add)
+    monkeypatch.setattr(queries, 'update_project', lambda **kwargs: None)
+
+    # the upload can only be read once, so the members can only have come from what was saved
+    project = {'project_id': 7, 'project_key': 'board', 'user_id': 1}
+    store.add(project_key='board', project=project, fobj=Upload(buf.getvalue()), file_name='board.zip', split_zip=True)
+
+    assert open(os.path.join(store.basedir, '1/board/board.zip'), 'rb').read() == buf.getvalue()
+    for name, data in members.items():
+        assert open(os.path.join(store.basedir, '1/board', os.path.basename(name)), 'rb').read() == data
+
+    assert [a['file_name'] for a in added] == ['board.zip', 'board.drl', 'board.gbl', 'board.gtl']
+    assert [a['source_project_file_id'] for a in added] == [None, 1, 1, 1]
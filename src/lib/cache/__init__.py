@@ -1,6 +1,7 @@
 import bson
 import datetime
 import dateutil.parser
+import errno
 import functools
 from ..api_framework import OurJSONEncoder
 import json
@@ -8,6 +9,11 @@ import hashlib
 import logging
 import os
 import pickle
+import socket
+import tempfile
+import threading
+import time
+import uuid
 
 # from Reputation_system.utils import redis_conn, mongo
 
@@ -48,8 +54,17 @@ def default_cachefn(*args, **kwargs):
 
 # a canonical cache object is a dict or dict-like object with the keys of
 # key, created, value, args, kwargs
+#
+# Misses on the same key are single flight: one caller runs fn and the rest wait for it and get what it cached.
+# Callers in the same process (threads or greenlets) wait on the one that got there first, and that one takes
+# lock_cache(key) so callers in other processes wait too - for backends without a shared lock that's only the
+# in-process part.  Nobody waits longer than lock_wait seconds before running fn themselves, and a shared lock is
+# given up on after lock_timeout seconds in case whoever took it died.
 class CacheBase(object):
-    def __init__(self, prefix, timeout, grace=None, keyfn=None, cachefn=None, binary=False, debug=False):
+    def __init__(
+        self, prefix, timeout, grace=None, keyfn=None, cachefn=None, binary=False, debug=False,
+        lock_timeout=600, lock_wait=300, lock_poll=0.25,
+    ):
         self.prefix = prefix
         self.timeout = timeout
         self.grace = grace
@@ -57,6 +72,11 @@ class CacheBase(object):
         self.cachefn = cachefn or default_cachefn
         self.binary = binary
         self.debug = debug
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self.lock_poll = lock_poll
+        self.flights = {}
+        self.flights_lock = threading.Lock()
 
     #############################################################################
     # functions subclasses must implement
@@ -81,6 +101,14 @@ class CacheBase(object):
     def keys(self):
         raise Exception('Not implemented')
 
+    # can take a lock on key every process sees, returning a token to unlock it with or None if it's held already.
+    # Anything older than lock_timeout has to be treated as free
+    def lock_cache(self, key):
+        return True
+
+    def unlock_cache(self, key, token):
+        pass
+
     def key_from_args(self, *args, **kwargs):
         stripped_kwargs = {k: v for k, v in kwargs.items() if k not in ['_precache', '_nocache', '_recache']}
         return self.keyfn(*args, **stripped_kwargs), stripped_kwargs
@@ -170,21 +198,92 @@ class CacheBase(object):
                     logger.warn("[cache - %r] RECACHE, re-creating cache fn=%r, key=%r diff=%r", self.prefix, fn.__name__, key, diff)
 
             if do_cache:
-                val = fn(*args, **stripped_kwargs)
-                cached = {
-                    'key': key,
-                    'created': datetime.datetime.utcnow(),
-                    'value': bson.binary.Binary(bytes(val)) if self.binary else val,
-                    'args': args,
-                    'kwargs': stripped_kwargs,
-                }
-                self.update_cache(key, cached)
+                def make():
+                    val = fn(*args, **stripped_kwargs)
+                    cached = {
+                        'key': key,
+                        'created': datetime.datetime.utcnow(),
+                        'value': bson.binary.Binary(bytes(val)) if self.binary else val,
+                        'args': args,
+                        'kwargs': stripped_kwargs,
+                    }
+                    self.update_cache(key, cached)
+                    return cached
+
+                # what somebody else made while we waited will do - unless we're here to replace what's cached,
+                # then it has to be newer than that
+                started = datetime.datetime.utcnow()
+                force = cached is not None or cachefnval == PRECACHE
+
+                def fresh():
+                    cached = self.load_cache(key)
+                    if not cached:
+                        return None
+                    if cached['created'] >= started:
+                        return cached
+                    if not force and (datetime.datetime.utcnow() - cached['created']).total_seconds() <= self.timeout:
+                        return cached
+                    return None
+
+                cached = self.single_flight(key, fresh, make)
 
             return cached['value']
 
         return wrapper
 
+    # make() for key, unless somebody else is making it already - then it's what fresh() finds once they're done
+    def single_flight(self, key, fresh, make):
+        deadline = time.time() + self.lock_wait
+        while True:
+            with self.flights_lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = threading.Event()
+
+            if leader:
+                try:
+                    return self._lead_flight(key, fresh, make, deadline)
+                finally:
+                    with self.flights_lock:
+                        del self.flights[key]
+                    flight.set()
+
+            flight.wait(max(deadline - time.time(), 0))
+            if not flight.is_set():
+                logger.warn("[cache - %r] gave up waiting for key=%r after %rs", self.prefix, key, self.lock_wait)
+                return make()
+
+            cached = fresh()
+            if cached:
+                return cached
+            # it failed, have a go ourselves
+
+    def _lead_flight(self, key, fresh, make, deadline):
+        token = self.lock_cache(key)
+        while token is None:
+            cached = fresh()
+            if cached:
+                return cached
+
+            if time.time() > deadline:
+                logger.warn("[cache - %r] gave up waiting for the lock on key=%r after %rs", self.prefix, key, self.lock_wait)
+                return make()
+
+            time.sleep(self.lock_poll)
+            token = self.lock_cache(key)
+
+        try:
+            # another process may have made it between our miss and getting the lock
+            cached = fresh()
+            if cached:
+                return cached
+            return make()
+        finally:
+            self.unlock_cache(key, token)
+
 
+# Only ever seen by one process, so the in-process part of single flight is all it needs
 class MemoryCache(CacheBase):
     def __init__(self, *args, **kwargs):
         super(MemoryCache, self).__init__(*args, **kwargs)
@@ -219,11 +318,7 @@ class FileCache(CacheBase):
         return os.path.join(self.basedir, self.prefix, key_pre, key)
 
     def update_cache(self, key, cache):
-        file_name = self.get_filename(key)
-        dir_name = os.path.dirname(file_name)
-        if not os.path.exists(dir_name):
-            os.makedirs(dir_name)
-        with open(file_name, 'wb+') as f:
+        with _write_file(self.get_filename(key)) as f:
             json.dump(cache, f, cls=OurJSONEncoder)
 
     def load_cache(self, key):
@@ -245,6 +340,12 @@ class FileCache(CacheBase):
         except KeyError:
             pass
 
+    def lock_cache(self, key):
+        return _lock_file(self.get_filename(key) + '.lock', self.lock_timeout)
+
+    def unlock_cache(self, key, token):
+        _unlock_file(self.get_filename(key) + '.lock', token)
+
     #def keys(self):
     #    return self.data.keys()
 
@@ -259,11 +360,7 @@ class PickleCache(CacheBase):
         return os.path.join(self.basedir, self.prefix, key_pre, key)
 
     def update_cache(self, key, cache):
-        file_name = self.get_filename(key)
-        dir_name = os.path.dirname(file_name)
-        if not os.path.exists(dir_name):
-            os.makedirs(dir_name)
-        with open(file_name, 'wb+') as f:
+        with _write_file(self.get_filename(key)) as f:
             pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
 
     def load_cache(self, key):
@@ -284,11 +381,18 @@ class PickleCache(CacheBase):
         except KeyError:
             pass
 
+    def lock_cache(self, key):
+        return _lock_file(self.get_filename(key) + '.lock', self.lock_timeout)
+
+    def unlock_cache(self, key, token):
+        _unlock_file(self.get_filename(key) + '.lock', token)
+
     #def keys(self):
     #    return self.data.keys()
 
 
 
+# No lock_cache: misses are only single flight within a process, other processes can make the same key at once
 class MongoCache(CacheBase):
     def __init__(self, mongo, prefix, *args, **kwargs):
         super(MongoCache, self).__init__(prefix, *args, **kwargs)
@@ -312,6 +416,7 @@ class MongoCache(CacheBase):
         return (x['key'] for x in self.mongo.safedb[self.mongo_table].find({}, {'_id': 0, 'key': 1}))
 
 
+# No lock_cache: misses are only single flight within a process, other processes can make the same key at once
 class MysqlCache(CacheBase):
     def __init__(self, sql, prefix, *args, **kwargs):
         super(MysqlCache, self).__init__(prefix, *args, **kwargs)
@@ -413,5 +518,96 @@ class RedisCache(CacheBase):
             for key in redis.scan_iter(self._key('*')):
                 yield ':'.join(key.split(':')[2:])
 
+    def _lock_key(self, keystr):
+        return 'lock:{}:{}'.format(self.prefix, keystr)
+
+    # expires by itself, so a lock whoever took it never gave back goes after lock_timeout
+    def lock_cache(self, key):
+        token = uuid.uuid4().hex
+        with self._conn() as redis:
+            if redis.set(self._lock_key(key), token, nx=True, ex=int(self.lock_timeout)):
+                return token
+        return None
+
+    def unlock_cache(self, key, token):
+        with self._conn() as redis:
+            redis.eval(_REDIS_UNLOCK, 1, self._lock_key(key), token)
+
+
+# deletes the lock only if it's still the one we took, it may have expired and been taken by someone else
+_REDIS_UNLOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _write_file(object):
+    # written to the side and moved into place so nobody reads half a file
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def __enter__(self):
+        dir_name = os.path.dirname(self.file_name)
+        if not os.path.exists(dir_name):
+            try:
+                os.makedirs(dir_name)
+            except OSError:
+                pass
+        fd, self.tmp = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+        self.f = os.fdopen(fd, 'wb')
+        return self.f
+
+    def __exit__(self, exc_type, exc_val, traceback):
+        self.f.close()
+        if exc_type is None:
+            os.rename(self.tmp, self.file_name)
+        else:
+            os.unlink(self.tmp)
+
+
+# a lock file made with O_EXCL so only one process gets it, holding a token for whoever did.  One older than timeout
+# was left by a process that died, it's removed so the next try gets it
+def _lock_file(file_name, timeout):
+    dir_name = os.path.dirname(file_name)
+    if not os.path.exists(dir_name):
+        try:
+            os.makedirs(dir_name)
+        except OSError:
+            pass
+
+    try:
+        fd = os.open(file_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+        try:
+            age = time.time() - os.path.getmtime(file_name)
+        except OSError:
+            return None
+        if age > timeout:
+            logger.warn("removing stale cache lock %r, %ds old", file_name, age)
+            _unlock_file(file_name, None)
+        return None
+
+    token = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    return token
+
+
+# token None removes it whoever has it
+def _unlock_file(file_name, token):
+    try:
+        if token is not None:
+            with open(file_name) as f:
+                if f.read() != token:
+                    return
+        os.unlink(file_name)
+    except (IOError, OSError):
+        pass
+
 
 
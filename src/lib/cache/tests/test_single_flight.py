@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# the cache imports itself as lib.cache, the same as it does in the api container where src is the working directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from lib import cache
+
+
+def _counted(seconds=0.2):
+    calls = []
+    lock = threading.Lock()
+
+    def fn(x):
+        with lock:
+            calls.append(x)
+        time.sleep(seconds)
+        return x * 2
+    return fn, calls
+
+
+def _in_threads(fn, count, *args):
+    results = []
+    start = threading.Event()
+
+    def run():
+        start.wait()
+        results.append(fn(*args))
+
+    threads = [threading.Thread(target=run) for i in range(count)]
+    for t in threads:
+        t.start()
+    start.set()
+    for t in threads:
+        t.join()
+    return results
+
+
+@pytest.fixture(params=['memory', 'file', 'pickle'])
+def make_cache(request, tmpdir):
+    def make(**kwargs):
+        kwargs.setdefault('lock_poll', 0.02)
+        if request.param == 'memory':
+            return cache.MemoryCache('test', 3600, **kwargs)
+        elif request.param == 'file':
+            return cache.FileCache(str(tmpdir), 'test', 3600, **kwargs)
+        return cache.PickleCache(str(tmpdir), 'test', 3600, **kwargs)
+    return make
+
+
+def test_threads_make_it_once(make_cache):
+    fn, calls = _counted()
+    cached = make_cache()(fn)
+    assert _in_threads(cached, 8, 21) == [42] * 8
+    assert calls == [21]
+
+    # and it's cached after
+    assert cached(21) == 42
+    assert calls == [21]
+
+
+def test_waiting_gives_up(make_cache):
+    # whoever's making it takes longer than lock_wait, so the others make it themselves
+    fn, calls = _counted(0.5)
+    cached = make_cache(lock_wait=0.1)(fn)
+    assert _in_threads(cached, 3, 5) == [10] * 3
+    assert calls == [5] * 3
+
+
+def _lock_name(c, key):
+    return c.get_filename(key) + '.lock'
+
+
+@pytest.mark.parametrize('cls', [cache.FileCache, cache.PickleCache])
+def test_stale_lock_taken_over(tmpdir, cls):
+    c = cls(str(tmpdir), 'test', 3600, lock_timeout=60, lock_wait=5, lock_poll=0.02)
+    fn, calls = _counted(0)
+    cached = c(fn)
+
+    # left behind by a process that died 10 minutes ago
+    name = _lock_name(c, c.key_from_args(3)[0])
+    assert cache._lock_file(name, c.lock_timeout)
+    os.utime(name, (time.time() - 600, time.time() - 600))
+
+    started = time.time()
+    assert cached(3) == 6
+    assert calls == [3]
+    assert time.time() - started < 1
+    assert not os.path.exists(name)
+
+
+@pytest.mark.parametrize('cls', [cache.FileCache, cache.PickleCache])
+def test_held_lock_wait_times_out(tmpdir, cls):
+    c = cls(str(tmpdir), 'test', 3600, lock_timeout=60, lock_wait=0.2, lock_poll=0.02)
+    fn, calls = _counted(0)
+    cached = c(fn)
+
+    # somebody else is making it and hasn't finished
+    name = _lock_name(c, c.key_from_args(3)[0])
+    token = cache._lock_file(name, c.lock_timeout)
+
+    started = time.time()
+    assert cached(3) == 6
+    assert calls == [3]
+    assert 0.2 <= time.time() - started < 1
+
+    # their lock is left alone
+    assert open(name).read() == token
+
+
+def _in_process(args):
+    cls, basedir, log = args
+    c = cls(basedir, 'test', 3600, lock_poll=0.02)
+
+    def fn(x):
+        with open(log, 'a') as f:
+            f.write('%d\n' % os.getpid())
+        time.sleep(0.3)
+        return x * 2
+    return c(fn)(4)
+
+
+@pytest.mark.parametrize('cls', [cache.FileCache, cache.PickleCache])
+def test_processes_make_it_once(tmpdir, cls):
+    # each process has its own cache object, only the lock file stops them all making it
+    log = str(tmpdir.join('calls'))
+    pool = multiprocessing.Pool(4)
+    try:
+        results = pool.map(_in_process, [(cls, str(tmpdir.join('cache')), log)] * 4, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    assert results == [8] * 4
+    assert len(open(log).read().split()) == 1
@@ -1,18 +1,53 @@
+import contextlib
 import copy
 import os
+import threading
 
 _machine = None
 
 flask_storage = os.environ.get('FLASK_STORAGE', "0'") != "0"
 if flask_storage:
-    from flask import request
+    from flask import request, has_request_context
 
+# Machines bound with using_machine, innermost last.  threading.local is per greenlet once gevent has patched
+# threading, and every worker process gets its own copy.
+_bound = threading.local()
+
+
+def _bound_stack():
+    if not hasattr(_bound, 'stack'):
+        _bound.stack = []
+    return _bound.stack
+
+
+# makes m the machine every operation in the with block (in this thread/greenlet) works on, eg
+#     with using_machine(Environment(**machines['k2cnc'])) as m:
+#         pcb_isolation_mill(...)
+# operations also take _machine=m to do the same for a single call
+@contextlib.contextmanager
+def using_machine(m):
+    if isinstance(m, (unicode, str)):
+        m = Environment(**machines[m])
+
+    stack = _bound_stack()
+    stack.append(m)
+    try:
+        yield m
+    finally:
+        stack.pop()
+
+
+# replaces the innermost using_machine binding if there is one, otherwise sets the machine for the request (or the
+# process, outside flask)
 def set_machine(m):
     global _machine
     if isinstance(m, (unicode, str)):
         m = Environment(**machines[m])
 
-    if flask_storage:
+    stack = _bound_stack()
+    if stack:
+        stack[-1] = m
+    elif flask_storage and has_request_context():
         request._machine = m
     else:
         _machine = m
@@ -21,18 +56,22 @@ def set_machine(m):
 
 
 def machine():
-    if flask_storage:
+    stack = _bound_stack()
+    if stack:
+        return stack[-1]
+    elif flask_storage and has_request_context():
         return request._machine
     else:
         return _machine
 
 
-
 import geometry
 import constants
 
 from cammath import *
 from environment import materials, machines, holes, Environment
+from post import GCodePost, CompactGCodePost
+from toolpath import Toolpath
 from operations import *
 from operations.pcb import *
 from operations.probe import *
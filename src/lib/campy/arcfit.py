@@ -0,0 +1,193 @@
+import math
+import numpy
+
+from . import toolpath as tp
+
+# Arc fitting for toolpaths.  Runs of straight cuts whose points all sit on a circle (isolation rings around round
+# pads, buffered traces...) are replaced with G2/G3 arcs, the same rows Environment._cut_arc records - target x/y,
+# i/j from the start of the arc to its center.  Use fit_arcs directly on a recorded Toolpath, or as a pass:
+#     machine().add_pass(ArcFitPass(tolerance=0.0005))
+
+
+# center and radius of the circle through three points, None if they're (nearly) in a line
+def circle_through(p1, p2, p3):
+    ax, ay = p1
+    bx, by = p2
+    cx, cy = p3
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-12:
+        return None
+
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+    uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    return ux, uy, math.hypot(ax - ux, ay - uy)
+
+
+# Checks points (an (N, 2) array, first one is where the arc starts) against a circle through the first, middle and
+# last point.  Returns (center x, center y, clockwise) if every point is within tolerance of the arc and every chord
+# between them within chord_tolerance, otherwise None
+def fit_arc(points, tolerance, max_radius, chord_tolerance=None):
+    circle = circle_through(points[0], points[len(points) // 2], points[-1])
+    if circle is None:
+        return None
+
+    ux, uy, radius = circle
+    if radius > max_radius:
+        return None
+
+    dx = points[:, 0] - ux
+    dy = points[:, 1] - uy
+    if numpy.abs(numpy.hypot(dx, dy) - radius).max() > tolerance:
+        return None
+
+    # points have to go around one way, less than a full turn, without skipping across the circle
+    steps = numpy.diff(numpy.arctan2(dy, dx))
+    steps = (steps + math.pi) % (2 * math.pi) - math.pi
+    if not ((steps > 0).all() or (steps < 0).all()):
+        return None
+
+    if abs(steps.sum()) >= 2 * math.pi - 1e-6 or numpy.abs(steps).max() >= math.pi / 2:
+        return None
+
+    # the arc bulges out from each chord by the sagitta
+    sagitta = radius * (1 - numpy.cos(steps / 2))
+    if numpy.abs(sagitta).max() > (chord_tolerance or tolerance):
+        return None
+
+    return ux, uy, steps[0] < 0
+
+
+def _copy_row(out, toolpath, row):
+    m = toolpath.row(row)
+    out.set_operation(m.op)
+    out.append(m.kind, m.x, m.y, m.z, m.a, m.feed, m.i, m.j, flags=m.flags, level=m.level, text=m.text)
+
+
+# Returns a new Toolpath with runs of at least min_segments straight cuts replaced by arcs where they fit within
+# tolerance.  A run is LINEAR rows at the same level and operation with plain numbers for x/y, no z change (after
+# the first row) and no feed change (after the first row), starting from a known position.
+#
+# Each chord of the run bulges out to the arc that replaces it.  chord_tolerance (default tolerance) limits that - if
+# the polyline was already simplified from a smooth curve it can be as loose as the simplification was.
+def fit_arcs(toolpath, tolerance=0.0005, min_segments=3, max_radius=100, chord_tolerance=None):
+    data = toolpath.arrays()
+    kinds = data['kind']
+    n = len(kinds)
+    out = tp.Toolpath()
+
+    position = [tp.NAN, tp.NAN, tp.NAN]
+    row = 0
+    while row < n:
+        kind = kinds[row]
+        z = position[2]
+        if (
+            kind == tp.LINEAR and not math.isnan(position[0]) and not math.isnan(position[1]) and
+            row not in toolpath.exprs and (math.isnan(data['z'][row]) or data['z'][row] == z)
+        ):
+            # gather the run that starts here
+            end = row + 1
+            while end < n and kinds[end] == tp.LINEAR and end not in toolpath.exprs:
+                if not math.isnan(data['feed'][end]) or not math.isnan(data['a'][end]):
+                    break
+                if data['level'][end] != data['level'][row] or data['op'][end] != data['op'][row]:
+                    break
+                if not math.isnan(data['z'][end]) and data['z'][end] != z:
+                    break
+                end += 1
+
+            if end - row >= min_segments and math.isnan(data['a'][row]):
+                xs = numpy.concatenate([[position[0]], data['x'][row:end]])
+                ys = numpy.concatenate([[position[1]], data['y'][row:end]])
+
+                # x or y can be left out for an axis that doesn't move
+                for values in (xs, ys):
+                    for k in range(1, len(values)):
+                        if math.isnan(values[k]):
+                            values[k] = values[k - 1]
+
+                _fit_run(
+                    out, toolpath, data, row, numpy.column_stack([xs, ys]),
+                    tolerance, min_segments, max_radius, chord_tolerance,
+                )
+                position = [xs[-1], ys[-1], z]
+                row = end
+                continue
+
+        _copy_row(out, toolpath, row)
+
+        if kind == tp.PROBE:
+            for k, axis in enumerate(('x', 'y', 'z')):
+                if not math.isnan(data[axis][row]) or axis in toolpath.exprs.get(row, {}):
+                    position[k] = tp.NAN
+        elif kind != tp.TEXT:
+            for k, axis in enumerate(('x', 'y', 'z')):
+                if axis in toolpath.exprs.get(row, {}):
+                    position[k] = tp.NAN
+                elif not math.isnan(data[axis][row]):
+                    position[k] = data[axis][row]
+
+        row += 1
+
+    return out
+
+
+# points[0] is where the run starts, points[k] is where row first + k - 1 ends
+def _fit_run(out, toolpath, data, first, points, tolerance, min_segments, max_radius, chord_tolerance):
+    count = len(points) - 1
+    start = 0
+    def _fit(end):
+        return fit_arc(points[start:end + 1], tolerance, max_radius, chord_tolerance)
+
+    while start < count:
+        end = start + min_segments
+        arc = _fit(end) if end <= count else None
+        if arc is None:
+            _copy_row(out, toolpath, first + start)
+            start += 1
+            continue
+
+        # grow the arc in bigger and bigger steps until it stops fitting, then narrow down on where that happened
+        good, bad, step = end, count + 1, 1
+        while good + step <= count:
+            next_arc = _fit(good + step)
+            if next_arc is None:
+                bad = good + step
+                break
+            good, arc = good + step, next_arc
+            step *= 2
+
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            next_arc = _fit(middle)
+            if next_arc is None:
+                bad = middle
+            else:
+                good, arc = middle, next_arc
+
+        end, (ux, uy, clockwise) = good, arc
+        m = toolpath.row(first + start)
+        x, y = points[end]
+        out.set_operation(m.op)
+        out.append(
+            tp.ARC_CW if clockwise else tp.ARC_CCW, x, y, m.z, feed=m.feed,
+            i=ux - points[start][0], j=uy - points[start][1], level=m.level,
+        )
+        start = end
+
+
+# Environment pass, see Environment.add_pass
+class ArcFitPass(object):
+    def __init__(self, tolerance=0.0005, min_segments=3, max_radius=100, chord_tolerance=None):
+        self.tolerance = tolerance
+        self.min_segments = min_segments
+        self.max_radius = max_radius
+        self.chord_tolerance = chord_tolerance
+
+    def __call__(self, toolpath):
+        return fit_arcs(
+            toolpath, tolerance=self.tolerance, min_segments=self.min_segments, max_radius=self.max_radius,
+            chord_tolerance=self.chord_tolerance,
+        )
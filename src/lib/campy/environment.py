@@ -1,9 +1,11 @@
+import contextlib
 import logging
-import shapely
 
 from .cammath import frange
 from .tools import *
 from . import constants
+from . import toolpath as tp
+from .post import GCodePost
 
 import copy
 import math
@@ -31,7 +33,10 @@ class Material(object):
 
 
 class Environment(object):
-    def __init__(self, min_rpm, max_rpm, max_feedrates, save_geoms=False):
+    def __init__(
+        self, min_rpm, max_rpm, max_feedrates, save_geoms=False, buffer_size=64*1024, write_through=False,
+        post=None, deferred=False, accelerations=None,
+    ):
         self.tool = None
         self.material = None
         self.material_factor = 1
@@ -41,14 +46,32 @@ class Environment(object):
         self.location = None
         self.files = {}
         self.f = None
+        self.filename = None
         self.level = 0
+        self.prefix = ''
         self.save_geoms = save_geoms
-        self.geometry = []
+        self.geometry = tp.MoveRecorder()
+
+        # output is collected here and handed to the file in large chunks, see write/flush
+        self.buffer = []
+        self.buffer_len = 0
+        self.buffer_size = buffer_size
+        self.write_through = write_through
+
+        # When self.toolpath is set, moves and text are recorded into it rather than formatted straight away.
+        # deferred=True keeps one toolpath per file and only runs passes + post-processor on it at flush time
+        self.post = post or GCodePost()
+        self.passes = []
+        self.deferred = deferred
+        self.toolpath = None
+        self.toolpaths = {}
+        self.operation_stack = []
 
         self.min_rpm = min_rpm
         self.max_rpm = max_rpm
         self.max_feedrates = max_feedrates
         self.peak_feedrate = max(max_feedrates)
+        self.accelerations = accelerations
 
         self.position = (0, 0, 0)
 
@@ -58,21 +81,33 @@ class Environment(object):
 
     def set_save_geoms(self, save_geoms):
         self.save_geoms = save_geoms
-        self.geometry = []
+        self.geometry = tp.MoveRecorder()
+
+    # write_through writes and flushes every line as it is generated - slow, but handy when debugging
+    def set_write_through(self, write_through):
+        self.flush()
+        self.write_through = write_through
 
     @classmethod
     def format_movement(cls, x=None, y=None, z=None, a=None, rate=None):
-        movement = []
-        for var, axis in zip((x, y, z, a, rate), ('X', 'Y', 'Z', 'A', 'F')):
-            if var is not None: 
-                if str(var).strip().startswith('['):
-                    movement.append("%s%s" % (axis, var))
-                else:
-                    movement.append('%s%.6f' % (axis, var))
+        return GCodePost.format_movement(x, y, z, a, rate)
+
+    # passes take a Toolpath and return a Toolpath, they are run (in order) every time a toolpath is emitted
+    def add_pass(self, fn):
+        self.passes.append(fn)
 
-        return movement
+    def set_post(self, post):
+        self.flush()
+        self.post = post
 
     def close_file(self, name):
+        self._emit_pending(name)
+        self.toolpaths.pop(name, None)
+        if self.files[name] is self.f:
+            self._flush_buffer()
+            self.f = None
+            self.toolpath = None
+
         f = self.files[name]
         f.write("M30\n")
         f.write("%\n")
@@ -80,18 +115,26 @@ class Environment(object):
         del self.files[name]
 
     def set_file(self, filename):
+        if self.f is not None and self.f is not self.files.get(filename):
+            self._flush_buffer()
+
         if filename not in self.files:
             dir = os.path.split(filename)[0]
             if not os.path.exists(dir):
                 os.makedirs(dir)
             self.files[filename] = open(filename, 'w')
             self.f = self.files[filename]
+            self.post.reset()
+            if self.deferred:
+                self.toolpaths[filename] = self.toolpath = tp.Toolpath()
 
             self.write("%")
             self.write("G17 G20 G40 G90")  # FIXME revisit this later
 
         self.filename = filename
         self.f = self.files[filename]
+        if self.deferred:
+            self.toolpath = self.toolpaths[filename]
 
     def set_tool(self, tool, feed_class='low', rpm_range=None, ):
         if isinstance(tool, (str, unicode)):
@@ -112,15 +155,117 @@ class Environment(object):
         else:
             self.material = material
 
-    def write(self, txt):
+    # point = (x, y) the text quotes, see Toolpath.translated
+    def write(self, txt, point=None):
+        if self.toolpath is not None:
+            if point is None:
+                self.toolpath.append(tp.TEXT, level=self.level, text=txt)
+            else:
+                self.toolpath.append(tp.TEXT, point[0], point[1], flags=tp.COMMENT_POINT, level=self.level, text=txt)
+            return
+
+        self._write_post(self.post.text(txt))
+
+    # writes a line that has already been through the post-processor.  Post-processors return None for moves that
+    # don't need a line at all
+    def _write_post(self, line):
+        if line is None:
+            return
+
         if self.f is None:
-            print "Can't write, f=None", txt
-        else:
-            prefix = " "*((self.level-1)*4)
-            self.f.write(prefix + txt + '\n')
-            # sys.stdout.write(txt + '\n');
+            print "Can't write, f=None", line
+            return
+
+        self._write_line(self.prefix + line + '\n')
+
+    def _write_line(self, line):
+        if self.write_through:
+            self.f.write(line)
+            self.f.flush()
+            return
+
+        self.buffer.append(line)
+        self.buffer_len += len(line)
+        if self.buffer_len >= self.buffer_size:
+            self._flush_buffer()
+
+    def flush(self):
+        for name in self.toolpaths.keys():
+            self._emit_pending(name)
+
+        self._flush_buffer()
 
-        self.f.flush()  # required?
+    def _flush_buffer(self):
+        if self.buffer:
+            self.f.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffer_len = 0
+
+        if self.f is not None:
+            self.f.flush()
+
+    # run passes and the post-processor over a toolpath and write the result to the current file.  If we're
+    # recording ourselves the moves are just appended to our toolpath, passes will see them when it gets emitted
+    def emit(self, toolpath):
+        if self.toolpath is not None:
+            self.toolpath.extend(toolpath)
+            return
+
+        for fn in self.passes:
+            toolpath = fn(toolpath) or toolpath
+
+        prefixes = {}
+        for level, line in self.post.render(toolpath):
+            if line is None:
+                continue
+
+            if level not in prefixes:
+                prefixes[level] = " "*((level-1)*4)
+            self._write_line(prefixes[level] + line + '\n')
+
+    def _emit_pending(self, filename):
+        toolpath = self.toolpaths.get(filename)
+        if not toolpath:
+            return
+
+        # passes can look at self.filename to see which file they're working on
+        current, current_toolpath, current_filename = self.f, self.toolpath, self.filename
+        if current is not self.files[filename]:
+            self._flush_buffer()
+            self.f = self.files[filename]
+
+        self.toolpath = None
+        self.filename = filename
+        self.emit(toolpath)
+        toolpath.clear()
+
+        if current is not self.f:
+            self._flush_buffer()
+        self.f, self.toolpath, self.filename = current, current_toolpath, current_filename
+
+    # record everything generated inside the with block into a Toolpath instead of the output, eg
+    #     with machine().record() as path:
+    #         pcb_isolation_mill(...)
+    #     machine().emit(path)
+    @contextlib.contextmanager
+    def record(self, toolpath=None):
+        saved = self.toolpath
+        self.toolpath = toolpath if toolpath is not None else tp.Toolpath()
+        self.toolpath.set_operation(self.operation_stack[-1] if self.operation_stack else None)
+        try:
+            yield self.toolpath
+        finally:
+            self.toolpath = saved
+
+    def push_operation(self, name):
+        self.operation_stack.append(name)
+        if self.toolpath is not None:
+            self.toolpath.set_operation(name)
+
+    def pop_operation(self):
+        self.operation_stack.pop()
+        if self.toolpath is not None:
+            self.toolpath.set_operation(self.operation_stack[-1] if self.operation_stack else None)
 
     def set_speed(self, rate):
         if rate is None:
@@ -144,40 +289,29 @@ class Environment(object):
     def end_program(self):
         self.write("M30")
         self.write("%")
+        self.flush()
 
     def pause_program(self):
         self.comment("PAUSE")
         self.write("M0")
 
-    def comment(self, c):
+    def comment(self, c, point=None):
         c = c.replace('(', '[').replace(')', ']')
-        self.write("(%s)" % (c,))
+        self.write("(%s)" % (c,), point=point)
 
     def _new_position(self, x, y, z):
         new_position = tuple(b if b is not None else a for a, b in zip(self.position, [x, y, z]))
         return new_position
 
-    def goto(self, x=None, y=None, z=None, a=None, point=None, rate=None, prefix='G0'):
-        if point is not None:
-            x, y, z = point
-
+    def _move_to(self, x, y, z, kind):
         new_position = self._new_position(x, y, z)
-        if self.position:
-            self.geometry.append((
-                shapely.geometry.LineString([self.position[:2], new_position[:2]]),
-                'goto'
-            ))
+        if self.save_geoms:
+            self.geometry.append(self.position, new_position, kind)
 
         self.position = new_position
 
-        # self.record_linear_move((x, y, z), speed=self.rapid_speed)
-        prefix = prefix + (' ' if prefix else '')
-        self.write("%s %s" % (prefix, " ".join(self.format_movement(x, y, z, a, rate))))
-
-    def cut(self, x=None, y=None, z=None, a=None, point=None, rate=None):
-        if point is not None:
-            x, y, z = point
-
+    # feed for moves that use the current speed if one isn't passed in.  The speed is only used for one move
+    def _take_feed(self, rate):
         if self.speed is not None and rate is None:
             feed = self.speed
             self.speed = None
@@ -186,17 +320,33 @@ class Environment(object):
         else:
             feed = None
 
-        new_position = self._new_position(x, y, z)
-        if self.position:
-            self.geometry.append((
-                shapely.geometry.LineString([self.position[:2], new_position[:2]]),
-                'cut'
-            ))
+        return feed
 
-        self.position = new_position
+    def goto(self, x=None, y=None, z=None, a=None, point=None, rate=None, prefix='G0'):
+        if point is not None:
+            x, y, z = point
+
+        self._move_to(x, y, z, 'goto')
+
+        # self.record_linear_move((x, y, z), speed=self.rapid_speed)
+        if self.toolpath is not None:
+            self.toolpath.append(tp.RAPID, x, y, z, a, rate, level=self.level)
+        else:
+            self._write_post(self.post.rapid(x, y, z, a, rate, prefix=prefix))
+
+    def cut(self, x=None, y=None, z=None, a=None, point=None, rate=None):
+        if point is not None:
+            x, y, z = point
+
+        feed = self._take_feed(rate)
+
+        self._move_to(x, y, z, 'cut')
 
         # self.record_linear_move((x, y, z))
-        self.write("G1 %s" % (" ".join(self.format_movement(x, y, z, a, feed))))
+        if self.toolpath is not None:
+            self.toolpath.append(tp.LINEAR, x, y, z, a, feed, level=self.level)
+        else:
+            self._write_post(self.post.linear(x, y, z, a, feed))
 
     # z is the top of the material being drilled into
     # retract_distance and depth are relative to z
@@ -211,21 +361,25 @@ class Environment(object):
         # cycle_depth = -1 * (depth + retract_distance)  # this is supposed to be how it works but it doesn't seem to
         cycle_depth = z - depth
 
-        if self.speed is not None and rate is None:
-            feed = "F%0.3f " % self.speed
-            self.speed = None
-        elif rate is not None:
-            feed = "F%0.3f " % rate
-        else:
-            feed = ""
+        feed = self._take_feed(rate)
+
+        for index, c in enumerate(centers):
+            c = tuple(c) + (None, ) * (3 - len(c))
+            self._move_to(c[0], c[1], c[2], 'goto')
 
-        retract_type = 'G99'   # G98 would retract to initial Z every time
+            if self.toolpath is not None:
+                flags = (tp.DRILL_START if index == 0 else 0) | (tp.DRILL_END if index == len(centers) - 1 else 0)
+                self.toolpath.append(
+                    tp.DRILL, c[0], c[1], c[2], feed=feed, i=z_retract, j=cycle_depth, flags=flags, level=self.level
+                )
+            elif index == 0:
+                self._write_post(self.post.rapid(*c))
+                self._write_post(self.post.drill_cycle(z_retract, cycle_depth, feed))
+            else:
+                self._write_post(self.post.rapid(*c, prefix=''))
 
-        self.goto(*centers[0])
-        self.write("{} G90 G81 R{:0.3f} Z{:0.3f} {}".format(retract_type, z_retract, cycle_depth, feed))
-        for c in centers[1:]:
-            self.goto(*c, prefix='')
-        self.write("G80")
+        if self.toolpath is None:
+            self._write_post(self.post.drill_cycle_end())
 
     # x, y forms the center of your arc
     # if I did this right, I think it presumes you're at bx, by already
@@ -275,27 +429,16 @@ class Environment(object):
 
     # I would prefer not to use this
     def _cut_arc(self, x=None, y=None, I=None, J=None, rate=None, z=None, clockwise=True):
-        if self.speed is not None and rate is None:
-            feed = "F%0.3f " % self.speed
-            self.speed = None
-        elif rate is not None:
-            feed = "F%0.3f " % rate
-        else:
-            feed = ""
-
-        Z = "Z%6f" % z if z is not None else ""
+        feed = self._take_feed(rate)
 
         # self.record_arc_move(x, y, z, I, J, clockwise)
-        self.write("%s X%.6f Y%.6f I%.6f J%6f %s %s" % ('G2' if clockwise else 'G3', x, y, I, J, Z, feed))
+        if self.toolpath is not None:
+            self.toolpath.append(tp.ARC_CW if clockwise else tp.ARC_CCW, x, y, z, feed=feed, i=I, j=J, level=self.level)
+        else:
+            self._write_post(self.post.arc(x, y, I, J, z, feed, clockwise=clockwise))
 
     def probe(self, axis='z', rate=None, to=None, toward=True, halt_on_error=True):
-        if self.speed is not None and rate is None:
-            feed = "F%0.3f " % self.speed
-            self.speed = None
-        elif rate is not None:
-            feed = "F%0.3f " % rate
-        else:
-            feed = ""
+        feed = self._take_feed(rate)
 
         # self.geometry.append()  ??
 
@@ -304,7 +447,12 @@ class Environment(object):
         else:
             gcode = 'G38.4' if halt_on_error else 'G38.5'
 
-        self.write("{} {}{} {}".format(gcode, axis.upper(), to, feed))
+        if self.toolpath is not None:
+            self.toolpath.append(
+                tp.PROBE, feed=feed, flags=tp.probe_codes.index(gcode), level=self.level, **{axis.lower(): to}
+            )
+        else:
+            self._write_post(self.post.probe(axis, to, feed, gcode=gcode))
 
     def calc_stepover(self, stepover=None, max_stepover=None, depth=None):
         diam = self.tool.diameter_at_depth(depth or 0)
@@ -368,11 +516,13 @@ class Environment(object):
 
     def push_level(self):
         self.level += 1
+        self.prefix = " "*((self.level-1)*4)
 
     def pop_level(self):
         self.level -= 1
         if self.level < 0:
             raise Exception("popped too many levels")
+        self.prefix = " "*((self.level-1)*4)
 
 
 # machine =
@@ -475,8 +625,9 @@ materials = {
 
 
 machines = {
-    'k2cnc': dict(min_rpm=10000, max_rpm=20000, max_feedrates=[144, 144, 20]),
-    'lms': dict(min_rpm=10000, max_rpm=20000, max_feedrates=[144, 144, 20]),
+    # feedrates are in/min, accelerations in/s^2
+    'k2cnc': dict(min_rpm=10000, max_rpm=20000, max_feedrates=[144, 144, 20], accelerations=[10, 10, 5]),
+    'lms': dict(min_rpm=10000, max_rpm=20000, max_feedrates=[144, 144, 20], accelerations=[10, 10, 5]),
 }
 
 holes = HoleSize()
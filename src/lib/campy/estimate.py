@@ -0,0 +1,330 @@
+import collections
+import math
+import os
+import re
+
+from . import gcode
+from . import toolpath as tp
+
+# Cycle time estimates.
+#
+# Moves are planned the way a look-ahead trajectory planner would: every move gets a top speed from its feed and the
+# per-axis max feedrates, an acceleration from the per-axis accelerations, and a junction speed with the next move
+# from the angle between them (junction deviation, as in grbl).  Speeds are then limited backwards and forwards so
+# every move can reach its exit speed, and each move is timed with a trapezoidal velocity profile.  Anything that
+# stops the machine (drill cycles, probes, pauses, G-code we can't follow) ends a run of blended moves.
+#
+# Feeds are in/min like everywhere else, accelerations in/s^2, times come out in seconds.  Expressions can't be
+# evaluated, axes given as expressions are taken as not moving.  Probes are assumed to travel the whole way.
+
+default_accelerations = [10, 10, 5]
+
+local_offset_re = re.compile(r'^\s*G52\s*(?:X\s*([-+.\d]+))?\s*(?:Y\s*([-+.\d]+))?', re.I)
+
+Segment = collections.namedtuple('Segment', ['length', 'start_dir', 'end_dir', 'speed', 'accel', 'op', 'kind'])
+
+
+def _unit(dx, dy, dz):
+    length = math.sqrt(dx*dx + dy*dy + dz*dz)
+    if not length:
+        return 0, (0, 0, 0)
+    return length, (dx / length, dy / length, dz / length)
+
+
+# time to cover length starting at v_in, ending at v_out, going no faster than speed
+def trapezoid_time(length, v_in, v_out, speed, accel):
+    d_up = (speed*speed - v_in*v_in) / (2 * accel)
+    d_down = (speed*speed - v_out*v_out) / (2 * accel)
+    if d_up + d_down <= length:
+        return (speed - v_in) / accel + (speed - v_out) / accel + (length - d_up - d_down) / speed
+
+    peak = math.sqrt(max((2 * accel * length + v_in*v_in + v_out*v_out) / 2, 0))
+    return max(peak - v_in, 0) / accel + max(peak - v_out, 0) / accel
+
+
+class Estimator(object):
+    def __init__(self, max_feedrates, accelerations=None, junction_deviation=0.0005):
+        # in/s from here on
+        self.max_speeds = [f / 60. for f in max_feedrates]
+        self.accelerations = accelerations or default_accelerations
+        self.junction_deviation = junction_deviation
+        self.files = collections.OrderedDict()
+        self.states = {}
+
+    @classmethod
+    def for_machine(cls, machine, **kwargs):
+        return cls(machine.max_feedrates, machine.accelerations, **kwargs)
+
+    def _file(self, name):
+        if name not in self.files:
+            self.files[name] = {
+                'seconds': 0,
+                'operations': collections.OrderedDict(),
+                'kinds': collections.OrderedDict(),
+                'distance': {'rapid': 0, 'feed': 0},
+                'moves': 0,
+                'pauses': 0,
+            }
+            self.states[name] = {'position': [None, None, None], 'feed': None, 'chain': []}
+
+        return self.files[name], self.states[name]
+
+    # top speed and acceleration along a direction, limited by whichever axis gets there first
+    def _limits(self, direction, speed):
+        accel = None
+        for axis, component in enumerate(direction):
+            if abs(component) > 1e-9:
+                speed = min(speed, self.max_speeds[axis] / abs(component))
+                a = self.accelerations[axis] / abs(component)
+                accel = a if accel is None else min(accel, a)
+
+        return speed, accel or min(self.accelerations)
+
+    def _add_time(self, report, op, kind, seconds):
+        report['seconds'] += seconds
+        report['operations'][op] = report['operations'].get(op, 0) + seconds
+        report['kinds'][kind] = report['kinds'].get(kind, 0) + seconds
+
+    # plan and time a run of blended moves
+    def _finish_chain(self, report, state):
+        chain = state['chain']
+        state['chain'] = []
+        if not chain:
+            return
+
+        # junction speed limits, the last move ends stopped
+        junctions = []
+        for a, b in zip(chain, chain[1:]):
+            cos_theta = -sum(x * y for x, y in zip(a.end_dir, b.start_dir))
+            limit = min(a.speed, b.speed)
+            if cos_theta > 0.999999:
+                limit = 0
+            elif cos_theta > -0.999999:
+                sin_half = math.sqrt((1 - cos_theta) / 2)
+                limit = min(limit, math.sqrt(min(a.accel, b.accel) * self.junction_deviation * sin_half / (1 - sin_half)))
+            junctions.append(limit)
+        junctions.append(0)
+
+        # backwards so every move can slow down in time, then forwards so it can speed up in time
+        exits = list(junctions)
+        for k in range(len(chain) - 1, 0, -1):
+            s = chain[k]
+            exits[k - 1] = min(exits[k - 1], math.sqrt(exits[k] ** 2 + 2 * s.accel * s.length))
+
+        v_in = 0
+        for k, s in enumerate(chain):
+            exits[k] = min(exits[k], math.sqrt(v_in ** 2 + 2 * s.accel * s.length))
+            self._add_time(report, s.op, s.kind, trapezoid_time(s.length, v_in, exits[k], s.speed, s.accel))
+            v_in = exits[k]
+
+    def _segment(self, report, state, op, kind, dx, dy, dz, speed, length=None, start_dir=None, end_dir=None, radius=None):
+        straight, direction = _unit(dx, dy, dz)
+        length = straight if length is None else length
+        if not length:
+            return
+
+        speed, accel = self._limits(start_dir or direction, speed)
+        if radius:
+            # centripetal acceleration
+            speed = min(speed, math.sqrt(accel * radius))
+
+        report['moves'] += 1
+        report['distance']['rapid' if kind == 'rapid' else 'feed'] += length
+        state['chain'].append(Segment(length, start_dir or direction, end_dir or direction, speed, accel, op, kind))
+
+    # moves from the current position to target, anything in target that's None or not a number doesn't move
+    def _deltas(self, state, target):
+        position = state['position']
+        deltas = []
+        for axis, value in enumerate(target):
+            if value is None or isinstance(value, basestring):
+                deltas.append(0)
+                continue
+
+            deltas.append(value - position[axis] if position[axis] is not None else 0)
+            position[axis] = value
+
+        return deltas
+
+    def _feed(self, state, feed):
+        if feed is not None and not isinstance(feed, basestring):
+            state['feed'] = feed
+        return (state['feed'] or max(self.max_speeds) * 60) / 60.
+
+    def move(self, name, op, kind, x=None, y=None, z=None, feed=None):
+        report, state = self._file(name)
+        speed = self._feed(state, feed)
+        if kind == tp.RAPID:
+            speed = max(self.max_speeds)
+
+        dx, dy, dz = self._deltas(state, (x, y, z))
+        self._segment(report, state, op, 'rapid' if kind == tp.RAPID else 'cut', dx, dy, dz, speed)
+
+    def arc(self, name, op, clockwise, x, y, i, j, z=None, feed=None):
+        report, state = self._file(name)
+        speed = self._feed(state, feed)
+        sx, sy, sz = state['position']
+        if sx is None or sy is None or isinstance(i, basestring) or isinstance(j, basestring):
+            self._deltas(state, (x, y, z))
+            self._finish_chain(report, state)
+            return
+
+        cx, cy = sx + i, sy + j
+        dx, dy, dz = self._deltas(state, (x, y, z))
+        radius = math.hypot(i, j)
+        a1 = math.atan2(sy - cy, sx - cx)
+        a2 = math.atan2(sy + dy - cy, sx + dx - cx)
+        sweep = ((a1 - a2) if clockwise else (a2 - a1)) % (2 * math.pi) or 2 * math.pi
+        length = math.hypot(radius * sweep, dz)
+
+        # tangents at each end, for the junctions with the moves either side
+        sign = -1 if clockwise else 1
+        start_dir = _unit(-sign * (sy - cy), sign * (sx - cx), 0)[1]
+        end_dir = _unit(-sign * (sy + dy - cy), sign * (sx + dx - cx), 0)[1]
+        self._segment(report, state, op, 'arc', 0, 0, dz, speed, length, start_dir, end_dir, radius)
+
+    def drill(self, name, op, x, y, retract, depth, feed=None):
+        report, state = self._file(name)
+        self._finish_chain(report, state)
+        feed_speed = self._feed(state, feed)
+        rapid = max(self.max_speeds)
+
+        dx, dy, _ = self._deltas(state, (x, y, None))
+        z = state['position'][2]
+        moves = [(dx, dy, 0, rapid, 'rapid')]
+        if z is not None and z > retract:
+            moves.append((0, 0, retract - z, rapid, 'rapid'))
+        moves += [(0, 0, depth - retract, feed_speed, 'drill'), (0, 0, retract - depth, rapid, 'rapid')]
+
+        # canned cycles stop between every step
+        for dx, dy, dz, speed, kind in moves:
+            self._segment(report, state, op, kind, dx, dy, dz, speed)
+            self._finish_chain(report, state)
+
+        state['position'][2] = retract
+
+    def probe(self, name, op, axis, to, feed=None):
+        report, state = self._file(name)
+        self._finish_chain(report, state)
+        target = [None, None, None]
+        if axis in 'xyz':
+            target['xyz'.index(axis)] = to
+
+        dx, dy, dz = self._deltas(state, target)
+        self._segment(report, state, op, 'probe', dx, dy, dz, self._feed(state, feed))
+        self._finish_chain(report, state)
+
+    # something we can't follow - everything stops
+    def stop(self, name, pause=False):
+        report, state = self._file(name)
+        self._finish_chain(report, state)
+        if pause:
+            report['pauses'] += 1
+
+    # O-word subroutines (pcb_panel writes them) are timed every time they're called, moved by the G52 offset in
+    # effect at the time - the same as gcode.Interpreter does for add_lines
+    def add_toolpath(self, toolpath, name=None):
+        subroutines = {}
+        body = None
+        offset = (0, 0)
+        for m in toolpath:
+            match = gcode.subroutine_re.match(m.text) if m.kind == tp.TEXT else None
+            if match:
+                number, word = match.group(1), match.group(2).lower()
+                if word == 'sub':
+                    body = subroutines[number] = []
+                elif word == 'endsub':
+                    body = None
+                elif body is None:
+                    for b in subroutines.get(number, []):
+                        self._add_move(name, b, offset)
+            elif body is not None:
+                body.append(m)
+            else:
+                match = local_offset_re.match(m.text) if m.kind == tp.TEXT else None
+                if match:
+                    offset = tuple(float(v) if v else o for v, o in zip(match.groups(), offset))
+                else:
+                    self._add_move(name, m, offset)
+
+        self.stop(name)
+
+    def _add_move(self, name, m, offset):
+        if any(offset) and m.kind != tp.TEXT:
+            m = m._replace(**dict(
+                (axis, value + d) for axis, value, d in (('x', m.x, offset[0]), ('y', m.y, offset[1]))
+                if value is not None and not isinstance(value, basestring)
+            ))
+
+        if m.kind in (tp.RAPID, tp.LINEAR):
+            self.move(name, m.op, m.kind, m.x, m.y, m.z, m.feed)
+        elif m.kind in (tp.ARC_CW, tp.ARC_CCW):
+            self.arc(name, m.op, m.kind == tp.ARC_CW, m.x, m.y, m.i, m.j, m.z, m.feed)
+        elif m.kind == tp.DRILL:
+            self.drill(name, m.op, m.x, m.y, m.i, m.j, m.feed)
+        elif m.kind == tp.PROBE:
+            for axis in ('x', 'y', 'z'):
+                if getattr(m, axis) is not None:
+                    self.probe(name, m.op, axis, getattr(m, axis), m.feed)
+                    break
+        elif m.kind == tp.TEXT and not gcode.passive_re.match(m.text):
+            self.stop(name, pause=any(code in gcode.pause_codes for code in m.text.upper().split()))
+
+    # .ngc files don't say which operation made which move, everything goes down as op=None.  Subroutines are timed
+    # every time they're called, like add_toolpath, see gcode.Interpreter
+    def add_lines(self, lines, name=None):
+        for number, event in gcode.events(lines):
+            if event[0] == 'move':
+                target = event[2]
+                xyz = [target.get(axis) for axis in 'XYZ']
+                if event[1] in ('G2', 'G3'):
+                    self.arc(name, None, event[1] == 'G2', xyz[0], xyz[1], target.get('I', 0), target.get('J', 0), xyz[2], event[3])
+                else:
+                    kind = tp.RAPID if event[1] == 'G0' else tp.LINEAR
+                    self.move(name, None, kind, xyz[0], xyz[1], xyz[2], event[3])
+            elif event[0] == 'drill':
+                self.drill(name, None, event[1]['X'], event[1]['Y'], event[2].get('R'), event[2].get('Z'), event[3])
+            elif event[0] == 'probe':
+                for axis, to in event[2].items():
+                    self.probe(name, None, axis.lower(), to, event[3])
+            elif event[0] in ('setting', 'pause'):
+                self.stop(name, pause=event[0] == 'pause')
+
+        self.stop(name)
+
+    def add_file(self, file_name, name=None):
+        with open(file_name) as f:
+            self.add_lines(f.read().splitlines(), name=name or file_name)
+
+    # Environment pass that estimates everything emitted through it, per file (by base name) - needs
+    # Environment(deferred=True) to see a whole job, see Environment.add_pass
+    def watch(self, machine):
+        def _pass(toolpath):
+            self.add_toolpath(toolpath, name=os.path.basename(machine.filename) if machine.filename else None)
+            return toolpath
+        return _pass
+
+    def report(self):
+        operations = collections.OrderedDict()
+        for f in self.files.values():
+            for op, seconds in f['operations'].items():
+                operations[op] = operations.get(op, 0) + seconds
+
+        return {
+            'seconds': sum(f['seconds'] for f in self.files.values()),
+            'operations': operations,
+            'files': self.files,
+        }
+
+
+def estimate_toolpath(toolpath, machine, **kwargs):
+    e = Estimator.for_machine(machine, **kwargs)
+    e.add_toolpath(toolpath)
+    return e.report()
+
+
+def estimate_files(file_names, max_feedrates, accelerations=None, **kwargs):
+    e = Estimator(max_feedrates, accelerations, **kwargs)
+    for file_name in file_names:
+        e.add_file(file_name)
+    return e.report()
@@ -0,0 +1,274 @@
+import re
+
+# Just enough of a G-code interpreter to read back what our post-processors write: G0/G1/G2/G3 moves, G38.x
+# probes, G81 drill cycles, feeds, comments, expressions and variable assignments, and the O-word subroutines and G52
+# offsets pcb_panel writes.  It's used to check that two programs move the machine the same way (see
+# CompactGCodePost) and by anything else that needs to read .ngc files.
+
+comment_re = re.compile(r'\([^)]*\)|;.*$')
+assignment_re = re.compile(r'^#\d+\s*=')
+number_re = re.compile(r'[-+]?(\d+\.?\d*|\.\d+)')
+
+# lines that can't change where the machine is or how it moves - comments and assignments to plain variables
+passive_re = re.compile(r'^\s*(\(.*\)|%|#[1-4]?\d{1,3}\s*=.*)\s*$')
+
+motion_codes = ['G0', 'G1', 'G2', 'G3', 'G38.2', 'G38.3', 'G38.4', 'G38.5', 'G80', 'G81']
+
+# codes that use axis words for something other than moving there
+setting_codes = ['G4', 'G10', 'G28', 'G30', 'G92']
+
+# o100 sub / o100 endsub / o100 call
+subroutine_re = re.compile(r'^\s*o(\d+)\s+(sub|endsub|call)\b', re.I)
+
+# codes that stop and wait for the operator
+pause_codes = ['M0', 'M1']
+
+
+def _code(letter, value):
+    txt = ('%f' % value).rstrip('0').rstrip('.')
+    return letter + txt
+
+
+# splits a line into (letter, value) words.  value is a float, or the text of an expression ("[#105-0.005]") or
+# variable ("#105") if it isn't a plain number
+def parse_words(line):
+    line = comment_re.sub('', line).strip()
+    words = []
+    pos = 0
+    while pos < len(line):
+        c = line[pos]
+        if c.isspace():
+            pos += 1
+            continue
+
+        letter = c.upper()
+        if not letter.isalpha():
+            raise Exception("Can't parse G-code {!r} at {}".format(line, pos))
+
+        pos += 1
+        while pos < len(line) and line[pos].isspace():
+            pos += 1
+
+        if pos < len(line) and line[pos] == '[':
+            depth = 0
+            start = pos
+            while pos < len(line):
+                if line[pos] == '[':
+                    depth += 1
+                elif line[pos] == ']':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                pos += 1
+
+            if depth:
+                raise Exception("Unbalanced expression in G-code {!r}".format(line))
+
+            pos += 1
+            words.append((letter, line[start:pos]))
+        elif pos < len(line) and line[pos] == '#':
+            m = re.compile(r'#\d+').match(line, pos)
+            words.append((letter, m.group(0)))
+            pos = m.end()
+        else:
+            m = number_re.match(line, pos)
+            if not m:
+                raise Exception("Can't parse G-code {!r} at {}".format(line, pos))
+            words.append((letter, float(m.group(0))))
+            pos = m.end()
+
+    return words
+
+
+# Subroutines are run every time they're called.  Positions come out with the G52 offset in effect added on, so a
+# panel written as a subroutine reads back the same as one with every board written out
+class Interpreter(object):
+    def __init__(self):
+        self.position = {}
+        self.feed = None
+        self.motion = None
+        self.cycle = {}
+        self.offset = {}
+        self.subroutines = {}
+        self.body = None
+
+    def _offset(self, axis, value):
+        if isinstance(value, basestring) or not self.offset.get(axis):
+            return value
+        return value + self.offset[axis]
+
+    # runs one line, returns a list of events - each is a tuple that starts with its type:
+    #     ('move', motion code, {axis: value}, feed) for G0-G3, arcs have I/J in the dict too
+    #     ('probe', motion code, {axis: value}, feed)
+    #     ('drill', {axis: value}, {R/Z: value}, feed) for every hole of a G81 cycle
+    #     ('assign', text) for variable assignments, they're kept so expressions can be checked in context
+    #     ('setting', text) for G10, G92 and friends
+    #     ('pause', ) for M0/M1
+    def execute(self, line):
+        line = line.strip()
+        subroutine = subroutine_re.match(line)
+        if subroutine:
+            number, word = subroutine.group(1), subroutine.group(2).lower()
+            if word == 'sub':
+                self.body = self.subroutines[number] = []
+            elif word == 'endsub':
+                self.body = None
+            elif self.body is not None:
+                self.body.append(line)
+            else:
+                return [event for body_line in self.subroutines.get(number, []) for event in self.execute(body_line)]
+            return []
+
+        if self.body is not None:
+            self.body.append(line)
+            return []
+
+        if not line or line.startswith('%'):
+            return []
+
+        if assignment_re.match(line):
+            return [('assign', re.sub(r'\s+', '', line))]
+
+        words = parse_words(line)
+        if not words:
+            return []
+
+        codes = []
+        values = {}
+        for letter, value in words:
+            if letter in 'GM' and not isinstance(value, basestring):
+                codes.append(_code(letter, value))
+            else:
+                values[letter] = value
+
+        if 'G52' in codes:
+            for axis in 'XYZ':
+                if axis in values and not isinstance(values[axis], basestring):
+                    self.offset[axis] = values[axis]
+            return []
+
+        if any(code in setting_codes for code in codes):
+            return [('setting', re.sub(r'\s+', '', comment_re.sub('', line)))]
+
+        if any(code in pause_codes for code in codes):
+            return [('pause', )]
+
+        motion = None
+        for code in codes:
+            if code in motion_codes:
+                motion = code
+
+        if motion == 'G80':
+            self.motion = None
+            motion = None
+        elif motion is not None:
+            self.motion = motion
+
+        if 'F' in values:
+            self.feed = values.pop('F')
+
+        axes = dict((k, self._offset(k, v)) for k, v in values.items() if k in 'XYZA')
+        events = []
+        if self.motion == 'G81':
+            if motion == 'G81':
+                self.cycle = dict((k, self._offset('Z', values[k])) for k in 'RZ' if k in values)
+                axes.pop('Z', None)
+
+            # a G81 line drills where it ends up, so do the lines after it with new coordinates
+            if motion == 'G81' or axes:
+                self.position.update(axes)
+                events.append(('drill', dict((k, self.position.get(k)) for k in 'XY'), dict(self.cycle), self.feed))
+        elif self.motion in ('G0', 'G1', 'G2', 'G3') and axes:
+            self.position.update(axes)
+            target = dict(self.position)
+            if self.motion in ('G2', 'G3'):
+                target.update((k, values[k]) for k in 'IJ' if k in values)
+            events.append(('move', self.motion, target, self.feed if self.motion != 'G0' else None))
+        elif self.motion is not None and self.motion.startswith('G38') and motion is not None:
+            events.append(('probe', self.motion, axes, self.feed))
+            for axis in axes:
+                self.position.pop(axis, None)
+
+        return events
+
+
+def events(lines):
+    interpreter = Interpreter()
+    for number, line in enumerate(lines):
+        for event in interpreter.execute(line):
+            yield number + 1, event
+
+
+def _close(a, b, tolerance):
+    if isinstance(a, basestring) or isinstance(b, basestring) or a is None or b is None:
+        return a == b
+    return abs(a - b) <= tolerance
+
+
+def _same_axes(a, b, tolerance):
+    return set(a) == set(b) and all(_close(a[k], b[k], tolerance) for k in a)
+
+
+def _same_event(a, b, tolerance, feed_tolerance):
+    if a[0] != b[0]:
+        return False
+
+    if a[0] in ('move', 'probe'):
+        return a[1] == b[1] and _same_axes(a[2], b[2], tolerance) and _close(a[3], b[3], feed_tolerance)
+    elif a[0] == 'drill':
+        return _same_axes(a[1], b[1], tolerance) and _same_axes(a[2], b[2], tolerance) and _close(a[3], b[3], feed_tolerance)
+
+    return a == b
+
+
+# flags straight moves that barely go anywhere - a compacted program can leave them out, or keep one where the
+# original's rounding didn't
+def _flagged_events(lines, tolerance):
+    last = None
+    for number, event in events(lines):
+        noop = False
+        if event[0] == 'move' and event[1] in ('G0', 'G1') and last is not None:
+            target = event[2]
+            noop = all(not isinstance(v, basestring) for v in target.values()) and _same_axes(target, last, tolerance)
+
+        if event[0] == 'move':
+            last = dict((k, v) for k, v in event[2].items() if k not in 'IJ')
+        elif event[0] in ('drill', 'probe'):
+            last = None
+
+        yield number, event, noop
+
+
+# Checks that two programs make the same moves, positions within tolerance and feeds within feed_tolerance.  Feed
+# changes only count when there's a move to use them, and moves shorter than twice the tolerance can be missing from
+# either side.  Returns a list of (line a, line b, event a, event b) for the differences - empty if they match.
+def compare(lines_a, lines_b, tolerance=1e-4, feed_tolerance=1e-3, max_differences=10):
+    differences = []
+    a = list(_flagged_events(lines_a, tolerance * 2))
+    b = list(_flagged_events(lines_b, tolerance * 2))
+    i = j = 0
+    while i < len(a) and j < len(b) and len(differences) < max_differences:
+        na, ea, noop_a = a[i]
+        nb, eb, noop_b = b[j]
+        if _same_event(ea, eb, tolerance, feed_tolerance):
+            i += 1
+            j += 1
+        elif noop_a:
+            i += 1
+        elif noop_b:
+            j += 1
+        else:
+            differences.append((na, nb, ea, eb))
+            i += 1
+            j += 1
+
+    # whatever is left over has to be moves that don't go anywhere
+    for number, event, noop in a[i:]:
+        if not noop and len(differences) < max_differences:
+            differences.append((number, None, event, None))
+
+    for number, event, noop in b[j:]:
+        if not noop and len(differences) < max_differences:
+            differences.append((None, number, None, event))
+
+    return differences
@@ -1,9 +1,16 @@
 #!/usr/bin/env python
 
 # from descartes import PolygonPatch
+import itertools
 import math
+import multiprocessing
+import numpy
 import ocl
 import shapely.affinity
+import shapely.geometry
+import shapely.ops
+import shapely.wkb
+import struct
 from shapely.coords import CoordinateSequence
 from shapely.geometry import Point, LineString, MultiLineString, Polygon, LinearRing, MultiPolygon
 from lib import svg
@@ -625,7 +632,195 @@ def graph_lines():
 # def float_to_color(f):
 #     pass
 
-def shapely_add_to_dwg(dwg, geoms, bounds=None, background='white', foreground='red', foreground_alpha=1, background_alpha=1, fill_box=False):
+# Union of a lot of geometry.  unary_union is already a cascaded union, but with tens of thousands of pieces it's
+# cheaper (and easier on memory) to union spatially compact chunks first and then union the chunks.  Returns None
+# if there's nothing to union
+def batched_union(geoms, chunk_size=1000):
+    geoms = [g for g in geoms if not g.is_empty]
+    if not geoms:
+        return None
+
+    while len(geoms) > chunk_size:
+        ordered = _spatial_order(geoms, chunk_size)
+        geoms = [shapely.ops.unary_union(ordered[k:k + chunk_size]) for k in range(0, len(ordered), chunk_size)]
+
+    return shapely.ops.unary_union(geoms)
+
+
+# sorts geometry into rows, back and forth, so consecutive runs of chunk_size cover small areas
+def _spatial_order(geoms, chunk_size):
+    centers = [((b[0] + b[2]) / 2., (b[1] + b[3]) / 2.) for b in (g.bounds for g in geoms)]
+    miny = min(c[1] for c in centers)
+    maxy = max(c[1] for c in centers)
+    rows = max(int(math.sqrt(len(geoms) / float(chunk_size))), 1)
+    row_height = (maxy - miny) / rows or 1
+
+    def _key(k):
+        x, y = centers[k]
+        row = min(int((y - miny) / row_height), rows - 1)
+        return row, x if row % 2 == 0 else -x
+
+    return [geoms[k] for k in sorted(range(len(geoms)), key=_key)]
+
+
+# Tiled, parallel version of adding and removing geometry in order.  runs is a list of (add, geoms) - geoms are
+# unioned into the result if add is true and cut out of it if not.  The area is cut into tile_size x tile_size
+# tiles, every tile gets the pieces that reach into it and works through the runs (in a worker process) clipped to
+# its own square, then the tiles are unioned back together along the seams.  Geometry goes to and from the workers
+# as WKB.  processes=None uses every core, 1 does the tiles one after the other in this process.  Returns None if
+# nothing's left
+def tiled_union(runs, tile_size, processes=None, chunk_size=1000):
+    runs = [(add, [g for g in geoms if not g.is_empty]) for add, geoms in runs]
+    bounds = [g.bounds for add, geoms in runs if add for g in geoms]
+    if not bounds:
+        return None
+
+    minx = min(b[0] for b in bounds)
+    miny = min(b[1] for b in bounds)
+    columns = int(math.ceil((max(b[2] for b in bounds) - minx) / tile_size)) or 1
+    rows = int(math.ceil((max(b[3] for b in bounds) - miny) / tile_size)) or 1
+
+    def _range(low, high, origin, count):
+        return range(max(int((low - origin) / tile_size), 0), min(int((high - origin) / tile_size), count - 1) + 1)
+
+    # which tiles each piece's bounds reach into
+    tiles = {}
+    for index, (add, geoms) in enumerate(runs):
+        for g in geoms:
+            gminx, gminy, gmaxx, gmaxy = g.bounds
+            for column in _range(gminx, gmaxx, minx, columns):
+                for row in _range(gminy, gmaxy, miny, rows):
+                    tiles.setdefault((column, row), {}).setdefault(index, []).append(g)
+
+    work = []
+    for (column, row), pieces in sorted(tiles.items()):
+        box = (
+            minx + column * tile_size, miny + row * tile_size,
+            minx + (column + 1) * tile_size, miny + (row + 1) * tile_size,
+        )
+        tile_runs = [(runs[index][0], [shapely.wkb.dumps(g) for g in pieces[index]]) for index in sorted(pieces)]
+        work.append((box, tile_runs, chunk_size))
+
+    if processes == 1:
+        results = [_tile_union(w) for w in work]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_tile_union, work)
+        finally:
+            pool.close()
+            pool.join()
+
+    return _merge_tiles([(w[0], shapely.wkb.loads(r)) for w, r in zip(work, results) if r is not None])
+
+
+def _polygons(geom):
+    if isinstance(geom, Polygon):
+        return [geom]
+    return [g for g in getattr(geom, 'geoms', []) if isinstance(g, Polygon)]
+
+
+# Puts tiles back together.  Only polygons that reach the edge of their tile can join up with anything in another
+# tile, and only their outlines have to be unioned for that - the holes in them don't reach the edge, so they're
+# put back afterwards into whichever merged outline they ended up in.  Unioning outlines without thousands of
+# holes in them is far quicker than unioning the polygons.
+def _merge_tiles(tiles):
+    done = []
+    edge = []
+    for box, geom in tiles:
+        for p in _polygons(geom):
+            minx, miny, maxx, maxy = p.bounds
+            if minx <= box[0] or miny <= box[1] or maxx >= box[2] or maxy >= box[3]:
+                edge.append(p)
+            else:
+                done.append(p)
+
+    outlines = _polygons(shapely.ops.unary_union([Polygon(p.exterior) for p in edge])) if edge else []
+    holes = [list(o.interiors) for o in outlines]
+    for p in edge:
+        if not p.interiors:
+            continue
+
+        point = p.representative_point()
+        for k, o in enumerate(outlines):
+            if o.bounds[0] <= point.x <= o.bounds[2] and o.bounds[1] <= point.y <= o.bounds[3] and o.contains(point):
+                holes[k].extend(p.interiors)
+                break
+
+    polygons = [Polygon(o.exterior, h) for o, h in zip(outlines, holes)] + done
+    if not polygons:
+        return None
+    return polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+
+
+def _tile_union(work):
+    box, runs, chunk_size = work
+    tile = shapely.geometry.box(*box)
+    result = None
+    for add, wkbs in runs:
+        merged = batched_union([shapely.wkb.loads(w) for w in wkbs], chunk_size=chunk_size)
+        if merged is None:
+            continue
+
+        merged = merged.intersection(tile)
+        if add:
+            result = result.union(merged) if result is not None else merged
+        elif result is not None:
+            result = result.difference(merged)
+
+    if result is None or result.is_empty:
+        return None
+    return shapely.wkb.dumps(result)
+
+
+# Outward offsets of geom by step, 2*step ... count*step.  incremental grows each pass out of the one before it
+# (offsetting by a and then by b is offsetting by a+b) instead of offsetting geom again, so every pass starts from an
+# outline that's already lost most of its gaps and small features.  Only the first pass uses round joins - on an
+# outline that's already rounded they'd multiply the vertices every pass, and mitres on corners that shallow are
+# never closer in than the round join and only stick out by a few millionths.  tolerance simplifies geom first and
+# offsets that much further so nothing ends up closer than asked.  processes > 1 splits the passes into that many
+# runs done in parallel, each starting from a plain offset, with geometry going to and from the workers as WKB.
+def offset_passes(geom, step, count, incremental=False, tolerance=None, processes=None):
+    extra = 0
+    if tolerance:
+        geom = geom.simplify(tolerance)
+        extra = tolerance
+
+    if processes > 1 and count > 1:
+        size = int(math.ceil(count / float(processes)))
+        data = shapely.wkb.dumps(geom)
+        work = [(data, step, extra, first, min(first + size - 1, count), incremental) for first in range(1, count + 1, size)]
+        pool = multiprocessing.Pool(len(work))
+        try:
+            results = pool.map(_offset_run_wkb, work)
+        finally:
+            pool.close()
+            pool.join()
+
+        return [shapely.wkb.loads(r) for run in results for r in run]
+
+    return _offset_run(geom, step, extra, 1, count, incremental)
+
+
+def _offset_run(geom, step, extra, first, last, incremental):
+    if not incremental:
+        return [geom.buffer(k * step + extra) for k in range(first, last + 1)]
+
+    passes = [geom.buffer(first * step + extra)]
+    for k in range(first + 1, last + 1):
+        passes.append(passes[-1].buffer(step, join_style=shapely.geometry.JOIN_STYLE.mitre))
+    return passes
+
+
+def _offset_run_wkb(work):
+    data, step, extra, first, last, incremental = work
+    return [shapely.wkb.dumps(g) for g in _offset_run(shapely.wkb.loads(data), step, extra, first, last, incremental)]
+
+
+# batch=True draws all of geoms as one filled <path> (polygons and points) and one stroked one (lines) made by
+# shapely_path_data, instead of an element per polygon, hole, line and point.  Holes are left unpainted rather than
+# painted background.  coords is passed on to shapely_path_data.
+def shapely_add_to_dwg(dwg, geoms, bounds=None, background='white', foreground='red', foreground_alpha=1, background_alpha=1, fill_box=False, batch=False, precision=4, coords=None):
     def _drawpoly(poly, stroke='black'):
         poly = poly.simplify(0.001)
         coords = [foo[:2] for foo in poly.exterior.coords]
@@ -676,7 +871,8 @@ def shapely_add_to_dwg(dwg, geoms, bounds=None, background='white', foreground='
     if not isinstance(geoms, (tuple, list)):
         geoms = [geoms]
 
-    geoms = [shapely.affinity.scale(g, yfact=-1, origin=(0, 0)) for g in geoms]
+    if not batch:
+        geoms = [shapely.affinity.scale(g, yfact=-1, origin=(0, 0)) for g in geoms]
 
     # bounds = shapely_svg_bounds(geoms)
 
@@ -688,21 +884,175 @@ def shapely_add_to_dwg(dwg, geoms, bounds=None, background='white', foreground='
             fill=background,
         ))
 
-    _draw_geoms(geoms)
+    if not batch:
+        _draw_geoms(geoms)
+        return
+
+    fill, lines = shapely_path_data(geoms, precision=precision, coords=coords)
+    if fill:
+        dwg.add(dwg.path(d=fill, fill=foreground, fill_opacity=foreground_alpha))
+    if lines:
+        dwg.add(dwg.path(d=lines, fill='none', stroke=foreground, stroke_width=0.001))
+
+
+# kinds of part in shapely_coords
+EXTERIOR, INTERIOR, LINE, POINT = range(4)
+
+
+# Every coordinate in geoms as one (N, 2) array, flipped like the svg if flip, along with the kind, first row and
+# number of rows of each ring, line and point (parts) and the z of each point (0 if it has none).  Each geometry is
+# written out as WKB in one call, _wkb_parts finds where each part's coordinates are in it and they're all read out of
+# the joined up WKB together.
+def shapely_coords(geoms, flip=True):
+    if not isinstance(geoms, (tuple, list)):
+        geoms = [geoms]
+
+    data = ''.join(shapely.wkb.dumps(g, big_endian=False) for g in geoms)
+    parts = []
+    offset = 0
+    while offset < len(data):
+        offset = _wkb_parts(data, offset, parts)
+    parts = [p for p in parts if p[2]]
+
+    if not parts:
+        return numpy.zeros((0, 2)), numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), numpy.zeros(0)
+
+    kinds, offsets, counts, dims = [numpy.array(x, dtype=int) for x in zip(*parts)]
+    starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
 
+    # where each x starts in data, then the 16 bytes of each x and y
+    part = numpy.repeat(numpy.arange(len(parts)), counts)
+    row = numpy.arange(len(part)) - starts[part]
+    first = offsets[part] + row * dims[part] * 8
+    raw = numpy.frombuffer(data, dtype=numpy.uint8)
+    xy = raw[first[:, None] + numpy.arange(16)].view('<f8').reshape(-1, 2)
 
+    z = numpy.zeros(len(parts))
+    points = (kinds == POINT) & (dims > 2)
+    if points.any():
+        z[points] = raw[offsets[points][:, None] + numpy.arange(16, 24)].view('<f8').ravel()
+
+    if flip:
+        xy[:, 1] *= -1
+    return xy, kinds, starts, counts, z
+
+
+_WKB_Z = 0x80000000
+
+
+# appends (kind, offset of first coordinate, number of coordinates, dimensions) to parts for each of the rings, lines
+# and points in the little endian WKB geometry at offset in data, returns the offset just past it
+def _wkb_parts(data, offset, parts):
+    wkb_type, = struct.unpack_from('<I', data, offset + 1)
+    dims = 3 if wkb_type & _WKB_Z else 2
+    wkb_type &= 0xff
+    offset += 5
+
+    if wkb_type == 1:
+        parts.append((POINT, offset, 1, dims))
+        return offset + 8 * dims
+    elif wkb_type == 2:
+        count, = struct.unpack_from('<I', data, offset)
+        parts.append((LINE, offset + 4, count, dims))
+        return offset + 4 + 8 * dims * count
+    elif wkb_type == 3:
+        rings, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        for ring in range(rings):
+            count, = struct.unpack_from('<I', data, offset)
+            parts.append((INTERIOR if ring else EXTERIOR, offset + 4, count, dims))
+            offset += 4 + 8 * dims * count
+        return offset
+    elif 4 <= wkb_type <= 7:
+        geoms, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        for g in range(geoms):
+            offset = _wkb_parts(data, offset, parts)
+        return offset
+    else:
+        raise Exception("unsupported WKB type: %r" % (wkb_type, ))
+
+
+# Path data for geoms, flipped like the svg, with coordinates to precision decimal places: (fill, lines) - polygons
+# and points (as circles of radius z, or 0.02 if they haven't got one) in one, lines in the other.  Exteriors go
+# counterclockwise and holes clockwise so with the nonzero fill rule overlapping polygons are all painted and holes
+# aren't.  Points repeated once rounded are dropped.  coords is what shapely_coords(geoms, flip) returns if that's
+# already been read.
+def shapely_path_data(geoms, flip=True, precision=4, coords=None):
+    xy, kinds, starts, counts, z = coords if coords is not None else shapely_coords(geoms, flip=flip)
+    if not len(xy):
+        return '', ''
+
+    xy = numpy.round(xy, precision) + 0.
+    rings = kinds <= INTERIOR
+    part = numpy.repeat(numpy.arange(len(kinds)), counts)
+
+    # repeats, and the point closing each ring (z closes it)
+    keep = numpy.ones(len(xy), dtype=bool)
+    keep[1:] = (xy[1:] != xy[:-1]).any(axis=1)
+    keep[starts] = True
+    keep[(starts + counts - 1)[rings & (counts > 1)]] = False
+    xy, part = xy[keep], part[keep]
+    counts = numpy.bincount(part, minlength=len(kinds))
+    starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
+
+    # twice the area of each ring, positive for counterclockwise in svg coordinates
+    row = numpy.arange(len(xy)) - starts[part]
+    following = numpy.where(row + 1 < counts[part], numpy.arange(len(xy)) + 1, starts[part])
+    cross = xy[:, 0] * xy[following, 1] - xy[following, 0] * xy[:, 1]
+    area = numpy.bincount(part, weights=cross, minlength=len(kinds))
+    reverse = rings & numpy.where(kinds == EXTERIOR, area < 0, area > 0)
+    order = numpy.where(reverse[part], starts[part] + counts[part] - 1 - row, numpy.arange(len(xy)))
+    xy = xy[order]
+
+    number = '%.{}f'.format(precision)
+    pairs = ((number + ' ' + number + '\n') * len(xy) % tuple(xy.ravel())).split('\n')
+
+    fill, lines = [], []
+    for kind, start, count, radius in itertools.izip(kinds.tolist(), starts.tolist(), counts.tolist(), z.tolist()):
+        if kind == POINT:
+            r = radius or 0.02
+            x, y = pairs[start].split(' ')
+            fill.append('M{} {}a{r} {r} 0 1 1 {d} 0a{r} {r} 0 1 1 -{d} 0z'.format(
+                number % (float(x) - r), y, r=number % r, d=number % (2 * r),
+            ))
+        elif kind == LINE:
+            if count > 1:
+                lines.append('M' + pairs[start] + 'L' + ' '.join(pairs[start + 1:start + count]))
+        elif count > 2:
+            fill.append('M' + pairs[start] + 'L' + ' '.join(pairs[start + 1:start + count]) + 'z')
+
+    return ''.join(fill), ''.join(lines)
+
+
+# Flipping a geometry only flips its bounds, so each one's bounds are read straight from shapely
 def shapely_svg_bounds(geoms, flip=True):
+    bounds = [g.bounds for g in geoms if not g.is_empty]
     if flip:
-        geoms = [shapely.affinity.scale(g, yfact=-1, origin=(0, 0)) for g in geoms]
+        # + 0. so a bound of 0 doesn't turn into -0 in the viewBox
+        bounds = [(tminx, -tmaxy + 0., tmaxx, -tminy + 0.) for tminx, tminy, tmaxx, tmaxy in bounds]
 
-    minx, miny, maxx, maxy = geoms[0].bounds
-    for g in geoms[1:]:
-        tminx, tminy, tmaxx, tmaxy = g.bounds
+    minx, miny, maxx, maxy = bounds[0]
+    for tminx, tminy, tmaxx, tmaxy in bounds[1:]:
         if tminx < minx: minx = tminx
         if tminy < miny: miny = tminy
         if tmaxx > maxx: maxx = tmaxx
         if tmaxy > maxy: maxy = tmaxy
 
+    return _svg_bounds(minx, miny, maxx, maxy)
+
+
+# the same from the coordinates shapely_coords read, for when they've been read anyway
+def coords_svg_bounds(xy):
+    if not len(xy):
+        return _svg_bounds(0., 0., 0., 0.)
+
+    minx, miny = [float(v) for v in xy.min(axis=0)]
+    maxx, maxy = [float(v) for v in xy.max(axis=0)]
+    return _svg_bounds(minx, miny, maxx, maxy)
+
+
+def _svg_bounds(minx, miny, maxx, maxy):
     box_width = maxx - minx
     box_height = maxy - miny
 
@@ -716,13 +1066,125 @@ def shapely_svg_bounds(geoms, flip=True):
     }
 
 
-def shapely_get_dwg(svg_file, bounds, marginpct, width=None, height=None):
+# segments are (N, 4) arrays of x1, y1, x2, y2 as recorded by toolpath.MoveRecorder
+def segments_svg_bounds(segments, flip=True):
+    if not len(segments):
+        minx = miny = maxx = maxy = 0
+    else:
+        xs = segments[:, 0::2]
+        ys = -segments[:, 1::2] if flip else segments[:, 1::2]
+        minx, miny, maxx, maxy = xs.min(), ys.min(), xs.max(), ys.max()
+
+    return {
+        'minx': minx,
+        'miny': miny,
+        'maxx': maxx,
+        'maxy': maxy,
+        'box_width': maxx - minx,
+        'box_height': maxy - miny,
+    }
+
+
+# Path data drawing segments (flipped, like segments_svg_bounds) in whole pixels from origin.  Segments that join
+# up once they're on the pixel grid become one subpath, and points are dropped while what's drawn stays within
+# tolerance pixels of every one of them - so how long it comes out depends on the picture, not the move count.
+def segments_path_data(segments, pixel, origin=(0, 0), tolerance=0.5):
+    if not len(segments):
+        return ''
+
+    q = numpy.rint((segments * (1, -1, 1, -1) - (origin * 2)) / pixel).astype(numpy.int64)
+    starts, ends = q[:, :2], q[:, 2:]
+
+    # a point for every segment end, and one more where a segment doesn't start where the last one ended
+    breaks = numpy.ones(len(q), dtype=bool)
+    breaks[1:] = (starts[1:] != ends[:-1]).any(axis=1)
+    at = numpy.arange(len(q)) + numpy.cumsum(breaks)
+    points = numpy.empty((len(q) + breaks.sum(), 2), dtype=numpy.int64)
+    moves = numpy.zeros(len(points), dtype=bool)
+    points[at] = ends
+    points[at[breaks] - 1] = starts[breaks]
+    moves[at[breaks] - 1] = True
+
+    # repeats
+    keep = numpy.ones(len(points), dtype=bool)
+    keep[1:] = moves[1:] | (points[1:] != points[:-1]).any(axis=1)
+    points, moves = _simplify_runs(points[keep], moves[keep], tolerance)
+
+    # moves that nothing is drawn from
+    drawn = numpy.ones(len(points), dtype=bool)
+    drawn[:-1] = ~(moves[:-1] & moves[1:])
+    drawn[-1] = not moves[-1]
+    points, moves = points[drawn], moves[drawn]
+
+    # relative coordinates are shorter, the pairs after an m are lines
+    deltas = numpy.vstack([points[:1], numpy.diff(points, axis=0)])
+    return ' '.join(
+        ('m%d %d' if move else '%d %d') % (dx, dy) for (dx, dy), move in zip(deltas.tolist(), moves.tolist())
+    )
+
+
+# Drops points that are within tolerance of the line between the points either side of them, a pass at a time
+# with no two neighbours going in the same pass.  How far off each kept point's lines could already be from the
+# points dropped next to them is carried along, so nothing ever ends up more than tolerance from what's drawn.
+def _simplify_runs(points, moves, tolerance):
+    error = numpy.zeros(len(points))
+    for parity in itertools.cycle([0, 1]):
+        n = len(points)
+        if n < 3:
+            break
+
+        # k-1, k, k+1 all in the same run
+        k = numpy.arange(1, n - 1)
+        inner = ~moves[k] & ~moves[k + 1]
+        a, p, b = points[k - 1].astype(float), points[k].astype(float), points[k + 1].astype(float)
+
+        # distance from p to the segment a-b
+        ab = b - a
+        length = (ab ** 2).sum(axis=1)
+        t = numpy.clip(((p - a) * ab).sum(axis=1) / numpy.where(length > 0, length, 1), 0, 1)
+        off = numpy.hypot(*(a + t[:, None] * ab - p).T)
+
+        candidate = inner & (off + error[k] <= tolerance)
+        if not candidate.any():
+            break
+
+        alone = candidate.copy()
+        alone[1:] &= ~candidate[:-1]
+        alone[:-1] &= ~candidate[1:]
+        drop = candidate & ((k % 2 == parity) | alone)
+
+        dropped = k[drop]
+        carried = error[dropped] + off[drop]
+        numpy.maximum.at(error, dropped - 1, carried)
+        numpy.maximum.at(error, dropped + 1, carried)
+
+        keep = numpy.ones(n, dtype=bool)
+        keep[dropped] = False
+        points, moves, error = points[keep], moves[keep], error[keep]
+
+    return points, moves
+
+
+# pixel = the size of a pixel in drawing units, everything is drawn to the nearest one.  One <path> for the lot
+def segments_add_to_dwg(dwg, segments, foreground='red', stroke_width=0.001, pixel=0.001, origin=(0, 0)):
+    d = segments_path_data(segments, pixel, origin=origin)
+    if not d:
+        return
+
+    group = dwg.g(transform='translate({:.6f} {:.6f}) scale({:.6g})'.format(origin[0], origin[1], pixel))
+    group.add(dwg.path(d=d, fill='none', stroke=foreground, stroke_width=stroke_width / pixel))
+    dwg.add(group)
+
+
+# debug=False skips svgwrite checking every attribute as it's saved, which takes far longer than making a big path
+def shapely_get_dwg(svg_file, bounds, marginpct, width=None, height=None, debug=True):
     marginx = bounds['box_width']*marginpct/100.0
     marginy = bounds['box_height']*marginpct/100.0
 
     return svgwrite.Drawing(
         svg_file,
         profile='tiny',
+        debug=debug,
         size=(width, height),
         viewBox="{} {} {} {}".format(
             bounds['minx'] - marginx,
@@ -733,16 +1195,23 @@ def shapely_get_dwg(svg_file, bounds, marginpct, width=None, height=None):
     )
 
 
-def shapely_to_svg(svg_file, geoms, width=1000, height=1000, marginpct=10):
-    bounds = shapely_svg_bounds(geoms)
+# Draws geoms batched (see shapely_add_to_dwg) unless batch is False, reading their coordinates once for both the
+# bounds and the paths
+def shapely_to_svg(svg_file, geoms, width=1000, height=1000, marginpct=10, batch=True):
+    coords = None
+    if batch:
+        coords = shapely_coords(geoms)
+        bounds = coords_svg_bounds(coords[0])
+    else:
+        bounds = shapely_svg_bounds(geoms)
 
     dwg = shapely_get_dwg(
         svg_file=svg_file,
         bounds=bounds,
         marginpct=marginpct,
-        width=width, height=height
+        width=width, height=height, debug=not batch,
     )
 
-    shapely_add_to_dwg(dwg=dwg, geoms=geoms)
+    shapely_add_to_dwg(dwg=dwg, geoms=geoms, batch=batch, coords=coords)
     dwg.save()
 
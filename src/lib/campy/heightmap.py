@@ -0,0 +1,75 @@
+import numpy
+import shapely.geometry
+import shapely.ops
+from shapely.strtree import STRtree
+
+# Z compensation from a grid of probed heights.  The probes store their Z in G-code variables, so heights aren't
+# known until the program runs - what we can work out here is which three probes every point sits between and how
+# much each of them counts (barycentric weights).  Every cut then gets a Z like
+#     [0.2500*#503+0.6250*#504+0.1250*#510-0.01]
+# instead of a handful of lines working the weights out on the controller for every vertex.
+#
+# Probe points are (x, y, variable number) like pcb_isolation_mill makes them.  Triangles are found with an STRtree
+# and each one keeps the matrix that turns (x, y, 1) into its three weights, so a whole ring is interpolated with a
+# few numpy products.
+
+
+class HeightMap(object):
+    def __init__(self, points):
+        self.points = shapely.geometry.MultiPoint(points)
+        self.triangles = shapely.ops.triangulate(self.points, edges=False)
+        self.tree = STRtree(self.triangles)
+        self.index = dict((id(t), k) for k, t in enumerate(self.triangles))
+
+        corners = numpy.array([t.exterior.coords[:3] for t in self.triangles])
+        self.variables = numpy.rint(corners[:, :, 2]).astype(int)
+
+        # weights = coefficients . (x, y, 1), the inverse of [[x1 x2 x3] [y1 y2 y3] [1 1 1]]
+        m = numpy.ones((len(self.triangles), 3, 3))
+        m[:, 0, :] = corners[:, :, 0]
+        m[:, 1, :] = corners[:, :, 1]
+        self.coefficients = numpy.linalg.inv(m)
+
+    # (triangle index, weights) for an (N, 2) array of points, raises if a point isn't on the map
+    def weights(self, coords, epsilon=1e-9):
+        coords = numpy.asarray(coords, dtype=float)[:, :2]
+        xy1 = numpy.ones((len(coords), 3))
+        xy1[:, :2] = coords
+
+        triangles = numpy.full(len(coords), -1, dtype=int)
+        weights = numpy.zeros((len(coords), 3))
+        minx, miny = coords.min(axis=0)
+        maxx, maxy = coords.max(axis=0)
+        for t in self.tree.query(shapely.geometry.box(minx, miny, maxx, maxy)):
+            k = self.index[id(t)]
+            todo = triangles < 0
+            w = xy1[todo].dot(self.coefficients[k].T)
+            inside = (w >= -epsilon).all(axis=1)
+
+            rows = numpy.nonzero(todo)[0][inside]
+            triangles[rows] = k
+            weights[rows] = w[inside]
+            if (triangles >= 0).all():
+                break
+
+        if (triangles < 0).any():
+            raise Exception("Did not find triangle for point {}".format(list(coords[numpy.argmax(triangles < 0)])))
+
+        return triangles, weights
+
+    # Z expressions for every point, with offset added on
+    def expressions(self, coords, offset=0, precision=4):
+        triangles, weights = self.weights(coords)
+        template = "{:.%df}*#{}" % precision
+        offset_template = "{:+.%df}" % precision
+        cutoff = 0.5 * 10 ** -precision
+
+        expressions = []
+        for k, w in zip(triangles, weights):
+            terms = [template.format(weight, var) for weight, var in zip(w, self.variables[k]) if abs(weight) >= cutoff]
+            expression = "+".join(terms)
+            if offset:
+                expression += offset_template.format(offset)
+            expressions.append("[{}]".format(expression))
+
+        return expressions
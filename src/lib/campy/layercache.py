@@ -0,0 +1,207 @@
+import collections
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import gerber
+import shapely.wkb
+
+logger = logging.getLogger(__name__)
+
+# Parsed gerber layers, and the geometry made from them, keyed by the SHA-256 of the file contents - the same file
+# is only parsed once however many projects it's in and whichever side or theme it's rendered with.
+#
+# Parsed layers are pcb-tools objects and only live in memory, the max_layers most recently used ones.  Geometry
+# also goes to disk when there's a directory: one file per file contents and kind, a line of JSON saying what's in
+# it followed by the WKB of each geometry.  The least recently used files go once they add up to over max_bytes.
+# What they add up to is kept in a file in the directory (see update_size), so every process using the directory
+# keeps it up to date and nothing has to look through it until it's over.
+#
+# LayerCache() - and so default, until something gives it a directory - only keeps parsed layers, in memory, and
+# makes geometry every time it's asked for.  The api sets default.directory from layer_cache_dir.
+
+
+class LayerCache(object):
+    def __init__(self, directory=None, max_bytes=256*1024*1024, max_layers=16):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_layers = max_layers
+        self.layers = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    # the file name is part of the key too, pcb-tools guesses the layer class from it
+    @classmethod
+    def key(cls, data, file_name=None):
+        h = hashlib.sha256(data)
+        h.update('\0' + os.path.basename(file_name or ''))
+        return h.hexdigest()
+
+    def layer(self, data, file_name=None):
+        key = self.key(data, file_name)
+        with self.lock:
+            layer = self.layers.pop(key, None)
+            if layer is not None:
+                self.layers[key] = layer
+                return layer
+
+        layer = gerber.load_layer_data(data, file_name)
+        with self.lock:
+            self.layers[key] = layer
+            while len(self.layers) > self.max_layers:
+                self.layers.popitem(last=False)
+
+        return layer
+
+    # make() is only called if the geometry for this file and kind isn't on disk already
+    def geometry(self, data, file_name, kind, make):
+        if not self.directory:
+            return make()
+
+        key = self.key(data, file_name)
+        path = os.path.join(self.directory, key[:2], '{}-{}.wkb'.format(key, kind))
+        geom = self._load(path)
+        if geom is not None:
+            return geom
+
+        geom = make()
+        self._save(path, geom, file_name=file_name, kind=kind)
+        return geom
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                geoms = [shapely.wkb.loads(f.read(size)) for size in header['sizes']]
+        except IOError:
+            return None
+        except Exception:
+            logger.warn("unreadable layer cache file %r, removing it", path, exc_info=True)
+            self._remove(path)
+            return None
+
+        # mark it as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return geoms if header['list'] else geoms[0]
+
+    def _save(self, path, geom, **meta):
+        is_list = isinstance(geom, list)
+        wkbs = [shapely.wkb.dumps(g) for g in (geom if is_list else [geom])]
+        header = dict(meta, list=is_list, sizes=[len(w) for w in wkbs])
+
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+
+        # written to the side and moved into place so nobody reads half a file
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(header) + '\n')
+            for w in wkbs:
+                f.write(w)
+            size = f.tell()
+        replaced = _file_size(path)
+        os.rename(tmp, path)
+
+        update_size(self.directory, size - replaced, self.max_bytes)
+
+    def _remove(self, path):
+        size = _file_size(path)
+        try:
+            os.unlink(path)
+        except OSError:
+            return
+        update_size(self.directory, -size)
+
+
+size_file = 'size'
+
+
+# Adds size bytes (negative for files removed) to what the files in directory add up to, and if that's over
+# max_bytes removes the least recently used ones until it's down to keep (max_bytes if not given).  Returns the
+# new total.  The total is kept in size_file, locked while it's changed, and the directory is only looked through
+# when it's over or when there's no size_file yet - in which case what's there already includes size.
+def update_size(directory, size, max_bytes=None, keep=None):
+    with _locked_size_file(directory) as f:
+        try:
+            total = int(f.read()) + size
+        except ValueError:
+            total = sum(size for mtime, size, path in _directory_files(directory))
+
+        if max_bytes is not None and total > max_bytes:
+            total = _evict(directory, max_bytes if keep is None else keep)
+
+        f.seek(0)
+        f.truncate()
+        f.write(str(total))
+
+    return total
+
+
+@contextlib.contextmanager
+def _locked_size_file(directory):
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+
+    with os.fdopen(os.open(os.path.join(directory, size_file), os.O_RDWR | os.O_CREAT), 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# (mtime, size, path) of every cached file, not size_file or files still being written
+def _directory_files(directory):
+    files = []
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if path == os.path.join(directory, size_file) or name.endswith('.tmp'):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+    return files
+
+
+def _evict(directory, keep):
+    files = _directory_files(directory)
+    total = sum(size for mtime, size, path in files)
+    for mtime, size, path in sorted(files):
+        if total <= keep:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+    return total
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+# what pcb_layer and PCBProject.process_layers use, memory only (and no geometry) until it's given a directory
+default = LayerCache()
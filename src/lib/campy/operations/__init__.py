@@ -2,7 +2,7 @@ from functools import wraps
 import inspect
 import math
 
-from .. import machine
+from .. import machine, using_machine
 from ..cammath import frange
 
 # center is always (x, y), z separate?
@@ -11,7 +11,9 @@ from ..cammath import frange
 # stepdown is X% for a percentage of bit diameter, X for absolute
 
 
-def operation(required=None, operation_feedrate=None, comment=None):
+# comment_point = the argument comment quotes as an (x, y) point, so copies of the operation's moves (see
+# Toolpath.translated) can move it too
+def operation(required=None, operation_feedrate=None, comment=None, comment_point=None):
     required = required or []
 
     def wrapout(fn):
@@ -19,7 +21,14 @@ def operation(required=None, operation_feedrate=None, comment=None):
 
         @wraps(fn)
         def wrapper(*args, **kwargs):
+            # _machine=... runs this operation (and everything it calls) on that machine
+            if kwargs.get('_machine') is not None:
+                with using_machine(kwargs.pop('_machine')):
+                    return wrapper(*args, **kwargs)
+            kwargs.pop('_machine', None)
+
             machine().push_level()
+            machine().push_operation(fn.__name__)
 
             foo = {}
             for name, default in zip(reversed(names), reversed(defaults)):
@@ -38,7 +47,8 @@ def operation(required=None, operation_feedrate=None, comment=None):
                 raise Exception("Required parameters missing: {}".format(missing))
 
             if comment is not None:
-                machine().comment(comment.format(**kwargs))
+                point = kwargs.get(comment_point) if comment_point else None
+                machine().comment(comment.format(**kwargs), point=point)
             elif '_comment' in foo and foo['_comment']:
                 machine().comment(foo['_comment'])
 
@@ -59,6 +69,7 @@ def operation(required=None, operation_feedrate=None, comment=None):
 
             retval = fn(*args, **kwargs)
 
+            machine().pop_operation()
             machine().pop_level()
             if pop_speed:
                 machine().pop_speed()
@@ -131,6 +142,7 @@ def drill_cycle(centers=None, z=None, retract_distance=None, depth=None, clearz=
     required=['center', 'z', 'outer_rad', 'depth', 'stepdown'],
     operation_feedrate='plunge',
     comment="Cutting HelicalDrill at {center}, outter_rad={outer_rad:.3f}, depth={depth:.3f}",
+    comment_point='center',
 )
 def helical_drill(center=None, z=None, outer_rad=None, depth=None, stepdown="25%", clockwise=True, clearz=None, auto_clear=True):
     R = machine().tool.diameter / 2.0
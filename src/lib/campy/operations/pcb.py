@@ -1,17 +1,23 @@
 import gerber
 from gerber.render import render, theme, RenderSettings
 import gerber.primitives as primitives
+import functools
+import hashlib
+import itertools
 import logging
 import math
+import multiprocessing
+import numpy
 import os
 import shapely.affinity
 import shapely.geometry
 import shapely.ops
+import shapely.wkb
 import svgwrite
 import zipfile
 
 from . import operation, machine, helical_drill, rect_stock, zprobe, drill_cycle
-from lib.campy import geometry, constants, environment, cammath
+from lib.campy import geometry, constants, environment, cammath, optimize, arcfit, heightmap, layercache, using_machine
 # from lib.campy import *
 
 logger = logging.getLogger(__name__)
@@ -55,24 +61,39 @@ class OurRenderContext(render.GerberContext):
         raise Exception("Missing render")
 
 
+# With batch=True primitives aren't an element each: a run of primitives in the same colour goes into one <path> for
+# the fills (pads, circles, regions) and one for the strokes (traces, arcs) of each width, with coordinates written
+# to a bit better than a pixel of the width x height image.  The fills are all wound the same way so the nonzero
+# fill rule paints them all, overlapping or not.
 class GerberSVGContext(OurRenderContext):
-    def __init__(self, svg_file, width, height, flipx=False, units='inch'):
+    def __init__(self, svg_file=None, width=None, height=None, flipx=False, units='inch', batch=False):
         super(GerberSVGContext, self).__init__(units=units)
 
         self.dwg = svgwrite.Drawing(
             svg_file,
             profile='full',
             size=(width, height),
+            debug=not batch,
         )
 
         self.mask_count = 0
         self.layer_mask = None
         self.layer_mask_name = None
         self.flipx = flipx
+        self.size = (width, height)
+        self.batch = batch
+        self.batch_color = None
+        self.batch_fills = []
+        self.batch_strokes = {}
+        self.number_format = '%.6f'
 
     def save(self):
         self.dwg.save()
 
+    # the svg, without writing it anywhere
+    def tostring(self):
+        return self.dwg.tostring()
+
     def render_layers(self, layers, theme=theme.THEMES['default']):
         # Calculate scale parameter
         x_range = [10000, -10000]
@@ -91,6 +112,13 @@ class GerberSVGContext(OurRenderContext):
 
         self.bounds = [x_range[0], y_range[0], width, height]
 
+        try:
+            pixel = max(width / float(self.size[0]), height / float(self.size[1]))
+        except (TypeError, ValueError, ZeroDivisionError):
+            pixel = None
+        if pixel > 0:
+            self.number_format = '%.{}f'.format(max(0, int(math.ceil(-math.log10(pixel))) + 1))
+
         bgsettings = theme['background']
         c = list(bgsettings.color)
 
@@ -141,6 +169,7 @@ class GerberSVGContext(OurRenderContext):
 
         for prim in layer.primitives:
             self.render(prim)
+        self._flush()
 
         self.group.add(
             self.dwg.rect(
@@ -157,7 +186,12 @@ class GerberSVGContext(OurRenderContext):
         if line.level_polarity != 'dark':
             logger.warn("line polarity! = %r", line.level_polarity)
 
-        if isinstance(line.aperture, primitives.Circle):
+        if isinstance(line.aperture, primitives.Circle) and self.batch:
+            self._add_stroke(
+                'white' if not self.invert and line.level_polarity == 'dark' else 'black', line.aperture.diameter,
+                'M{}L{}'.format(self._point(start), self._point(end)),
+            )
+        elif isinstance(line.aperture, primitives.Circle):
             self.layer_mask.add(
                 self.dwg.line(
                     start, end,
@@ -199,10 +233,18 @@ class GerberSVGContext(OurRenderContext):
                 ))
                 self.dwg.defs.add(mask)
 
+        fill = 'white' if not self.invert and primitive.level_polarity == 'dark' else 'black'
+        if self.batch:
+            f = self.number_format
+            self._add_fill(fill, 'M{}h{}v{}h{}z'.format(
+                self._point((x1, y1)), f % primitive.width, f % primitive.height, f % -primitive.width,
+            ))
+            return
+
         self.layer_mask.add(self.dwg.rect(
             (x1, y1),
             (primitive.width, primitive.height),
-            fill='white' if not self.invert and primitive.level_polarity == 'dark' else 'black',
+            fill=fill,
         ))
 
     def _render_circle(self, primitive, color):
@@ -233,9 +275,18 @@ class GerberSVGContext(OurRenderContext):
             ))
             self.dwg.defs.add(mask)
 
+        fill = 'white' if not self.invert and primitive.level_polarity == 'dark' else 'black'
+        if self.batch:
+            # two half circles, counterclockwise like the rectangles
+            r = self.number_format % primitive.radius
+            self._add_fill(fill, 'M{}a{r} {r} 0 1 1 {d} 0a{r} {r} 0 1 1 -{d} 0z'.format(
+                self._point((center[0] - primitive.radius, center[1])), r=r, d=self.number_format % (2 * primitive.radius),
+            ))
+            return
+
         self.layer_mask.add(self.dwg.circle(
             center=center, r=primitive.radius,
-            fill='white' if not self.invert and primitive.level_polarity == 'dark' else 'black',
+            fill=fill,
         ))
 
     def _render_region(self, region, color):
@@ -246,9 +297,19 @@ class GerberSVGContext(OurRenderContext):
             else:
                 logger.warn('notline')
 
+        fill = 'white' if not self.invert and region.level_polarity == 'dark' else 'black'
+        if self.batch:
+            # z closes it, and counterclockwise so overlapping the other fills doesn't cut a hole in them
+            if len(coords) > 1 and coords[-1] == coords[0]:
+                coords = coords[:-1]
+            if sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(coords, coords[1:] + coords[:1])) < 0:
+                coords.reverse()
+            self._add_fill(fill, 'M{}L{}z'.format(self._point(coords[0]), ' '.join(self._point(c) for c in coords[1:])))
+            return
+
         self.layer_mask.add(self.dwg.polygon(
             coords,
-            fill='white' if not self.invert and region.level_polarity == 'dark' else 'black',
+            fill=fill,
         ))
 
     def _render_arc(self, arc, color):
@@ -282,6 +343,13 @@ class GerberSVGContext(OurRenderContext):
 
         coords = [(arc.center[0] + arc.radius*math.cos(a), arc.center[1] + arc.radius*math.sin(a)) for a in angles]
 
+        if self.batch:
+            self._add_stroke(
+                'white' if not self.invert and arc.level_polarity == 'dark' else 'black', width,
+                'M{}L{}'.format(self._point(coords[0]), ' '.join(self._point(c) for c in coords[1:] or coords)),
+            )
+            return
+
         self.layer_mask.add(
             self.dwg.polyline(
                 coords,
@@ -295,36 +363,121 @@ class GerberSVGContext(OurRenderContext):
     def _render_drill(self, primitive, color):
         self._render_circle(primitive, color)
 
+    def _point(self, p):
+        return (self.number_format + ' ' + self.number_format) % (p[0], p[1])
+
+    # primitives in the same colour can be painted in any order, so they're held until the colour changes
+    def _add_fill(self, color, data):
+        if color != self.batch_color:
+            self._flush()
+            self.batch_color = color
+        self.batch_fills.append(data)
+
+    def _add_stroke(self, color, width, data):
+        if color != self.batch_color:
+            self._flush()
+            self.batch_color = color
+        self.batch_strokes.setdefault(width, []).append(data)
+
+    def _flush(self):
+        if self.batch_fills:
+            self.layer_mask.add(self.dwg.path(d=''.join(self.batch_fills), fill=self.batch_color))
+        for width in sorted(self.batch_strokes):
+            self.layer_mask.add(self.dwg.path(
+                d=''.join(self.batch_strokes[width]), fill='none', stroke=self.batch_color, stroke_width=width,
+                stroke_linejoin='round', stroke_linecap='round',
+            ))
+
+        self.batch_color = None
+        self.batch_fills = []
+        self.batch_strokes = {}
+
+
+def _centered_box(width, height):
+    return shapely.geometry.box(-width/2., -height/2., width/2., height/2.)
 
+
+# a shape to flash - the geometry, and the coordinates of its rings if it's a plain polygon
+def _template(geom):
+    if isinstance(geom, shapely.geometry.Polygon) and not geom.is_empty:
+        return geom, [numpy.asarray(geom.exterior.coords)] + [numpy.asarray(r.coords) for r in geom.interiors]
+    return geom, None
+
+
+# moving the coordinates and making a new polygon is a lot quicker than shapely.affinity.translate
+def _place(template, x, y):
+    geom, rings = template
+    if rings is None:
+        return shapely.affinity.translate(geom, xoff=x, yoff=y)
+
+    offset = (x, y)
+    return shapely.geometry.Polygon(rings[0] + offset, [r + offset for r in rings[1:]])
+
+
+# tile_size = union big layers in tiles, in processes worker processes - see geometry.tiled_union
 class GerberGeometryContext(OurRenderContext):
-    def __init__(self, units='inch'):
+    def __init__(self, units='inch', tile_size=None, processes=None):
         super(GerberGeometryContext, self).__init__(units=units)
 
+        self.tile_size = tile_size
+        self.processes = processes
+        self.runs = []
+
         self.polys = []
         self.remove_polys = []
         self.running_poly = None
 
+        # primitives waiting to be merged into running_poly - consecutive ones with the same polarity are unioned
+        # together in one go, and only a change of polarity has to touch running_poly
+        self.pending = []
+        self.pending_add = True
+
+        # aperture shapes, see _flash
+        self.templates = {}
+
     def update_running(self, p, add=True):
         if add:
             self.polys.append(p)
-            if self.running_poly:
-                self.running_poly = self.running_poly.union(p)
-            else:
-                self.running_poly = p
         else:
             self.remove_polys.append(p)
-            self.running_poly = self.running_poly.difference(p)
+
+        if add != self.pending_add:
+            self.flush_running()
+            self.pending_add = add
+
+        self.pending.append(p)
+
+    def flush_running(self):
+        if not self.pending:
+            return
+
+        # tiled, the runs are kept until the end and done all at once
+        if self.tile_size:
+            self.runs.append((self.pending_add, self.pending))
+            self.pending = []
+            return
+
+        merged = geometry.batched_union(self.pending)
+        self.pending = []
+        if merged is None:
+            return
+
+        if self.pending_add:
+            self.running_poly = self.running_poly.union(merged) if self.running_poly else merged
+        elif self.running_poly:
+            self.running_poly = self.running_poly.difference(merged)
 
     def render_layer(self, layer, union=True):
         for prim in layer.primitives:
             self.render(prim)
 
-        clear = shapely.ops.unary_union(self.remove_polys)
         if union:
-            # adds = shapely.ops.unary_union(self.polys)
-            # return adds.difference(clear)
+            self.flush_running()
+            if self.tile_size:
+                return geometry.tiled_union(self.runs, self.tile_size, processes=self.processes)
             return self.running_poly
         else:
+            clear = shapely.ops.unary_union(self.remove_polys)
             ret = []
             for p in self.polys:
                 np = p.difference(clear)
@@ -351,56 +504,63 @@ class GerberGeometryContext(OurRenderContext):
         elif hasattr(line, 'vertices') and line.vertices is not None:
             raise Exception("render_line don't know what to do")
 
-    def _render_rectangle(self, primitive, color):
-        x1, y1 = primitive.lower_left
-        x2 = x1 + primitive.width
-        y2 = y1 + primitive.height
-        box = shapely.geometry.box(x1, y1, x2, y2, ccw=False)
+    # Flashes of the same aperture are all the same shape, so each shape is made once (centered on 0, 0) and then
+    # moved to every place it's flashed
+    def _flash(self, key, make, center):
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = _template(make())
 
-        center = primitive.position
-        if primitive.hole_diameter > 0:
-            circle = shapely.geometry.Point(*center).buffer(distance=primitive.hole_diameter)
-            if primitive.level_polarity == 'dark':
-                box = box.difference(circle)
-            else:
-                raise Exception("render_rectangle doesn't really know what to do with non-dark circle in it...")
+        return _place(template, *center)
 
-        if primitive.hole_width > 0 and primitive.hole_height > 0:
-            cx, cy = center
-            w = primitive.hole_width
-            h = primitive.hole_height
-            box2 = shapely.geometry.box((cx-w)/2., (cy-h)/2., (cx+w)/2., (cy+h)/2)
-            if primitive.level_polarity == 'dark':
-                box = box.difference(box2)
-            else:
-                raise Exception("render_rectangle doesn't really know what to do with non-dark circle in it...")
-
-        self.update_running(box)
+    def _render_rectangle(self, primitive, color):
+        has_hole = primitive.hole_diameter > 0
+        has_slot = primitive.hole_width > 0 and primitive.hole_height > 0
+        if (has_hole or has_slot) and primitive.level_polarity != 'dark':
+            raise Exception("render_rectangle doesn't really know what to do with non-dark circle in it...")
+
+        # the pad's own size, turned about its center - the slot turns with it, a round hole doesn't have to
+        w = primitive.width
+        h = primitive.height
+        rotation = primitive.rotation % 360
+
+        def _make():
+            box = shapely.geometry.box(-w/2., -h/2., w/2., h/2., ccw=False)
+            if has_slot:
+                box = box.difference(_centered_box(primitive.hole_width, primitive.hole_height))
+            if rotation:
+                box = shapely.affinity.rotate(box, rotation, origin=(0, 0))
+            if has_hole:
+                box = box.difference(shapely.geometry.Point(0, 0).buffer(distance=primitive.hole_diameter))
+            return box
+
+        key = (
+            'rectangle', w, h, rotation,
+            primitive.hole_diameter if has_hole else 0,
+            (primitive.hole_width, primitive.hole_height) if has_slot else None,
+        )
+        self.update_running(self._flash(key, _make, primitive.position))
 
     def _render_circle(self, primitive, color):
-        center = primitive.position
-        if not self.invert and primitive.level_polarity == 'dark':
-            circle = shapely.geometry.Point(*center).buffer(distance=primitive.radius)
-        else:
+        if self.invert or primitive.level_polarity != 'dark':
             raise Exception("render_circle doesn't know what to do with polarity!=dark")
 
-        if hasattr(primitive, 'hole_diameter') and primitive.hole_diameter is not None and primitive.hole_diameter > 0:
-            hole = shapely.geometry.Point(*center).buffer(distance=primitive.hole_diameter)
-            circle = circle.difference(hole)
+        hole_diameter = getattr(primitive, 'hole_diameter', None)
+        has_hole = hole_diameter is not None and hole_diameter > 0
+        hole_width = getattr(primitive, 'hole_width', None)
+        hole_height = getattr(primitive, 'hole_height', None)
+        has_slot = hole_width is not None and hole_height is not None and hole_width > 0 and hole_height > 0
 
-        if (hasattr(primitive, 'hole_width') and hasattr(primitive, 'hole_height')
-            and primitive.hole_width is not None and primitive.hole_height is not None
-            and primitive.hole_width > 0 and primitive.hole_height > 0):
+        def _make():
+            circle = shapely.geometry.Point(0, 0).buffer(distance=primitive.radius)
+            if has_hole:
+                circle = circle.difference(shapely.geometry.Point(0, 0).buffer(distance=hole_diameter))
+            if has_slot:
+                circle = circle.difference(_centered_box(hole_width, hole_height))
+            return circle
 
-            if primitive.hole_width > 0 and primitive.hole_height > 0:
-                cx, cy = center
-                w = primitive.hole_width
-                h = primitive.hole_height
-                box2 = shapely.geometry.box((cx - w) / 2., (cy - h) / 2., (cx + w) / 2., (cy + h) / 2)
-                if primitive.level_polarity == 'dark':
-                    circle = circle.difference(box2)
-
-        self.update_running(circle)
+        key = ('circle', primitive.radius, hole_diameter if has_hole else 0, (hole_width, hole_height) if has_slot else None)
+        self.update_running(self._flash(key, _make, primitive.position))
 
     def _render_region(self, region, color):
         coords = [region.primitives[0].start]
@@ -470,7 +630,7 @@ class GerberDrillContext(render.GerberContext):
 @operation(required=['tool_radius'])
 def pcb_isolation_geometry(
     gerber_file=None, gerber_data=None, gerber_geometry=None, stepover='40%', outline_separation=0.020, tool_radius=None,
-    flipx=False, flipy=False,
+    flipx=False, flipy=False, incremental=False, tolerance=None, processes=None,
 ):
     if gerber_geometry:
         geom = gerber_geometry
@@ -512,9 +672,12 @@ def pcb_isolation_geometry(
 
                 geoms.append(bgeom)
     else:
+        # see geometry.offset_passes for incremental, tolerance and processes
         union_geom = shapely.ops.cascaded_union(in_geoms)
-        for step in range(1, stepovers+1):
-            bgeom = union_geom.buffer(step*stepover)
+        passes = geometry.offset_passes(
+            union_geom, stepover, stepovers, incremental=incremental, tolerance=tolerance, processes=processes,
+        )
+        for bgeom in passes:
             if isinstance(bgeom, shapely.geometry.Polygon):
                 bgeom = shapely.geometry.MultiPolygon([bgeom])
 
@@ -527,36 +690,10 @@ def pcb_isolation_geometry(
 def pcb_isolation_mill(
     gerber_file=None, gerber_data=None, gerber_geometry=None, stepover='40%', outline_separation=None, depth=None, clearz=None,
     xoff=0, yoff=0,
-    auto_clear=True, flipx=False, flipy=False, simplify=0.001, zprobe_radius=None,
+    auto_clear=True, flipx=False, flipy=False, simplify=0.001, zprobe_radius=None, optimize_travel=False,
+    arc_tolerance=None, incremental_offsets=False, offset_tolerance=None, offset_processes=None,
+    stages=None, geometry_key=None,
 ):
-    def _zadjust(x, y):
-        if not delauney:
-            machine().write("#100=0")
-            return "#100"
-
-        pt = shapely.geometry.Point(x, y)
-
-        try:
-            match = next(x for x in delauney if x.contains(pt))
-        except StopIteration:
-            raise Exception("Did not find triangle for point {}".format(list(pt.coords)))
-
-        vars = {
-            'px': x,
-            'py': y,
-        }
-        for i, p in enumerate(match.exterior.coords):
-            vars['x{}'.format(i+1)] = p[0]
-            vars['y{}'.format(i+1)] = p[1]
-            vars['z{}'.format(i+1)] = "#{}".format(int(round(p[2])))
-
-        machine().write("#100=[[{y2}-{y3}]*[{x1}-{x3}] + [{x3}-{x2}]*[{y1}-{y3}]]".format(**vars))  # denom
-        machine().write("#102=[[[[{y2}-{y3}]*[{px}-{x3}] + [{x3}-{x2}]*[{py}-{y3}]]]/#100]".format(**vars))  # w1 num
-        machine().write("#103=[[[[{y3}-{y1}]*[{px}-{x3}] + [{x1}-{x3}]*[{py}-{y3}]]]/#100]".format(**vars))  # w2 num
-        machine().write("#104=[1 - #102 - #103]")
-        machine().write("#105=[#102*{z1} + #103*{z2} + #104*{z3}]".format(**vars))
-        return "#105"
-
     def _zadjust_geom(_coords, zrad):
         outcoords = []
         lastc = None
@@ -581,43 +718,56 @@ def pcb_isolation_mill(
 
         return outcoords
 
-    def _cut_coords(c, zrad):
-        machine().goto(z=clearz)
-
+    def _ring_coords(c):
         if simplify:
-            coords = c.simplify(simplify).coords
+            return list(c.simplify(simplify).coords)
         else:
-            coords = c.coords
+            return list(c.coords)
 
+    def _cut_coords(coords, zrad):
+        machine().goto(z=clearz)
         machine().goto(*coords[0])
 
-        if zrad:
-            zvar = _zadjust(*coords[0])
-            machine().cut(z="[{}-{}]".format(zvar, depth))
-        else:
+        if not zrad:
             machine().cut(z=-1*depth)
-
-        for c in _zadjust_geom(coords, zrad):
-            if zrad:
-                zvar = _zadjust(*coords[0])
-                machine().cut(c[0], c[1], "[{}-{}]".format(zvar, depth))
-            else:
+            for c in coords:
                 machine().cut(c[0], c[1], -1*depth)
+            return
+
+        # every vertex gets its own height off the probed map
+        coords = _zadjust_geom(coords, zrad)
+        zs = heights.expressions(coords, offset=-1*depth)
+        machine().cut(z=zs[0])
+        for c, z in zip(coords, zs):
+            machine().cut(c[0], c[1], z)
 
     clearz = clearz or 1*constants.MM
     logger.warn("tool radius - depth=%r, base dia=%r, diameter at=%r", depth, machine().tool.diameter_at_depth(0), machine().tool.diameter_at_depth(depth))
     tool_radius = machine().tool.diameter_at_depth(depth)/2.0
-    geom, geoms = pcb_isolation_geometry(
-        gerber_file=gerber_file,
-        gerber_data=gerber_data,
-        gerber_geometry=gerber_geometry,
-        stepover=stepover,
-        outline_separation=outline_separation,
-        tool_radius=tool_radius,
-        flipx=flipx, flipy=flipy,
-    )
+
+    def _offsets():
+        return pcb_isolation_geometry(
+            gerber_file=gerber_file,
+            gerber_data=gerber_data,
+            gerber_geometry=gerber_geometry,
+            stepover=stepover,
+            outline_separation=outline_separation,
+            tool_radius=tool_radius,
+            flipx=flipx, flipy=flipy,
+            incremental=incremental_offsets, tolerance=offset_tolerance, processes=offset_processes,
+        )
+
+    # stages = a stages.StageCache and geometry_key = what's in gerber_geometry, offsets are then kept by what they
+    # depend on - not the depth, feeds or where the board is going
+    if stages is not None and geometry_key is not None:
+        geom, geoms = stages.get('offsets', (
+            geometry_key, stepover, outline_separation, tool_radius, flipx, flipy, incremental_offsets, offset_tolerance,
+        ), _offsets)
+    else:
+        geom, geoms = _offsets()
+
     geom = shapely.affinity.translate(geom, xoff=xoff, yoff=yoff)
-    delauney = None
+    heights = None
 
     # FIXME
     if zprobe_radius:
@@ -668,19 +818,38 @@ def pcb_isolation_mill(
                 zprobe(center=(cx, cy), z=.125, depth=.25, rate=5, tries=1, storez=varnum)
                 varnum += 1
 
-        pg = shapely.geometry.MultiPoint(points)
-        delauney = shapely.ops.triangulate(pg, edges=False)
+        heights = heightmap.HeightMap(points)
         box = shapely.geometry.box(minx, miny, maxx, maxy)
-        geometry.shapely_to_svg('points.svg', [box, pg, shapely.geometry.MultiPolygon(delauney)])
+        geometry.shapely_to_svg('points.svg', [box, heights.points, shapely.geometry.MultiPolygon(heights.triangles)])
 
         machine().pause_program()
 
+    rings = []
     for g in geoms:
         g = shapely.affinity.translate(g, xoff=xoff, yoff=yoff)
         for p in g:
-            _cut_coords(p.exterior, zprobe_radius)
+            rings.append(_ring_coords(p.exterior))
             for i in p.interiors:
-                _cut_coords(i, zprobe_radius)
+                rings.append(_ring_coords(i))
+
+    if optimize_travel:
+        rings, stats = optimize.order_rings(rings, start=machine().position[:2])
+        logger.warn(
+            "travel optimized - %d rings, travel %.3f -> %.3f, saved %.3f",
+            stats['rings'], stats['travel_before'], stats['travel_after'], stats['travel_saved']
+        )
+
+    # arc_tolerance turns runs of short cuts that sit on a circle into G2/G3 arcs.  Rings were already simplified,
+    # so their chords can be that far off the curve they came from
+    if arc_tolerance:
+        with machine().record() as path:
+            for coords in rings:
+                _cut_coords(coords, zprobe_radius)
+
+        machine().emit(arcfit.fit_arcs(path, tolerance=arc_tolerance, chord_tolerance=max(arc_tolerance, simplify or 0)))
+    else:
+        for coords in rings:
+            _cut_coords(coords, zprobe_radius)
 
     if auto_clear:
         machine().goto(z=clearz)
@@ -688,16 +857,17 @@ def pcb_isolation_mill(
     return geom, geoms
 
 
+# parsed layers are shared through layercache.default, don't change them
 def pcb_layer(gerber_file=None, gerber_data=None):
     if gerber_data is not None:
-        return gerber.load_layer_data(gerber_data, gerber_file)
+        return layercache.default.layer(gerber_data, gerber_file)
     else:
         return gerber.load_layer(gerber_file)
 
 
-def pcb_trace_geometry(gerber_file=None, gerber_data=None, union=True):
+def pcb_trace_geometry(gerber_file=None, gerber_data=None, union=True, tile_size=None, processes=None):
     b = pcb_layer(gerber_file=gerber_file, gerber_data=gerber_data)
-    ctx = GerberGeometryContext()
+    ctx = GerberGeometryContext(tile_size=tile_size, processes=processes)
     return ctx.render_layer(b, union=union)
 
 
@@ -716,7 +886,7 @@ def pcb_outline_geometry(gerber_file=None, gerber_data=None, union=True):
 @operation(required=['depth'], operation_feedrate='drill')
 def pcb_drill(
         gerber_file=None, gerber_data=None, gerber_geometry=None, depth=None, flipx=False, flipy=False, clearz=None, auto_clear=True,
-        xoff=0, yoff=0,
+        xoff=0, yoff=0, drill_order=None,
 ):
     clearz = clearz or 1*constants.MM
 
@@ -743,6 +913,21 @@ def pcb_drill(
     drill_holes = [x for x in hole_geom if x.coords[0][2] <= tool_dia]
     helical_holes = [x for x in hole_geom if x.coords[0][2] > tool_dia]
 
+    # drill_order = 'tsp' or 'serpentine' to reorder holes for less travel, otherwise they're cut in file order.
+    # Everything here is cut with the one tool, so holes aren't grouped by size.
+    if drill_order:
+        start = machine().position[:2]
+        for label, holes in [('drill', drill_holes), ('helical', helical_holes)]:
+            groups, stats = optimize.order_holes([h.coords[0] for h in holes], start=start, method=drill_order, group=False)
+            if groups:
+                holes[:] = [holes[i] for i in groups[0][1]]
+                start = holes[-1].coords[0][:2]
+
+            logger.warn(
+                "%s holes ordered (%s) - %d holes, travel %.3f -> %.3f, saved %.3f",
+                label, drill_order, stats['points'], stats['travel_before'], stats['travel_after'], stats['travel_saved']
+            )
+
     machine().goto(z=1*constants.MM)
     if drill_holes:
         drill_cycle(
@@ -818,7 +1003,112 @@ def pcb_cutout(gerber_file=None, gerber_data=None, gerber_geometry=None, bounds=
         machine().goto(z=clearz)
 
 
+# A panel of identical boards.  fn(xoff, yoff) makes one board, and by default it's run for every offset.
+#
+# copy=True only runs it for the first offset, records it, and makes every other board a translated copy of those
+# moves (and of the preview geometry), which is a lot quicker.  The copies aren't quite what fn would have made at
+# their offset - simplification can pick slightly different vertices and a Z probe grid is zeroed on the first board
+# - but they cut the same board.  subroutine=<number> writes the first board once as an O-word subroutine instead and
+# calls it with a G52 offset for every board, its comments are the first board's.  Boards with expressions in X or Y
+# can't be moved and are always made one by one.
+def pcb_panel(offsets, fn, subroutine=None, copy=False):
+    if not copy and not subroutine:
+        for xoff, yoff in offsets:
+            fn(xoff, yoff)
+        return
+
+    m = machine()
+    x0, y0 = offsets[0]
+    start = len(m.geometry)
+    with m.record() as board:
+        fn(x0, y0)
+
+    if any('x' in exprs or 'y' in exprs for exprs in board.exprs.values()):
+        m.emit(board)
+        for xoff, yoff in offsets[1:]:
+            fn(xoff, yoff)
+        return
+
+    end = m.position
+    moves = m.geometry.translated(start=start) if m.save_geoms else None
+    if subroutine:
+        m.write("o{} sub".format(subroutine))
+        m.emit(board)
+        m.write("o{} endsub".format(subroutine))
+        for xoff, yoff in offsets:
+            m.write("G52 X{:.6f} Y{:.6f}".format(xoff - x0, yoff - y0))
+            m.write("o{} call".format(subroutine))
+        m.write("G52 X0 Y0")
+    else:
+        m.emit(board)
+        for xoff, yoff in offsets[1:]:
+            m.emit(board.translated(xoff - x0, yoff - y0))
+
+    last = end
+    for xoff, yoff in offsets[1:]:
+        dx, dy = xoff - x0, yoff - y0
+        if moves:
+            # every board after the first starts from where the one before it finished, and stays there until it
+            # first moves in x/y
+            segments = moves.translated(dx, dy)
+            k = 0
+            while k < len(segments) and (moves.coords[4*k + 2], moves.coords[4*k + 3]) == (moves.coords[0], moves.coords[1]):
+                segments.coords[4*k + 2], segments.coords[4*k + 3] = last[0], last[1]
+                k += 1
+            for k in range(min(k + 1, len(segments))):
+                segments.coords[4*k], segments.coords[4*k + 1] = last[0], last[1]
+            m.geometry.extend(segments)
+        last = (end[0] + dx, end[1] + dy) + tuple(end[2:])
+
+    m.position = last
+
+
+# A layer's file contents.  Layers loaded from a file on disk or a zip only keep where to find them (so a project
+# stays small, and pickles) and are read when they're needed, one at a time
+def _layer_data(layer):
+    if 'data' in layer:
+        return layer['data']
+
+    if 'member' in layer:
+        with zipfile.ZipFile(layer['path']) as z:
+            return z.read(layer['member'])
+
+    with open(layer['path'], 'rb') as f:
+        return f.read()
+
+
+def _layer_geometry(key, layer, union=True):
+    data, file_name = _layer_data(layer), layer['filename']
+    if key == ('both', 'drill'):
+        kind, make = 'drill', lambda: pcb_drill_geometry(gerber_data=data, gerber_file=file_name)
+    elif key[1] == 'outline':
+        kind, make = 'outline', lambda: pcb_outline_geometry(gerber_data=data, gerber_file=file_name, union=union)
+    else:
+        kind, make = 'trace', lambda: pcb_trace_geometry(gerber_data=data, gerber_file=file_name, union=union)
+
+    if not union and kind != 'drill':
+        kind += '-parts'
+    return layercache.default.geometry(data, file_name, kind, make)
+
+
+# PCBProject.process_layers workers send geometry back as WKB, a lot smaller and quicker than pickled shapely objects
+def _layer_geometry_wkb(work):
+    g = _layer_geometry(*work)
+    if isinstance(g, list):
+        return [shapely.wkb.dumps(x) for x in g]
+    return shapely.wkb.dumps(g)
+
+
+def _from_wkb(data):
+    if isinstance(data, list):
+        return [shapely.wkb.loads(x) for x in data]
+    return shapely.wkb.loads(data)
+
+
 class PCBProject(object):
+    # what process_layers makes geometry for, the rest are only parsed if something asks for them
+    cam_layers = ['copper', 'drill', 'outline']
+
     def __init__(self, gerber_input=None ):
         self.gerber_input = gerber_input
         # if isinstance(border, (int, float)):
@@ -864,17 +1154,10 @@ class PCBProject(object):
             logger.warn("gerber_input is None, bailing")
             return
 
+        # nothing is read here, see _layer_data
         if isinstance(gerber_input, (list, tuple)):
             for f in gerber_input:
-                ftype = self.identify_file(f[0])
-                logger.warn("Loading %r type=%r", f[0], ftype)
-                if ftype is None:
-                    continue
-
-                self.layers[ftype] = {
-                    'filename': f[0],
-                    'data': f[1].read(),
-                }
+                self.load_layer(f[0], f[1])
         elif os.path.isdir(gerber_input):
             logger.warn("gerber_input is directory")
             for fname in os.listdir(gerber_input):
@@ -884,22 +1167,23 @@ class PCBProject(object):
 
                 self.layers[ftype] = {
                     'filename': fname,
-                    'data': open(fname).read()
+                    'path': os.path.join(gerber_input, fname),
                 }
 
         elif os.path.splitext(gerber_input)[-1].lower() == '.zip':
             logger.warn("gerber_input is zip")
-            z = zipfile.ZipFile(gerber_input)
-            for i in z.infolist():
-                ftype = self.identify_file(i.filename)
-                logger.warn("Loading %r type=%r", i.filename, ftype)
-                if ftype is None:
-                    continue
-
-                self.layers[ftype] = {
-                    'filename': i.filename,
-                    'data': z.read(i.filename),
-                }
+            with zipfile.ZipFile(gerber_input) as z:
+                for i in z.infolist():
+                    ftype = self.identify_file(i.filename)
+                    logger.warn("Loading %r type=%r", i.filename, ftype)
+                    if ftype is None or i.filename.endswith('/'):
+                        continue
+
+                    self.layers[ftype] = {
+                        'filename': i.filename,
+                        'path': os.path.abspath(gerber_input),
+                        'member': i.filename,
+                    }
         else:
             raise Exception("Input not supported: supply either a directory or zip file containing gerber files")
 
@@ -907,29 +1191,37 @@ class PCBProject(object):
 
     def get_layer(self, layer):
         v = self.layers[layer]
-        return pcb_layer(gerber_data=v['data'], gerber_file=v['filename'])
-
-    def process_layers(self, union=True):
-        union_geom = shapely.geometry.GeometryCollection()
+        return pcb_layer(gerber_data=_layer_data(v), gerber_file=v['filename'])
+
+    def layer_data(self, layer):
+        return _layer_data(self.layers[layer])
+
+    # processes = parse and render the layers in that many worker processes.  Only cam_layers are made into geometry
+    # (and go into the bounds), silkscreen and mask layers are left alone
+    def process_layers(self, union=True, processes=None):
+        keys = sorted(k for k in self.layers.keys() if k[1] in self.cam_layers)
+        work = [(k, self.layers[k], union) for k in keys]
+        if processes > 1 and len(work) > 1:
+            pool = multiprocessing.Pool(min(processes, len(work)))
+            try:
+                results = pool.map(_layer_geometry_wkb, work)
+            finally:
+                pool.close()
+                pool.join()
+
+            geoms = [_from_wkb(r) for r in results]
+        else:
+            geoms = [_layer_geometry(*w) for w in work]
 
-        for k, v in self.layers.items():
-            if k == ('both', 'drill'):
-                g = pcb_drill_geometry(gerber_data=v['data'], gerber_file=v['filename'])
-            elif k[1] == ('outline'):
-                g = pcb_outline_geometry(gerber_data=v['data'], gerber_file=v['filename'], union=union)
-            else:
-            # elif k[1] == ('copper'):
-                g = pcb_trace_geometry(gerber_data=v['data'], gerber_file=v['filename'], union=union)
+        # only the overall bounds are needed, there's no need to union the layers to get them
+        bounds = []
+        for k, g in zip(keys, geoms):
+            self.layers[k]['geometry'] = g
+            bounds.extend(x.bounds for x in (g if isinstance(g, list) else [g]) if not x.is_empty)
 
-            # logger.warn('%r - %r', k, g.bounds)
-            if union:
-                v['geometry'] = g
-                union_geom = union_geom.union(g)
-            else:
-                v['geometry'] = g
-                union_geom = union_geom.union(shapely.ops.unary_union(g))
-
-        self.bounds = union_geom.bounds
+        self.bounds = [
+            min(b[0] for b in bounds), min(b[1] for b in bounds), max(b[2] for b in bounds), max(b[3] for b in bounds),
+        ]
         minx, miny, maxx, maxy = self.bounds
 
         # if self.auto_zero:
@@ -947,10 +1239,12 @@ class PCBProject(object):
 #            xoff = yoff = 0
 
         if union:
-            for k, v in self.layers.items():
+            for k in keys:
+                v = self.layers[k]
                 v['geometry'] = shapely.affinity.translate(v['geometry'], xoff=xoff, yoff=yoff)  # +self.border[0] / +self.border[1]
         else:
-            for k, v in self.layers.items():
+            for k in keys:
+                v = self.layers[k]
                 v['geometry'] = [
                     shapely.affinity.translate(x, xoff=xoff + self.border[0], yoff=yoff + self.border[1]) for x in v['geometry']
                 ]
@@ -962,20 +1256,32 @@ class PCBProject(object):
             newminy + (maxy - miny),  #  + self.border[1] + self.border[3],
         ]
 
+    # a file that's on disk is read from there when it's needed, anything else (uploads, StringIO) is read now
     def load_layer(self, file_name, fobj):
         ftype = self.identify_file(file_name)
         logger.warn("load layer, file=%r, fobj=%r, ftype=%r", file_name, fobj, ftype)
         if ftype is None:
             return None
 
-        this = {
-            'filename': file_name,
-            'data': fobj.read()
-        }
+        path = getattr(fobj, 'name', None)
+        if isinstance(path, basestring) and os.path.isfile(path):
+            this = {
+                'filename': file_name,
+                'path': os.path.abspath(path),
+            }
+        else:
+            this = {
+                'filename': file_name,
+                'data': fobj.read()
+            }
         self.layers[ftype] = this
 
         return this
 
+    # what's in a layer's geometry, for stages.StageCache keys
+    def layer_key(self, layer):
+        return hashlib.sha256(shapely.wkb.dumps(self.layers[layer]['geometry'])).hexdigest()
+
     def layer_to_svg(self, layer_key, svg_file, width=600, height=600):
         geoms = self.layers[layer_key]['geometry']
         geometry.shapely_to_svg(
@@ -1004,8 +1310,22 @@ class PCBProject(object):
                 origin=(minx - width * .1, -thickness, maxy - height - height * .1)
             )
 
+    # from_origin = start the file from the origin, so what goes into it doesn't depend on where the last file left
+    # off.  Otherwise the machine carries on from there, which only shows in the preview and where optimize_travel
+    # starts
+    def _start_file(self, file_name, side, posts=None, thickness=None, fixture_width=None, from_origin=False):
+        machine().set_file(file_name)
+        if from_origin:
+            machine().position = (0, 0, 0)
+        self.auto_set_stock(side=side, posts=posts, thickness=thickness, fixture_width=fixture_width, )
+
     # drill = 'top' or 'bottom' depending on which side to drill from
     # cutout = 'top' or 'bottom' depending on which side to cut out from
+    # processes = generate the files in that many worker processes (needs file_per_operation), the output is the same
+    # panel_copy = make the first board of a panel and copy it for the others, panel_subroutine = write it once as a
+    # subroutine and call it for every board - both much quicker than making every board, see pcb_panel
+    # stages = a stages.StageCache to keep each file's moves and the isolation offsets in, keyed only on what they
+    # depend on - running the job again with one parameter changed only remakes what uses it
     @operation(required=['output_directory', 'iso_bit', 'drill_bit', 'cutout_bit'])
     def pcb_job(
         self,
@@ -1013,7 +1333,9 @@ class PCBProject(object):
         cutout=None, drill=None,
         iso_bit=None, drill_bit=None, cutout_bit=None, post_bit=None,
         panelx=1, panely=1, flip='y', zprobe_radius=None, side='both',
-        border=None, thickness=1.7 * constants.MM, posts=None, fixture_width=None,
+        border=None, thickness=1.7 * constants.MM, posts=None, fixture_width=None, optimize_travel=False,
+        arc_tolerance=None, processes=None, incremental_offsets=False, panel_subroutine=False, panel_copy=False,
+        stages=None,
     ):
         def _xoff(xi, side='top'):
             minx, miny, maxx, maxy = self.bounds
@@ -1030,124 +1352,230 @@ class PCBProject(object):
             minx, miny, maxx, maxy = self.bounds
             return yi*(maxy-miny+cutout_bit.diameter)
 
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
+        def _posts():
+            machine().set_tool(post_bit)
+            if posts == 'x':
+                minx, miny, maxx, maxy = self.bounds
+                helical_drill(center=(minx - 1/8, (miny+maxy)/2.), outer_rad=1/8., z=0, depth=.65, stepdown="10%")
+                helical_drill(center=(maxx + 1/4. + 1/8., (miny+maxy)/2.), outer_rad=1/8., z=0, depth=.65, stepdown="10%")
+            elif posts == 'y':
+                raise Exception("not implemented")
 
-        # .... TOP ....
-        if side in ['top', 'both']:
-            if not file_per_operation:
-                machine().set_file(os.path.join(output_directory, 'pcb_top_all.ngc'))
-                self.auto_set_stock(side='top', posts=posts, thickness=thickness, fixture_width=fixture_width, )
+            machine().pause_program()
 
-            if posts != 'none':
-                if file_per_operation:
-                    machine().set_file(os.path.join(output_directory, 'pcb_top_0_posts.ngc'))
-                    self.auto_set_stock(side='top', posts=posts, thickness=thickness, fixture_width=fixture_width, )
+        def _offsets(side):
+            return [(_xoff(x, side=side), _yoff(y)) for x in range(panelx) for y in range(panely)]
 
-                machine().set_tool(post_bit)
-                if posts == 'x':
-                    minx, miny, maxx, maxy = self.bounds
-                    helical_drill(center=(minx - 1/8, (miny+maxy)/2.), outer_rad=1/8., z=0, depth=.65, stepdown="10%")
-                    helical_drill(center=(maxx + 1/4. + 1/8., (miny+maxy)/2.), outer_rad=1/8., z=0, depth=.65, stepdown="10%")
-                elif posts == 'y':
-                    raise Exception("not implemented")
+        # every board in the panel is the same, see pcb_panel.  Subroutine numbers are given out as the sections are
+        # listed, so a file comes out the same whichever process made it or if it came out of stages
+        subroutines = itertools.count(100)
 
-                machine().pause_program()
-
-            if file_per_operation:
-                machine().set_file(os.path.join(output_directory, 'pcb_top_1_iso.ngc'))
-                self.auto_set_stock(side='top', posts=posts, thickness=thickness, fixture_width=fixture_width, )
+        def _panel(side, fn, subroutine):
+            offsets = _offsets(side)
+            pcb_panel(
+                offsets, fn, subroutine=subroutine if panel_subroutine and len(offsets) > 1 else None, copy=panel_copy,
+            )
 
+        def _iso(side, subroutine):
             machine().set_tool(iso_bit)
-            l = self.layers[('top', 'copper')]
-            for x in range(panelx):
-                for y in range(panely):
-                    pcb_isolation_mill(
-                        gerber_geometry=l['geometry'],
-                        xoff=_xoff(x), yoff=_yoff(y),
-                        outline_separation=outline_separation,
-                        depth=outline_depth,
-                        zprobe_radius=zprobe_radius,
-                    )
+            l = self.layers[(side, 'copper')]
+            _panel(side, lambda xoff, yoff: pcb_isolation_mill(
+                gerber_geometry=l['geometry'],
+                xoff=xoff, yoff=yoff,
+                outline_separation=outline_separation,
+                depth=outline_depth,
+                flipx=self.bounds if side == 'bottom' and flip == 'x' else False,
+                flipy=self.bounds if side == 'bottom' and flip == 'y' else False,
+                zprobe_radius=zprobe_radius,
+                optimize_travel=optimize_travel,
+                arc_tolerance=arc_tolerance,
+                incremental_offsets=incremental_offsets,
+                stages=stages, geometry_key=keys.get((side, 'copper')),
+            ), subroutine)
+
+        def _drill(side, subroutine):
+            machine().set_tool(drill_bit)
+
+            l = self.layers[('both', 'drill')]
+            _panel(side, lambda xoff, yoff: pcb_drill(
+                gerber_geometry=l['geometry'],
+                xoff=xoff, yoff=yoff,
+                depth=thickness,
+                flipx=self.bounds if side == 'bottom' and flip == 'x' else False,
+                flipy=self.bounds if side == 'bottom' and flip == 'y' else False,
+                drill_order='tsp' if optimize_travel else None,
+            ), subroutine)
+
+        def _cutout(side, subroutine):
+            machine().set_tool(cutout_bit)
+            _panel(side, lambda xoff, yoff: pcb_cutout(
+                bounds=self.bounds, depth=thickness, xoff=xoff, yoff=yoff, stepdown="15%",
+            ), subroutine)
+
+        # (side, file name, what goes in it, what that depends on) - each one only depends on the layers, so they can
+        # be made in any order.  The last part is the stages key, with everything the section's function reads
+        keys = dict((k, self.layer_key(k)) for k in self.layers if k[1] in ('copper', 'drill')) if stages is not None else {}
+
+        def _section(section_side, file_name, fn, *parts):
+            subroutine = next(subroutines) if fn is not _posts else None
+            parts = (fn.__name__, section_side, subroutine, self.bounds) + parts
+            if fn is not _posts:
+                parts += (_offsets(section_side), panel_subroutine, panel_copy)
+                fn = functools.partial(fn, section_side, subroutine)
+
+            sections.append((section_side, file_name, fn, parts))
+
+        sections = []
+        iso = (iso_bit, outline_separation, outline_depth, flip, zprobe_radius, optimize_travel, arc_tolerance, incremental_offsets)
+        drills = (drill_bit, thickness, flip, optimize_travel, keys.get(('both', 'drill')))
+        if side in ['top', 'both']:
+            if posts != 'none':
+                _section('top', 'pcb_top_0_posts.ngc', _posts, post_bit, posts)
+
+            _section('top', 'pcb_top_1_iso.ngc', _iso, keys.get(('top', 'copper')), *iso)
 
             if drill == 'top' and ('both', 'drill') in self.layers:
-                if file_per_operation:
-                    machine().set_file(os.path.join(output_directory, 'pcb_top_2_drill.ngc'))
-                    self.auto_set_stock(side='top', posts=posts, thickness=thickness, fixture_width=fixture_width, )
-
-                machine().set_tool(drill_bit)
-
-                l = self.layers[('both', 'drill')]
-                for x in range(panelx):
-                    for y in range(panely):
-                        pcb_drill(
-                            gerber_geometry=l['geometry'],
-                            xoff=_xoff(x), yoff=_yoff(y),
-                            depth=thickness,
-                            flipy=False
-                        )
+                _section('top', 'pcb_top_2_drill.ngc', _drill, *drills)
 
             if cutout == 'top':
+                _section('top', 'pcb_top_3_cutout.ngc', _cutout, cutout_bit, thickness)
+
+        if side in ['bottom', 'both']:
+            _section('bottom', 'pcb_bottom_1_iso.ngc', _iso, keys.get(('bottom', 'copper')), *iso)
+
+            if drill == 'bottom' and ('both', 'drill') in self.layers:
+                _section('bottom', 'pcb_bottom_2_drill.ngc', _drill, *drills)
+
+            if cutout == 'bottom':
+                _section('bottom', 'pcb_bottom_3_cutout.ngc', _cutout, cutout_bit, thickness)
+
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+
+        # files made in other processes can't know where the one before them left off - and with optimize_travel that
+        # decides where a file starts, so serial runs start every file from the origin too.  Sections in stages are
+        # kept by where they start, so a serial run carries on from the last file whether or not it uses them
+        stock = dict(
+            posts=posts, thickness=thickness, fixture_width=fixture_width,
+            from_origin=optimize_travel or processes > 1,
+        )
+        if processes > 1 and file_per_operation and len(sections) > 1:
+            self._pcb_job_parallel(output_directory, sections, stock, processes, stages)
+        else:
+            current_side = None
+            for section_side, file_name, fn, parts in sections:
                 if file_per_operation:
-                    machine().set_file(os.path.join(output_directory, 'pcb_top_3_cutout.ngc'))
-                    self.auto_set_stock(side='top', posts=posts, thickness=thickness, fixture_width=fixture_width, )
+                    self._start_file(os.path.join(output_directory, file_name), section_side, **stock)
+                elif section_side != current_side:
+                    self._start_file(os.path.join(output_directory, 'pcb_{}_all.ngc'.format(section_side)), section_side, **stock)
 
-                machine().set_tool(cutout_bit)
-                for x in range(panelx):
-                    for y in range(panely):
-                        pcb_cutout(bounds=self.bounds, depth=thickness, xoff=_xoff(x), yoff=_yoff(y), stepdown="15%")
+                current_side = section_side
+                if stages is None:
+                    fn()
+                else:
+                    _emit_section(stages.get('section', parts + (_machine_state(machine()),), lambda: _record_section(fn)))
+
+        # output is buffered, make sure everything has hit the disk before anyone goes looking for the files
+        machine().flush()
+
+    # Each worker records one file's moves with its own Environment, they're written here in order through our
+    # passes and post-processor after _start_file - exactly what a serial run would write, and what it would keep in
+    # stages, so either kind of run can use sections the other made.  The sections and machine are handed to each
+    # worker as it's forked (see _pcb_job_worker), so nothing but the section numbers and results has to be pickled.
+    # Only files that aren't in stages are made.
+    def _pcb_job_parallel(self, output_directory, sections, stock, processes, stages=None):
+        # every file starts from the origin
+        state = _machine_state(machine(), position=(0, 0, 0))
+        results = [None] * len(sections)
+        if stages is not None:
+            for k, (section_side, file_name, fn, parts) in enumerate(sections):
+                results[k] = stages.load('section', parts + (state,))
+
+        todo = [k for k, r in enumerate(results) if r is None]
+        if todo:
+            pool = multiprocessing.Pool(
+                min(processes, len(todo)), initializer=_pcb_job_worker, initargs=(sections, machine()),
+            )
+            try:
+                made = pool.map(_pcb_job_section, todo)
+            finally:
+                pool.close()
+                pool.join()
+
+            for k, result in zip(todo, made):
+                results[k] = result
+                if stages is not None:
+                    stages.save('section', sections[k][3] + (state,), result)
+
+        for (section_side, file_name, fn, parts), result in zip(sections, results):
+            self._start_file(os.path.join(output_directory, file_name), section_side, **stock)
+            _emit_section(result)
+
+
+# What a section's moves depend on in the machine it's made on, beyond the parameters pcb_job gives it
+def _machine_state(m, position=None):
+    return (
+        m.min_rpm, m.max_rpm, m.max_feedrates, m.accelerations, m.material, m.material_factor, m.speed, m.speed_stack,
+        m.probe_speed, m.level, m.operation_stack, m.save_geoms, position or m.position,
+    )
 
-        if side in ['bottom', 'both']:
-            # .... BOTTOM ....
-            l = self.layers[('bottom', 'copper')]
 
-            if not file_per_operation:
-                machine().set_file(os.path.join(output_directory, 'pcb_bottom_all.ngc'))
-                self.auto_set_stock(side='bottom', posts=posts, thickness=thickness, fixture_width=fixture_width, )
+# what a section leaves behind in the machine for the next one - a speed that wasn't used up is used by the next cut
+def _end_state(m):
+    return dict(position=m.position, speed=m.speed, tool=m.tool, feed_class=getattr(m, 'feed_class', None))
 
-            if file_per_operation:
-                machine().set_file(os.path.join(output_directory, 'pcb_bottom_1_iso.ngc'))
-                self.auto_set_stock(side='bottom', posts=posts, thickness=thickness, fixture_width=fixture_width, )
 
-            machine().set_tool(iso_bit)
+# (moves, preview geometry, _end_state) for a section made here, see pcb_job stages
+def _record_section(fn):
+    m = machine()
+    start = len(m.geometry)
+    with m.record() as toolpath:
+        fn()
 
-            for x in range(panelx):
-                for y in range(panely):
-                    pcb_isolation_mill(
-                        gerber_geometry=l['geometry'],
-                        xoff=_xoff(x, side='bottom'), yoff=_yoff(y),
-                        outline_separation=outline_separation,
-                        depth=outline_depth,
-                        flipx=self.bounds if flip == 'x' else False,
-                        flipy=self.bounds if flip == 'y' else False,
-                        zprobe_radius=zprobe_radius,
-                    )
+    # already in m.geometry, _emit_section will put it there again
+    geometry = m.geometry.translated(start=start)
+    del m.geometry.coords[4*start:]
+    del m.geometry.kind[start:]
+    return toolpath, geometry, _end_state(m)
 
-            if drill == 'bottom' and ('both', 'drill') in self.layers:
-                if file_per_operation:
-                    machine().set_file(os.path.join(output_directory, 'pcb_bottom_2_drill.ngc'))
-                    self.auto_set_stock(side='bottom', posts=posts, thickness=thickness, fixture_width=fixture_width, )
-
-                machine().set_tool(drill_bit)
-
-                l = self.layers[('both', 'drill')]
-                for x in range(panelx):
-                    for y in range(panely):
-                        pcb_drill(
-                            gerber_geometry=l['geometry'],
-                            xoff=_xoff(x, side='bottom'), yoff=_yoff(y),
-                            depth=thickness,
-                            flipx=self.bounds if flip == 'x' else False,
-                            flipy=self.bounds if flip == 'y' else False,
-                        )
 
-            if cutout == 'bottom':
-                if file_per_operation:
-                    machine().set_file(os.path.join(output_directory, 'pcb_bottom_3_cutout.ngc'))
-                    self.auto_set_stock(side='bottom', posts=posts, thickness=thickness, fixture_width=fixture_width, )
+def _emit_section(section):
+    toolpath, geometry, state = section
+    machine().emit(toolpath)
+    if machine().save_geoms:
+        machine().geometry.extend(geometry)
+    for name, value in state.items():
+        setattr(machine(), name, value)
+
 
-                machine().set_tool(cutout_bit)
-                for x in range(panelx):
-                    for y in range(panely):
-                        pcb_cutout(bounds=self.bounds, depth=thickness, xoff=_xoff(x, side='bottom'), yoff=_yoff(y), stepdown="15%")
+# (sections, parent machine) in a _pcb_job_parallel worker, given to it by _pcb_job_worker
+_worker_job = None
 
+
+# the sections hold closures that can't be pickled, so they go to each worker as its initargs - passed straight to the
+# forked process rather than pickled
+def _pcb_job_worker(sections, parent):
+    global _worker_job
+    _worker_job = (sections, parent)
+
+
+def _pcb_job_section(index):
+    sections, parent = _worker_job
+    section_side, file_name, fn, parts = sections[index]
+
+    m = environment.Environment(
+        parent.min_rpm, parent.max_rpm, parent.max_feedrates, save_geoms=parent.save_geoms,
+        accelerations=parent.accelerations,
+    )
+    m.set_material(parent.material)
+    m.material_factor = parent.material_factor
+    m.speed = parent.speed
+    m.operation_stack = list(parent.operation_stack)
+    for level in range(parent.level):
+        m.push_level()
+
+    # the stock goes in with _start_file when the file is written, like a serial run
+    with using_machine(m), m.record() as toolpath:
+        fn()
+
+    return toolpath, m.geometry, _end_state(m)
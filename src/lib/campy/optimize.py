@@ -0,0 +1,281 @@
+import math
+import numpy
+
+
+# Uniform grid over a set of points, for nearest neighbour lookups while points are being used up.  Every point
+# belongs to an owner (a ring, a hole...) and removing an owner removes all of its points.
+class GridIndex(object):
+    def __init__(self, points, owners=None, cell_size=None):
+        self.points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+        self.owners = numpy.arange(len(self.points)) if owners is None else numpy.asarray(owners)
+        self.alive = numpy.ones(self.owners.max() + 1 if len(self.owners) else 0, dtype=bool)
+
+        if len(self.points):
+            self.minx, self.miny = self.points.min(axis=0)
+            maxx, maxy = self.points.max(axis=0)
+        else:
+            self.minx = self.miny = maxx = maxy = 0
+
+        if cell_size is None:
+            area = max((maxx - self.minx) * (maxy - self.miny), 1e-12)
+            cell_size = math.sqrt(area / max(len(self.points), 1)) * 2
+        self.cell_size = max(cell_size, 1e-9)
+
+        self.ncols = int((maxx - self.minx) / self.cell_size) + 1
+        self.nrows = int((maxy - self.miny) / self.cell_size) + 1
+
+        self.cells = {}
+        cols, rows = self._cell(self.points[:, 0], self.points[:, 1])
+        for i, key in enumerate(zip(cols.tolist(), rows.tolist())):
+            self.cells.setdefault(key, []).append(i)
+
+    def _cell(self, x, y):
+        cols = numpy.clip(((x - self.minx) / self.cell_size).astype(int), 0, self.ncols - 1)
+        rows = numpy.clip(((y - self.miny) / self.cell_size).astype(int), 0, self.nrows - 1)
+        return cols, rows
+
+    def remove_owner(self, owner):
+        self.alive[owner] = False
+
+    def _ring(self, col, row, r):
+        if r == 0:
+            yield col, row
+            return
+
+        for c in range(col - r, col + r + 1):
+            yield c, row - r
+            yield c, row + r
+        for rr in range(row - r + 1, row + r):
+            yield col - r, rr
+            yield col + r, rr
+
+    # index of the closest point with a live owner, ties go to the lowest index so results are repeatable
+    def nearest(self, x, y):
+        col = min(max(int((x - self.minx) / self.cell_size), 0), self.ncols - 1)
+        row = min(max(int((y - self.miny) / self.cell_size), 0), self.nrows - 1)
+
+        # query points can be well outside the grid, so distances are measured from the clamped cell
+        ox = max(x - (self.minx + (col + 1) * self.cell_size), self.minx + col * self.cell_size - x, 0)
+        oy = max(y - (self.miny + (row + 1) * self.cell_size), self.miny + row * self.cell_size - y, 0)
+        outside = math.sqrt(ox*ox + oy*oy)
+
+        best = None
+        best_dist = None
+        max_r = max(self.ncols, self.nrows)
+        for r in range(max_r + 1):
+            # anything in ring r or further out is at least this far away
+            if best is not None and best_dist <= math.hypot(outside, (r - 1) * self.cell_size):
+                break
+
+            for key in self._ring(col, row, r):
+                indexes = self.cells.get(key)
+                if not indexes:
+                    continue
+
+                live = [i for i in indexes if self.alive[self.owners[i]]]
+                if len(live) != len(indexes):
+                    self.cells[key] = live
+                    if not live:
+                        continue
+
+                pts = self.points[live]
+                d = numpy.hypot(pts[:, 0] - x, pts[:, 1] - y)
+                k = d.argmin()
+                if best is None or d[k] < best_dist or (d[k] == best_dist and live[k] < best):
+                    best, best_dist = live[k], d[k]
+
+        return best
+
+
+def path_length(points, start=None):
+    points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+    if start is not None:
+        points = numpy.vstack([numpy.asarray(start, dtype=numpy.float64)[:2], points])
+
+    if len(points) < 2:
+        return 0.
+    return float(numpy.hypot(*numpy.diff(points, axis=0).T).sum())
+
+
+# Improves an open path that starts at start by reversing sub-sequences while that makes it shorter.  Returns the new
+# visiting order as indexes into points.  Only reversals up to window points long are tried, which keeps each pass
+# linear - after nearest neighbour the useful ones are almost always short.
+def two_opt(points, start, order=None, max_passes=10, window=250):
+    points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+    order = numpy.arange(len(points)) if order is None else numpy.asarray(order)
+    n = len(order)
+    if n < 3:
+        return order
+
+    # path is shifted by one from order, path[0] is the start point
+    path = numpy.vstack([numpy.asarray(start, dtype=numpy.float64)[:2], points[order]])
+    for p in range(max_passes):
+        improved = False
+        for i in range(n - 1):
+            # reversing order[i:j+1] swaps edges (i-1, i) + (j, j+1) for (i-1, j) + (i, j+1)
+            prev = path[i]
+            first = path[i + 1]
+            ends = path[i + 2:i + 2 + window]
+            nexts = path[i + 3:i + 3 + window]
+
+            # the last point of the path has nothing after it
+            m = len(nexts)
+            tail = numpy.zeros(len(ends) - m)
+            before = numpy.hypot(*(first - prev)) + numpy.append(numpy.hypot(*(nexts - ends[:m]).T), tail)
+            after = numpy.hypot(*(ends - prev).T) + numpy.append(numpy.hypot(*(nexts - first).T), tail)
+            gain = before - after
+            k = gain.argmax()
+            if gain[k] > 1e-9:
+                j = i + 1 + k
+                order[i:j + 1] = order[i:j + 1][::-1].copy()
+                path[i + 1:j + 2] = path[i + 1:j + 2][::-1].copy()
+                improved = True
+
+        if not improved:
+            break
+
+    return order
+
+
+# Orders closed rings (first coord == last coord) to cut down on rapid travel between them.  Rings are picked nearest
+# neighbour first, then the order is tidied up with 2-opt, then every ring is rotated so that it's entered at the
+# vertex closest to its neighbours.  Returns the rotated rings in their new order and a dict of travel distances.
+def order_rings(rings, start=(0, 0), two_opt_passes=10):
+    rings = [list(r) for r in rings]
+    stats = {
+        'rings': len(rings),
+        'travel_before': path_length([r[0][:2] for r in rings], start=start) if rings else 0,
+    }
+
+    if len(rings) < 2:
+        stats['travel_after'] = stats['travel_before']
+        stats['travel_saved'] = 0
+        return rings, stats
+
+    # closing vertex is a duplicate of the first one, leave it out
+    vertices = [numpy.asarray([c[:2] for c in r[:-1]] or [r[0][:2]], dtype=numpy.float64) for r in rings]
+    owners = numpy.concatenate([numpy.full(len(v), i, dtype=int) for i, v in enumerate(vertices)])
+    offsets = numpy.cumsum([0] + [len(v) for v in vertices])
+    points = numpy.vstack(vertices)
+
+    index = GridIndex(points, owners)
+    order = []
+    entries = []
+    cx, cy = start[:2]
+    for i in range(len(rings)):
+        p = index.nearest(cx, cy)
+        ring = owners[p]
+        index.remove_owner(ring)
+        order.append(ring)
+        entries.append(p - offsets[ring])
+        cx, cy = points[p]
+
+    order = numpy.asarray(order)
+    entries = numpy.asarray(entries)
+    entry_points = points[offsets[order] + entries]
+
+    if two_opt_passes:
+        new = two_opt(entry_points, start, max_passes=two_opt_passes)
+        order, entries, entry_points = order[new], entries[new], entry_points[new]
+
+    # with the order fixed, enter each ring at the vertex that's closest to both its neighbours
+    prev = numpy.asarray(start[:2], dtype=numpy.float64)
+    for k in range(len(order)):
+        v = vertices[order[k]]
+        cost = numpy.hypot(*(v - prev).T)
+        if k + 1 < len(order):
+            cost = cost + numpy.hypot(*(v - entry_points[k + 1]).T)
+        entries[k] = cost.argmin()
+        entry_points[k] = prev = v[entries[k]]
+
+    out = []
+    for ring, entry in zip(order.tolist(), entries.tolist()):
+        r = rings[ring]
+        if entry:
+            r = r[entry:-1] + r[:entry] + [r[entry]]
+        out.append(r)
+
+    stats['travel_after'] = path_length(entry_points, start=start)
+    stats['travel_saved'] = stats['travel_before'] - stats['travel_after']
+    return out, stats
+
+
+# Serpentine (boustrophedon) order - points are split into horizontal bands band high and every other band is
+# walked right to left.  band defaults to the average spacing between points.
+def serpentine(points, band=None):
+    points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+    if len(points) < 2:
+        return numpy.arange(len(points))
+
+    if band is None:
+        minx, miny = points.min(axis=0)
+        maxx, maxy = points.max(axis=0)
+        band = math.sqrt(max((maxx - minx) * (maxy - miny), 1e-12) / len(points))
+
+    rows = numpy.floor((points[:, 1] - points[:, 1].min()) / max(band, 1e-9)).astype(int)
+    xs = numpy.where(rows % 2, -points[:, 0], points[:, 0])
+
+    # lexsort sorts by the last key first, index breaks ties so the order is repeatable
+    return numpy.lexsort((numpy.arange(len(points)), xs, rows))
+
+
+# Orders points (drill hits...) for the least travel.  method is 'tsp' for nearest neighbour followed by 2-opt, or
+# 'serpentine'.  Returns the visiting order as a list of indexes into points and a dict of travel distances.
+def order_points(points, start=(0, 0), method='tsp', two_opt_passes=10):
+    points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+    stats = {
+        'points': len(points),
+        'travel_before': path_length(points, start=start) if len(points) else 0,
+    }
+
+    if method == 'serpentine':
+        order = serpentine(points)
+    elif method == 'tsp':
+        order = []
+        index = GridIndex(points)
+        cx, cy = start[:2]
+        for i in range(len(points)):
+            p = index.nearest(cx, cy)
+            index.remove_owner(p)
+            order.append(p)
+            cx, cy = points[p]
+
+        order = numpy.asarray(order, dtype=int)
+        if two_opt_passes:
+            order = order[two_opt(points[order], start, max_passes=two_opt_passes)]
+    else:
+        raise Exception("Unknown ordering method: {}".format(method))
+
+    stats['travel_after'] = path_length(points[order], start=start) if len(points) else 0
+    stats['travel_saved'] = stats['travel_before'] - stats['travel_after']
+    return order.tolist(), stats
+
+
+# Orders holes given as (x, y, radius).  With group, holes are split up by size (smallest first, one group per drill
+# bit) and each group is ordered starting from where the last one left off.  Returns a list of (radius, indexes)
+# groups - radius is None when everything is in one group - and a dict of travel distances over all groups.
+def order_holes(holes, start=(0, 0), method='tsp', group=True, two_opt_passes=10):
+    holes = [tuple(h) for h in holes]
+    if group:
+        sizes = sorted(set(h[2] for h in holes))
+        groups = [(size, [i for i, h in enumerate(holes) if h[2] == size]) for size in sizes]
+    else:
+        groups = [(None, range(len(holes)))] if holes else []
+
+    # before is the order the holes came in, ungrouped
+    stats = {
+        'points': len(holes),
+        'travel_before': path_length([h[:2] for h in holes], start=start) if holes else 0,
+        'travel_after': 0,
+    }
+    pos = start
+    out = []
+    for size, indexes in groups:
+        points = [holes[i][:2] for i in indexes]
+        order, group_stats = order_points(points, start=pos, method=method, two_opt_passes=two_opt_passes)
+        stats['travel_after'] += group_stats['travel_after']
+        pos = points[order[-1]]
+        out.append((size, [indexes[i] for i in order]))
+
+    stats['travel_saved'] = stats['travel_before'] - stats['travel_after']
+    return out, stats
@@ -0,0 +1,254 @@
+import re
+
+from . import gcode
+from . import toolpath as tp
+
+
+# Post-processors turn moves into lines of G-code.  Environment calls the individual methods directly when it's
+# writing as it goes, and render() when a whole Toolpath is emitted at once, so both paths produce the same text.
+# Subclasses can keep modal state between calls - lines are always requested in output order.
+class GCodePost(object):
+    def __init__(self):
+        self.reset()
+
+    # called before a new file (or a new run of output) starts
+    def reset(self):
+        pass
+
+    @classmethod
+    def format_movement(cls, x=None, y=None, z=None, a=None, rate=None):
+        movement = []
+        for var, axis in zip((x, y, z, a, rate), ('X', 'Y', 'Z', 'A', 'F')):
+            if var is not None:
+                if str(var).strip().startswith('['):
+                    movement.append("%s%s" % (axis, var))
+                else:
+                    movement.append('%s%.6f' % (axis, var))
+
+        return movement
+
+    @classmethod
+    def format_feed(cls, feed):
+        return "F%0.3f " % feed if feed is not None else ""
+
+    def text(self, txt):
+        return txt
+
+    def rapid(self, x=None, y=None, z=None, a=None, rate=None, prefix='G0'):
+        prefix = prefix + (' ' if prefix else '')
+        return "%s %s" % (prefix, " ".join(self.format_movement(x, y, z, a, rate)))
+
+    def linear(self, x=None, y=None, z=None, a=None, rate=None):
+        return "G1 %s" % (" ".join(self.format_movement(x, y, z, a, rate)))
+
+    def arc(self, x=None, y=None, I=None, J=None, z=None, rate=None, clockwise=True):
+        Z = "Z%6f" % z if z is not None else ""
+        return "%s X%.6f Y%.6f I%.6f J%6f %s %s" % ('G2' if clockwise else 'G3', x, y, I, J, Z, self.format_feed(rate))
+
+    def probe(self, axis='z', to=None, rate=None, gcode='G38.2'):
+        # whole numbers come back out of a Toolpath as floats, print them the same way either way
+        if isinstance(to, float) and to.is_integer():
+            to = int(to)
+        return "{} {}{} {}".format(gcode, axis.upper(), to, self.format_feed(rate))
+
+    # retract_type G98 would retract to initial Z every time
+    def drill_cycle(self, z_retract, cycle_depth, rate=None, retract_type='G99'):
+        return "{} G90 G81 R{:0.3f} Z{:0.3f} {}".format(retract_type, z_retract, cycle_depth, self.format_feed(rate))
+
+    def drill_cycle_end(self):
+        self.cancel_cycle()
+        return "G80"
+
+    # called when G80 cancels a canned cycle, for subclasses that keep modal state
+    def cancel_cycle(self):
+        pass
+
+    # yields (level, line) for every line of G-code in the toolpath
+    def render(self, toolpath):
+        for m in toolpath:
+            if m.kind == tp.TEXT:
+                yield m.level, self.text(m.text)
+            elif m.kind == tp.RAPID:
+                yield m.level, self.rapid(m.x, m.y, m.z, m.a, m.feed)
+            elif m.kind == tp.LINEAR:
+                yield m.level, self.linear(m.x, m.y, m.z, m.a, m.feed)
+            elif m.kind in (tp.ARC_CW, tp.ARC_CCW):
+                yield m.level, self.arc(m.x, m.y, m.i, m.j, m.z, m.feed, clockwise=m.kind == tp.ARC_CW)
+            elif m.kind == tp.PROBE:
+                for axis in ('x', 'y', 'z', 'a'):
+                    to = getattr(m, axis)
+                    if to is not None:
+                        break
+                yield m.level, self.probe(axis, to, m.feed, gcode=tp.probe_codes[m.flags])
+            elif m.kind == tp.DRILL:
+                if m.flags & tp.DRILL_START:
+                    yield m.level, self.rapid(m.x, m.y, m.z)
+                    yield m.level, self.drill_cycle(m.i, m.j, m.feed)
+                else:
+                    yield m.level, self.rapid(m.x, m.y, m.z, prefix='')
+
+                if m.flags & tp.DRILL_END:
+                    yield m.level, self.drill_cycle_end()
+            else:
+                raise Exception("Unknown move type: {}".format(m.kind))
+
+
+# Writes the same moves as GCodePost with far fewer bytes by keeping track of modal state - axis words, motion
+# codes and feeds are only written when they change, numbers are rounded to precision[units] decimal places and
+# trailing zeros are trimmed.  Moves that end up with nothing to say are dropped (None is returned for them).
+#
+# Anything written as text that isn't a comment or a plain variable assignment might change state behind our back
+# (G10, G92, tool changes...), so everything is forgotten and written out in full again after it.  Expressions are
+# always written.  stats() reports how much smaller the output came out, gcode.compare() checks it moves the same.
+class CompactGCodePost(GCodePost):
+    precision = {'inch': 4, 'mm': 3}
+    feed_precision = {'inch': 3, 'mm': 1}
+
+    passive_text_re = gcode.passive_re
+    units_re = re.compile(r'\bG(20|21)\b', re.I)
+
+    def __init__(self, precision=None, feed_precision=None, units='inch'):
+        self.precision = dict(self.precision, **(precision or {}))
+        self.feed_precision = dict(self.feed_precision, **(feed_precision or {}))
+        self.initial_units = units
+        self.bytes_before = 0
+        self.bytes_after = 0
+        super(CompactGCodePost, self).__init__()
+
+    def reset(self):
+        self.units = self.initial_units
+        self.forget()
+
+    def forget(self):
+        self.motion = None
+        self.words = {}
+        self.feed = None
+
+    def stats(self):
+        return {
+            'bytes_before': self.bytes_before,
+            'bytes_after': self.bytes_after,
+            'bytes_saved': self.bytes_before - self.bytes_after,
+        }
+
+    def _count(self, before, after):
+        self.bytes_before += len(before) + 1
+        if after is not None:
+            self.bytes_after += len(after) + 1
+        return after
+
+    @classmethod
+    def format_number(cls, value, precision):
+        txt = '%.*f' % (precision, value)
+        if '.' in txt:
+            txt = txt.rstrip('0').rstrip('.')
+        return '0' if txt in ('-0', '') else txt
+
+    def _word(self, letter, value, precision):
+        if isinstance(value, basestring):
+            return letter + value.strip()
+        return letter + self.format_number(value, precision)
+
+    # words for the axes that changed, all of them for letters in keep
+    def _axis_words(self, values, keep=''):
+        precision = self.precision[self.units]
+        words = []
+        for letter, value in values:
+            if value is None:
+                continue
+
+            word = self._word(letter, value, precision)
+            if isinstance(value, basestring):
+                # expressions can't be compared, they depend on variables
+                self.words[letter] = None
+                words.append(word)
+            elif letter in keep or self.words.get(letter) != word:
+                self.words[letter] = word
+                words.append(word)
+
+        return words
+
+    def _feed_words(self, rate):
+        if rate is None:
+            return []
+
+        word = self._word('F', rate, self.feed_precision[self.units])
+        if word == self.feed:
+            return []
+
+        self.feed = word
+        return [word]
+
+    # motion code goes in front if it changed - but only when there is movement, a lone feed change doesn't need it
+    def _motion_line(self, code, axis_words, feed_words):
+        if not axis_words:
+            return " ".join(feed_words) or None
+
+        if code != self.motion:
+            self.motion = code
+            axis_words.insert(0, code)
+
+        return " ".join(axis_words + feed_words)
+
+    def text(self, txt):
+        units = self.units_re.findall(txt)
+        if units:
+            self.units = 'inch' if units[-1] == '20' else 'mm'
+
+        if not self.passive_text_re.match(txt):
+            self.forget()
+
+        return self._count(txt, txt)
+
+    def rapid(self, x=None, y=None, z=None, a=None, rate=None, prefix='G0'):
+        before = super(CompactGCodePost, self).rapid(x, y, z, a, rate, prefix=prefix)
+
+        if not prefix:
+            # next hole of a canned cycle, it only gets drilled if there's a line for it
+            words = self._axis_words(zip('XYZA', (x, y, z, a)), keep='XYZA') + self._feed_words(rate)
+            return self._count(before, " ".join(words))
+
+        words = self._axis_words(zip('XYZA', (x, y, z, a)))
+        return self._count(before, self._motion_line(prefix, words, self._feed_words(rate)))
+
+    def linear(self, x=None, y=None, z=None, a=None, rate=None):
+        before = super(CompactGCodePost, self).linear(x, y, z, a, rate)
+        words = self._axis_words(zip('XYZA', (x, y, z, a)))
+        return self._count(before, self._motion_line('G1', words, self._feed_words(rate)))
+
+    # X/Y are always written, an arc back to where it started is a full circle.  I/J aren't modal
+    def arc(self, x=None, y=None, I=None, J=None, z=None, rate=None, clockwise=True):
+        before = super(CompactGCodePost, self).arc(x, y, I, J, z, rate, clockwise=clockwise)
+        precision = self.precision[self.units]
+        words = self._axis_words([('X', x), ('Y', y)], keep='XY')
+        words += [self._word('I', I, precision), self._word('J', J, precision)]
+        words += self._axis_words([('Z', z)])
+        return self._count(before, self._motion_line('G2' if clockwise else 'G3', words, self._feed_words(rate)))
+
+    # where the probe stops isn't known until it's run
+    def probe(self, axis='z', to=None, rate=None, gcode='G38.2'):
+        before = super(CompactGCodePost, self).probe(axis, to, rate, gcode=gcode)
+        words = [gcode, self._word(axis.upper(), to, self.precision[self.units])] + self._feed_words(rate)
+        self.motion = None
+        self.words.pop(axis.upper(), None)
+        return self._count(before, " ".join(words))
+
+    # with G99 each hole ends at the R plane, with G98 at wherever it started - either way Z isn't worth tracking
+    def drill_cycle(self, z_retract, cycle_depth, rate=None, retract_type='G99'):
+        before = super(CompactGCodePost, self).drill_cycle(z_retract, cycle_depth, rate, retract_type=retract_type)
+        # GCodePost only ever gave these 3 decimals
+        precision = min(self.precision[self.units], 3)
+        words = [retract_type, 'G90', 'G81', self._word('R', z_retract, precision), self._word('Z', cycle_depth, precision)]
+        words += self._feed_words(rate)
+        self.motion = 'G81'
+        self.words.pop('Z', None)
+        return self._count(before, " ".join(words))
+
+    # G80 leaves no motion mode, and Z wherever the last hole left it
+    def cancel_cycle(self):
+        self.motion = None
+        self.words.pop('Z', None)
+
+    def drill_cycle_end(self):
+        line = super(CompactGCodePost, self).drill_cycle_end()
+        return self._count(line, line)
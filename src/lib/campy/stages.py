@@ -0,0 +1,92 @@
+import collections
+import datetime
+import hashlib
+import threading
+
+# Memoized stages of a CAM job.  Every stage is keyed only on what it actually depends on - layer contents, the
+# parameters it's given and the machine state it starts from - so a tweaked parameter only redoes the stages that
+# use it: a new outline_depth redoes the isolation toolpaths but not the offsets (unless a V bit makes the width
+# depend on the depth), the drilling or the cutout.
+#
+# Values are kept in memory, the max_items most recently used ones, and handed to store too when there is one -
+# anything with load_cache(key) and update_cache(key, cache) like the caches in lib.cache, so a PickleCache keeps
+# them on disk where every process can get at them.  Values have to pickle for that.
+
+
+class StageCache(object):
+    def __init__(self, store=None, max_items=32):
+        self.store = store
+        self.max_items = max_items
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    # parts are plain values, dicts, lists/tuples or objects (tools, materials) which are keyed on their attributes
+    @classmethod
+    def key(cls, name, *parts):
+        return '{}-{}'.format(name, hashlib.sha256(repr(_canonical(parts))).hexdigest())
+
+    # make() is only called if there's nothing for these parts yet
+    def get(self, name, parts, make):
+        value = self.load(name, parts)
+        if value is None:
+            value = make()
+            self.save(name, parts, value)
+        return value
+
+    # None if there's nothing for these parts
+    def load(self, name, parts):
+        value = self._load(self.key(name, *parts))
+        if value is None:
+            self.misses[name] += 1
+        else:
+            self.hits[name] += 1
+        return value
+
+    def save(self, name, parts, value):
+        key = self.key(name, *parts)
+        self._remember(key, value)
+        if self.store is not None:
+            self.store.update_cache(key, {'key': key, 'created': datetime.datetime.utcnow(), 'value': value})
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def _load(self, key):
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.items[key] = value
+                return value
+
+        if self.store is None:
+            return None
+
+        cached = self.store.load_cache(key)
+        if not cached:
+            return None
+
+        timeout = getattr(self.store, 'timeout', None)
+        if timeout and (datetime.datetime.utcnow() - cached['created']).total_seconds() > timeout:
+            return None
+
+        self._remember(key, cached['value'])
+        return cached['value']
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+
+def _canonical(x):
+    if isinstance(x, dict):
+        return sorted((_canonical(k), _canonical(v)) for k, v in x.items())
+    if isinstance(x, (list, tuple)):
+        return tuple(_canonical(v) for v in x)
+    if hasattr(x, '__dict__'):
+        return type(x).__name__, _canonical(vars(x))
+    return x
@@ -0,0 +1,158 @@
+import os
+import random
+import sys
+
+import pytest
+
+# campy imports itself as lib.campy, the same as it does in the api container where src is the working directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+import shapely.geometry
+import shapely.ops
+
+
+# A small made up board - round pads, rectangular pads and traces unioned together like a rendered copper layer,
+# and holes in the same (x, y, radius) format as GerberDrillContext
+def synthetic_board(count=30, holes=20, width=1.0, height=0.75, seed=1):
+    r = random.Random(seed)
+    polys = []
+    for i in range(count):
+        x, y = r.uniform(0, width), r.uniform(0, height)
+        if i % 3 == 0:
+            polys.append(shapely.geometry.Point(x, y).buffer(0.03, resolution=16))
+        elif i % 3 == 1:
+            polys.append(shapely.geometry.box(x, y, x + 0.06, y + 0.04))
+        else:
+            x2 = min(max(x + r.uniform(-.2, .2), 0), width)
+            y2 = min(max(y + r.uniform(-.2, .2), 0), height)
+            polys.append(shapely.geometry.LineString([(x, y), (x2, y2)]).buffer(0.01, resolution=16))
+
+    copper = shapely.ops.unary_union(polys)
+    if isinstance(copper, shapely.geometry.Polygon):
+        copper = shapely.geometry.MultiPolygon([copper])
+
+    drills = shapely.geometry.MultiPoint([
+        (r.uniform(0, width), r.uniform(0, height), r.choice((0.012, 0.015, 0.02, 0.04))) for i in range(holes)
+    ])
+
+    return copper, drills
+
+
+# A made up copper layer as gerber: a ground pour, clear polarity squares around every pad and then round and
+# rectangular pads and traces from every third pad, going up to trace_length in any direction
+def synthetic_gerber(count=60, width=1.0, height=0.75, seed=1, trace_length=0.3):
+    r = random.Random(seed)
+
+    def _xy(x, y):
+        return 'X%06dY%06d' % (round(x * 10000), round(y * 10000))
+
+    def _square(x, y, half):
+        return [
+            'G36*', _xy(x - half, y - half) + 'D02*', _xy(x + half, y - half) + 'D01*', _xy(x + half, y + half) + 'D01*',
+            _xy(x - half, y + half) + 'D01*', _xy(x - half, y - half) + 'D01*', 'G37*',
+        ]
+
+    pads = [(r.uniform(0.1, width - 0.1), r.uniform(0.1, height - 0.1)) for i in range(count)]
+    lines = ['%FSLAX24Y24*%', '%MOIN*%', '%ADD10C,0.0600*%', '%ADD11R,0.0600X0.0400*%', '%ADD12C,0.0100*%', '%LPD*%']
+    lines += [
+        'G36*', _xy(0, 0) + 'D02*', _xy(width, 0) + 'D01*', _xy(width, height) + 'D01*', _xy(0, height) + 'D01*',
+        _xy(0, 0) + 'D01*', 'G37*',
+    ]
+    lines.append('%LPC*%')
+    for x, y in pads:
+        lines += _square(x, y, 0.05)
+
+    lines.append('%LPD*%')
+    for k, (x, y) in enumerate(pads):
+        if k % 3 == 2:
+            x2 = min(max(x + r.uniform(-trace_length, trace_length), 0), width)
+            y2 = min(max(y + r.uniform(-trace_length, trace_length), 0), height)
+            lines += ['D12*', _xy(x, y) + 'D02*', _xy(x2, y2) + 'D01*']
+        else:
+            lines += ['D10*' if k % 3 == 0 else 'D11*', _xy(x, y) + 'D03*']
+
+    lines.append('M02*')
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture
+def board():
+    return synthetic_board()
+
+
+# a fresh k2cnc cutting fr4, set as the machine for the test
+@pytest.fixture
+def machine():
+    from lib.campy import set_machine, Environment, machines
+
+    m = set_machine(Environment(**machines['k2cnc']))
+    m.set_material('fr4-1oz')
+    m.max_rpm = m.min_rpm = 15000
+    yield m
+
+    for file_name in m.files.keys():
+        m.close_file(file_name)
+    set_machine(None)
+
+
+@pytest.fixture
+def iso_bit():
+    from lib.campy import constants
+    from lib.campy.tools import VRouterBit
+    return VRouterBit(included_angle=30.0, diameter=1/8., tip_diameter=0.1*constants.MM, tool_material='hss', flutes=1)
+
+
+@pytest.fixture
+def drill_bit():
+    from lib.campy import constants
+    from lib.campy.tools import StraightRouterBit
+    return StraightRouterBit(diameter=0.9*constants.MM, tool_material='hss', flutes=2)
+
+
+@pytest.fixture
+def cutout_bit():
+    from lib.campy.tools import StraightRouterBit
+    return StraightRouterBit(diameter=1/16., tool_material='hss', flutes=2)
+
+
+# run_job(output_directory, **kwargs) runs pcb_job on the synthetic board with its own machine and returns
+# {file name: contents}.  kwargs go to pcb_job, board=(copper, drills) replaces the synthetic board.  preview=True
+# returns the preview's segments (see toolpath.MoveRecorder) as well
+@pytest.fixture
+def run_job(board, iso_bit, drill_bit, cutout_bit):
+    from lib.campy import PCBProject, Environment, machines, constants, using_machine
+
+    def _run(output_directory, board=board, preview=False, **kwargs):
+        copper, drills = board
+        pcb = PCBProject()
+        pcb.layers = {
+            ('top', 'copper'): {'geometry': copper},
+            ('bottom', 'copper'): {'geometry': copper},
+            ('both', 'drill'): {'geometry': drills},
+        }
+        minx, miny, maxx, maxy = copper.bounds
+        pcb.bounds = [minx, miny, maxx, maxy]
+
+        job = dict(
+            output_directory=output_directory, side='top', drill='top', cutout='top', posts='none',
+            iso_bit=iso_bit, drill_bit=drill_bit, cutout_bit=cutout_bit,
+            outline_depth=0.005, outline_separation=0.020, thickness=1.7*constants.MM,
+        )
+        job.update(kwargs)
+
+        with using_machine(Environment(**machines['k2cnc'])) as m:
+            m.set_material('fr4-1oz')
+            m.max_rpm = m.min_rpm = 15000
+            m.set_save_geoms(preview)
+            pcb.pcb_job(**job)
+            for file_name in m.files.keys():
+                m.close_file(file_name)
+
+        files = dict(
+            (name, open(os.path.join(output_directory, name)).read()) for name in sorted(os.listdir(output_directory))
+        )
+        if preview:
+            return files, m.geometry.segments()
+        return files
+
+    return _run
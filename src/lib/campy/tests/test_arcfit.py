@@ -0,0 +1,80 @@
+import math
+
+from lib.campy import arcfit
+from lib.campy import toolpath as tp
+
+
+def _circle_path(radius=0.25, segments=64, cx=1.0, cy=1.0, z=-0.005):
+    path = tp.Toolpath()
+    path.append(tp.RAPID, cx + radius, cy)
+    path.append(tp.LINEAR, z=z, feed=5)
+    for k in range(1, segments + 1):
+        angle = 2 * math.pi * k / segments
+        path.append(tp.LINEAR, cx + radius * math.cos(angle), cy + radius * math.sin(angle))
+    return path
+
+
+def test_circle_becomes_arcs():
+    path = _circle_path()
+    out = arcfit.fit_arcs(path, tolerance=0.0005)
+
+    arcs = [m for m in out if m.kind in (tp.ARC_CW, tp.ARC_CCW)]
+    assert arcs
+    assert len(out) < len(path)
+    assert all(m.kind == tp.ARC_CCW for m in arcs)
+
+    # every arc is around the circle's center and ends on one of the original vertices
+    vertices = [(m.x, m.y) for m in path if m.kind == tp.LINEAR and m.x is not None]
+    x, y = path.row(0).x, path.row(0).y
+    for m in out:
+        if m.kind in (tp.ARC_CW, tp.ARC_CCW):
+            assert abs(x + m.i - 1.0) < 1e-6 and abs(y + m.j - 1.0) < 1e-6
+            assert (m.x, m.y) in vertices
+        if m.x is not None:
+            x, y = m.x, m.y
+
+    # and the last one closes the circle
+    assert (x, y) == vertices[-1]
+
+
+def test_clockwise():
+    path = tp.Toolpath()
+    path.append(tp.RAPID, 0.1, 0)
+    for k in range(1, 17):
+        angle = -math.pi / 2 * k / 16
+        path.append(tp.LINEAR, 0.1 * math.cos(angle), 0.1 * math.sin(angle))
+
+    kinds = [m.kind for m in arcfit.fit_arcs(path)]
+    assert kinds == [tp.RAPID, tp.ARC_CW]
+
+
+def test_straight_lines_are_left_alone():
+    path = tp.Toolpath()
+    path.append(tp.RAPID, 0, 0)
+    for k in range(1, 10):
+        path.append(tp.LINEAR, k * 0.1, 0)
+
+    assert list(arcfit.fit_arcs(path)) == list(path)
+
+
+def test_too_coarse_for_tolerance():
+    # an octagon is 0.019 away from its circle at the middle of every side
+    path = _circle_path(segments=8)
+    out = arcfit.fit_arcs(path, tolerance=0.0005)
+    assert [m.kind for m in out] == [m.kind for m in path]
+
+
+def test_expressions_and_unknown_start_break_runs():
+    path = tp.Toolpath()
+    # no rapid first - nowhere to start an arc from
+    for k in range(1, 9):
+        angle = math.pi / 2 * k / 8
+        path.append(tp.LINEAR, math.cos(angle), math.sin(angle), z="[#500-0.005]")
+
+    out = arcfit.fit_arcs(path)
+    assert list(out) == list(path)
+
+
+def test_pass():
+    path = _circle_path()
+    assert list(arcfit.ArcFitPass(tolerance=0.0005)(path)) == list(arcfit.fit_arcs(path, tolerance=0.0005))
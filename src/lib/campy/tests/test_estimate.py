@@ -0,0 +1,38 @@
+import math
+import os
+
+from lib.campy import estimate
+from lib.campy import toolpath as tp
+
+
+def test_straight_move():
+    e = estimate.Estimator([60, 60, 60], [10, 10, 10])
+    e.move('a', None, tp.LINEAR, 0, 0, 0, feed=60)
+    e.move('a', None, tp.LINEAR, 1, 0, 0)
+    e.stop('a')
+
+    # 1 in/s, reached after 0.05in and 0.1s, the same again to stop
+    assert abs(e.report()['seconds'] - (0.1 + 0.9 + 0.1)) < 1e-9
+
+
+def test_arc_length():
+    e = estimate.Estimator([6000, 6000, 6000], [1e9, 1e9, 1e9])
+    e.move('a', None, tp.RAPID, 1, 0, 0)
+    e.arc('a', None, False, -1, 0, -1, 0, feed=60)
+    e.stop('a')
+    assert abs(e.report()['files']['a']['distance']['feed'] - math.pi) < 1e-9
+
+
+def test_subroutine_file(tmpdir, run_job):
+    job = dict(panelx=2, panely=2, side='top', drill='top', cutout='top')
+    copied = str(tmpdir.join('copied'))
+    subroutine = str(tmpdir.join('subroutine'))
+    run_job(copied, panel_copy=True, **job)
+    run_job(subroutine, panel_subroutine=True, **job)
+
+    for name in os.listdir(copied):
+        a = estimate.estimate_files([os.path.join(copied, name)], [144, 144, 20], [10, 10, 5])
+        b = estimate.estimate_files([os.path.join(subroutine, name)], [144, 144, 20], [10, 10, 5])
+        assert a['seconds'] > 0
+        assert abs(a['seconds'] - b['seconds']) < 1e-6 * a['seconds']
+        assert a['files'].values()[0]['moves'] == b['files'].values()[0]['moves']
@@ -0,0 +1,42 @@
+from lib.campy import gcode
+
+
+def test_parse_words():
+    assert gcode.parse_words("G1 X1.5 Y-.25 Z[#500-0.005] F#501 (comment)") == [
+        ('G', 1.0), ('X', 1.5), ('Y', -0.25), ('Z', '[#500-0.005]'), ('F', '#501'),
+    ]
+
+
+def test_subroutines_and_local_offsets():
+    lines = [
+        "o100 sub",
+        "G0 X0.1 Y0.2",
+        "G1 Z-0.01 F5",
+        "o100 endsub",
+        "G52 X0 Y0",
+        "o100 call",
+        "G52 X1 Y0.5",
+        "o100 call",
+        "G52 X0 Y0",
+        "G0 X0 Y0",
+    ]
+    events = [event for number, event in gcode.events(lines)]
+    assert events == [
+        ('move', 'G0', {'X': 0.1, 'Y': 0.2}, None),
+        ('move', 'G1', {'X': 0.1, 'Y': 0.2, 'Z': -0.01}, 5.0),
+        ('move', 'G0', {'X': 1.1, 'Y': 0.7, 'Z': -0.01}, None),
+        ('move', 'G1', {'X': 1.1, 'Y': 0.7, 'Z': -0.01}, 5.0),
+        ('move', 'G0', {'X': 0.0, 'Y': 0.0, 'Z': -0.01}, None),
+    ]
+
+
+def test_subroutine_panel_reads_back_like_copied_one(tmpdir, run_job):
+    job = dict(panelx=2, panely=2, side='top', drill='top', cutout='top')
+    copied = run_job(str(tmpdir.join('copied')), panel_copy=True, **job)
+    subroutine = run_job(str(tmpdir.join('subroutine')), panel_subroutine=True, **job)
+
+    assert sorted(copied) == sorted(subroutine)
+    for name in copied:
+        assert ' call' in subroutine[name]
+        # both are written to 6 decimals, from numbers that were added up differently
+        assert gcode.compare(copied[name].splitlines(), subroutine[name].splitlines(), tolerance=2e-6) == []
@@ -0,0 +1,210 @@
+import math
+import os
+import re
+
+import numpy
+import shapely.geometry
+import shapely.ops
+
+from lib.campy import geometry
+
+datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# a polygon with a hole, a multipolygon, a line and a point with a radius
+svg_geoms = [
+    shapely.geometry.Polygon(
+        [(0, 0), (1, 0), (1, 1), (0, 1)], [[(0.25, 0.25), (0.25, 0.5), (0.5, 0.5), (0.5, 0.25)]],
+    ),
+    shapely.geometry.MultiPolygon([shapely.geometry.box(2, 0, 3, 0.5), shapely.geometry.box(2, 1, 2.5, 1.5)]),
+    shapely.geometry.LineString([(0, 2), (1, 2.5), (2, 2)]),
+    shapely.geometry.Point(3, 2, 0.1),
+]
+
+
+def test_shapely_to_svg_is_unchanged(tmpdir):
+    # data/shapely_to_svg.svg is what shapely_to_svg wrote before batch
+    path = str(tmpdir.join('geoms.svg'))
+    geometry.shapely_to_svg(path, svg_geoms, batch=False)
+    assert open(path).read() == open(os.path.join(datadir, 'shapely_to_svg.svg')).read()
+
+
+def test_shapely_to_svg_batch(tmpdir):
+    path = str(tmpdir.join('geoms.svg'))
+    geometry.shapely_to_svg(path, svg_geoms)
+    svg = open(path).read()
+    assert svg.count('<path') == 2
+    assert '<polygon' not in svg
+
+    # same viewBox as unbatched
+    unbatched = str(tmpdir.join('unbatched.svg'))
+    geometry.shapely_to_svg(unbatched, svg_geoms, batch=False)
+    viewbox = lambda p: open(p).read().split('viewBox="')[1].split('"')[0]
+    assert viewbox(path) == viewbox(unbatched)
+
+
+def test_svg_bounds():
+    geoms = svg_geoms + [shapely.geometry.LineString(), shapely.geometry.box(-1, -2, -0.5, 0)]
+    for flip in True, False:
+        expected = geometry.shapely_svg_bounds(geoms, flip=flip)
+        assert geometry.coords_svg_bounds(geometry.shapely_coords(geoms, flip=flip)[0]) == expected
+    assert geometry.shapely_svg_bounds([shapely.geometry.box(0, -1, 1, 0)]) == {
+        'minx': 0, 'miny': 0, 'maxx': 1, 'maxy': 1, 'box_width': 1, 'box_height': 1,
+    }
+
+
+def test_shapely_coords():
+    geoms = [
+        shapely.geometry.GeometryCollection([
+            svg_geoms[0],
+            shapely.geometry.MultiLineString([[(0, 0, 1), (1, 1, 2)], [(2, 2), (3, 3), (4, 4)]]),
+        ]),
+        shapely.geometry.MultiPoint([(5, 5, 0.25), (6, 6, 0.5)]),
+        shapely.geometry.Point(7, 7),
+        shapely.geometry.LineString(),
+        shapely.geometry.Polygon(),
+    ]
+    xy, kinds, starts, counts, z = geometry.shapely_coords(geoms)
+
+    E, I, L, P = geometry.EXTERIOR, geometry.INTERIOR, geometry.LINE, geometry.POINT
+    assert kinds.tolist() == [E, I, L, L, P, P, P]
+    assert counts.tolist() == [5, 5, 2, 3, 1, 1, 1]
+    assert starts.tolist() == [0, 5, 10, 12, 15, 16, 17]
+    assert z.tolist() == [0, 0, 0, 0, 0.25, 0.5, 0]
+    assert xy[10:].tolist() == [[0, 0], [1, -1], [2, -2], [3, -3], [4, -4], [5, -5], [6, -6], [7, -7]]
+    assert numpy.array_equal(geometry.shapely_coords(geoms, flip=False)[0][:, 1], -xy[:, 1])
+
+    assert [len(a) for a in geometry.shapely_coords([])] == [0] * 5
+
+
+def test_shapely_coords_match_shapely():
+    # read out of the WKB, the same as asking shapely for each ring
+    geoms = [
+        shapely.geometry.Point(x, x / 2.).buffer(0.3, 3).difference(shapely.geometry.Point(x, x / 2.).buffer(0.1, 2))
+        for x in range(20)
+    ]
+    xy, kinds, starts, counts, z = geometry.shapely_coords(geoms, flip=False)
+    rings = [r for g in geoms for r in [g.exterior] + list(g.interiors)]
+    assert counts.tolist() == [len(r.coords) for r in rings]
+    assert numpy.array_equal(xy, numpy.concatenate([numpy.asarray(r.coords) for r in rings]))
+
+
+def _same_area(a, b, tolerance=1e-9):
+    return a.symmetric_difference(b).area < tolerance * a.area
+
+
+# pads and traces that overlap each other and the seams of 0.2 tiles, and a clear run cutting squares out of them
+def test_tiled_union(board):
+    copper = list(board[0])
+    pieces = [shapely.geometry.box(x, y, x + 0.1, y + 0.1) for x in (0.15, 0.35, 0.55) for y in (0.15, 0.35)]
+    pieces += [shapely.geometry.LineString([(0, 0.05 * k), (1, 0.7 - 0.05 * k)]).buffer(0.01) for k in range(5)]
+    holes = [shapely.geometry.Point(0.2 * k, 0.2).buffer(0.03) for k in range(6)]
+    runs = [(True, copper + pieces), (False, holes), (True, pieces[:2])]
+
+    expected = shapely.ops.unary_union(copper + pieces).difference(shapely.ops.unary_union(holes))
+    expected = expected.union(shapely.ops.unary_union(pieces[:2]))
+
+    for processes in (1, 2):
+        tiled = geometry.tiled_union(runs, 0.2, processes=processes)
+        assert tiled.is_valid
+        assert _same_area(expected, tiled)
+
+    assert geometry.tiled_union([(False, holes)], 0.2, processes=1) is None
+
+
+def test_tiled_gerber_geometry():
+    from conftest import synthetic_gerber
+    from lib.campy.operations.pcb import GerberGeometryContext, pcb_layer
+
+    layer = pcb_layer(gerber_data=synthetic_gerber(), gerber_file='synthetic.gtl')
+    serial = GerberGeometryContext().render_layer(layer)
+    for processes in (1, 2):
+        tiled = GerberGeometryContext(tile_size=0.2, processes=processes).render_layer(layer)
+        assert tiled.is_valid
+        assert _same_area(serial, tiled)
+
+
+def test_batched_union(board):
+    pieces = list(board[0]) + [shapely.geometry.box(0.1 * k, 0.2, 0.1 * k + 0.15, 0.3) for k in range(8)]
+    pieces.append(shapely.geometry.Polygon())
+
+    expected = shapely.ops.unary_union(pieces)
+    # chunks small enough to be unioned in more than one round
+    for chunk_size in (4, 10, 1000):
+        batched = geometry.batched_union(pieces, chunk_size=chunk_size)
+        assert batched.is_valid
+        assert _same_area(expected, batched)
+
+    assert geometry.batched_union([shapely.geometry.Polygon()]) is None
+
+
+def test_batched_gerber_geometry():
+    from conftest import synthetic_gerber
+    from lib.campy.operations.pcb import GerberGeometryContext, pcb_layer
+
+    # what GerberGeometryContext did before runs of primitives were batched: each one straight into running_poly
+    class OneAtATime(GerberGeometryContext):
+        def update_running(self, p, add=True):
+            if add:
+                self.running_poly = self.running_poly.union(p) if self.running_poly else p
+            else:
+                self.running_poly = self.running_poly.difference(p)
+
+    layer = pcb_layer(gerber_data=synthetic_gerber(), gerber_file='synthetic.gtl')
+    expected = OneAtATime().render_layer(layer)
+    batched = GerberGeometryContext().render_layer(layer)
+    assert batched.is_valid
+    assert _same_area(expected, batched)
+
+
+def test_incremental_offsets(board):
+    copper, step = board[0], 0.01
+    fresh = geometry.offset_passes(copper, step, 6)
+
+    for kwargs, furthest in [
+        (dict(incremental=True), 0.05 * step),
+        (dict(incremental=True, processes=2), 0.05 * step),
+        (dict(incremental=True, tolerance=0.0005), step),
+    ]:
+        passes = geometry.offset_passes(copper, step, 6, **kwargs)
+        assert len(passes) == 6
+        for k, (expected, grown) in enumerate(zip(fresh, passes)):
+            # never closer to the copper than a fresh offset that far out, and not much further from it
+            assert copper.distance(grown.boundary) >= copper.distance(expected.boundary), (kwargs, k)
+            assert expected.hausdorff_distance(grown) < furthest, (kwargs, k)
+
+    assert [g.wkb for g in geometry.offset_passes(copper, step, 6, processes=2)] == [g.wkb for g in fresh]
+
+
+# back from segments_path_data to lines in drawing units
+def _path_lines(d, pixel, origin):
+    lines, x, y = [], 0, 0
+    for move, dx, dy in re.findall(r'(m?)(-?\d+) (-?\d+)', d):
+        x, y = x + int(dx), y + int(dy)
+        if move:
+            lines.append([])
+        lines[-1].append((origin[0] + x * pixel, origin[1] + y * pixel))
+    return [l for l in lines if len(l) > 1]
+
+
+def test_preview_path_matches_moves(tmpdir, run_job):
+    files, segments = run_job(str(tmpdir), preview=True, side='top', drill='top', cutout='top')
+    bounds = geometry.segments_svg_bounds(segments)
+    origin = (bounds['minx'], bounds['miny'])
+
+    # what the preview used to draw, a line for every move
+    flipped = segments * (1, -1, 1, -1)
+    moves = shapely.geometry.MultiLineString([
+        [(x1, y1), (x2, y2)] for x1, y1, x2, y2 in flipped.tolist() if (x1, y1) != (x2, y2)
+    ])
+
+    for size in (200, 800, 3200):
+        pixel = max(bounds['box_width'], bounds['box_height']) / size
+        d = geometry.segments_path_data(segments, pixel, origin=origin)
+        drawn = shapely.geometry.MultiLineString(_path_lines(d, pixel, origin))
+
+        # half a pixel rounding each end onto the grid, and half a pixel simplifying
+        assert moves.hausdorff_distance(drawn) <= (0.5 * math.sqrt(2) + 0.5) * pixel, size
+
+    dwg = geometry.shapely_get_dwg(str(tmpdir.join('preview.svg')), bounds, 0, width=800, height=800, debug=False)
+    geometry.segments_add_to_dwg(dwg, segments, pixel=pixel, origin=origin)
+    assert dwg.tostring().count('<path') == 1
@@ -0,0 +1,85 @@
+import random
+import re
+
+import numpy
+import pytest
+
+from lib.campy import heightmap
+
+
+def _grid(nx=5, ny=4, step=0.25):
+    return [(x * step, y * step, 500 + y * nx + x) for y in range(ny) for x in range(nx)]
+
+
+def _random_points(count, maxx=1.0, maxy=0.75, seed=1):
+    r = random.Random(seed)
+    return numpy.array([(r.uniform(0, maxx), r.uniform(0, maxy)) for i in range(count)])
+
+
+def test_weights_interpolate_planes():
+    probes = _grid()
+    hm = heightmap.HeightMap(probes)
+    coords = _random_points(500)
+    triangles, weights = hm.weights(coords)
+
+    assert (triangles >= 0).all()
+    assert numpy.allclose(weights.sum(axis=1), 1)
+    assert (weights >= -1e-9).all()
+
+    # barycentric weights reproduce any plane exactly, whatever the triangulation
+    heights = dict((var, 0.1 * x - 0.3 * y + 0.02) for x, y, var in probes)
+    for (x, y), k, w in zip(coords, triangles, weights):
+        z = sum(weight * heights[var] for weight, var in zip(w, hm.variables[k]))
+        assert abs(z - (0.1 * x - 0.3 * y + 0.02)) < 1e-9
+
+
+def test_probe_points_use_one_variable():
+    probes = _grid()
+    hm = heightmap.HeightMap(probes)
+    expressions = hm.expressions([(0.25, 0.5), (1.0, 0.0)])
+    assert expressions == ["[1.0000*#511]", "[1.0000*#504]"]
+
+
+def test_expressions():
+    hm = heightmap.HeightMap(_grid())
+    coords = _random_points(50)
+    expressions = hm.expressions(coords, offset=-0.005)
+
+    term = r"\d\.\d{4}\*#5\d\d"
+    for e in expressions:
+        assert re.match(r"^\[%s(\+%s){0,2}-0\.0050\]$" % (term, term), e), e
+
+    # tiny or long offsets still come out as plain decimals
+    assert hm.expressions(coords[:1], offset=-0.00005, precision=5)[0].endswith("-0.00005]")
+    assert hm.expressions(coords[:1], offset=1/3., precision=4)[0].endswith("+0.3333]")
+
+
+def test_off_the_map():
+    hm = heightmap.HeightMap(_grid())
+    with pytest.raises(Exception):
+        hm.weights([(0.5, 0.5), (2, 2)])
+
+
+# what pcb_isolation_mill did before HeightMap - look through every triangle for each point
+def _linear_search_height(triangles, x, y, values):
+    import shapely.geometry
+
+    pt = shapely.geometry.Point(x, y)
+    match = next(t for t in triangles if t.intersects(pt))
+    (x1, y1, z1), (x2, y2, z2), (x3, y3, z3) = match.exterior.coords[:3]
+    d = (y2 - y3) * (x1 - x3) + (x3 - x2) * (y1 - y3)
+    w1 = ((y2 - y3) * (x - x3) + (x3 - x2) * (y - y3)) / d
+    w2 = ((y3 - y1) * (x - x3) + (x1 - x3) * (y - y3)) / d
+    return w1 * values[int(z1)] + w2 * values[int(z2)] + (1 - w1 - w2) * values[int(z3)]
+
+
+def test_expressions_match_linear_search():
+    probes = _grid()
+    r = random.Random(2)
+    values = dict((var, r.uniform(-0.01, 0.01)) for x, y, var in probes)
+    hm = heightmap.HeightMap(probes)
+    coords = _random_points(200)
+
+    for (x, y), e in zip(coords, hm.expressions(coords, precision=6)):
+        z = eval(re.sub(r'#(\d+)', lambda m: repr(values[int(m.group(1))]), e.replace('[', '(').replace(']', ')')))
+        assert abs(z - _linear_search_height(hm.triangles, x, y, values)) < 1e-6
@@ -0,0 +1,76 @@
+import os
+import time
+
+import shapely.geometry
+
+from lib.campy import layercache
+
+
+def _files(directory):
+    return sorted(
+        os.path.join(root, name)
+        for root, dirs, names in os.walk(directory) for name in names if name != layercache.size_file
+    )
+
+
+def _size(directory):
+    return int(open(os.path.join(directory, layercache.size_file)).read())
+
+
+def test_geometry_is_made_once(tmpdir):
+    cache = layercache.LayerCache(str(tmpdir))
+    made = []
+
+    def _make():
+        made.append(1)
+        return [shapely.geometry.Point(0, 0).buffer(1), shapely.geometry.LineString([(0, 0), (1, 1)])]
+
+    first = cache.geometry('data', 'board.gtl', 'copper', _make)
+    again = cache.geometry('data', 'board.gtl', 'copper', _make)
+    assert len(made) == 1
+    assert [g.wkb for g in again] == [g.wkb for g in first]
+
+    # no directory, nothing kept
+    cache = layercache.LayerCache()
+    cache.geometry('data', 'board.gtl', 'copper', _make)
+    cache.geometry('data', 'board.gtl', 'copper', _make)
+    assert len(made) == 3
+
+
+def test_size_is_kept_without_looking_through_the_directory(tmpdir, monkeypatch):
+    directory = str(tmpdir)
+    cache = layercache.LayerCache(directory, max_bytes=10 ** 6)
+    cache.geometry('a', 'board.gtl', 'copper', lambda: shapely.geometry.Point(0, 0).buffer(1))
+
+    def _walk(*args):
+        raise AssertionError("looked through the directory")
+
+    monkeypatch.setattr(os, 'walk', _walk)
+    for k in range(5):
+        cache.geometry(str(k), 'board.gtl', 'copper', lambda: shapely.geometry.Point(0, 0).buffer(1))
+    monkeypatch.undo()
+
+    assert _size(directory) == sum(os.path.getsize(path) for path in _files(directory))
+
+
+def test_least_recently_used_go(tmpdir):
+    directory = str(tmpdir)
+    geom = shapely.geometry.Point(0, 0).buffer(1)
+    cache = layercache.LayerCache(directory)
+
+    # mtimes are what says which was used last
+    for k in range(3):
+        cache.geometry(str(k), 'board.gtl', 'copper', lambda: geom)
+        path = [p for p in _files(directory) if p.endswith('{}-copper.wkb'.format(cache.key(str(k), 'board.gtl')))][0]
+        os.utime(path, (time.time() - 100 + k, time.time() - 100 + k))
+    size = os.path.getsize(path)
+
+    cache.max_bytes = 3 * size
+    cache.geometry('3', 'board.gtl', 'copper', lambda: geom)
+    assert len(_files(directory)) == 3
+    assert _size(directory) == 3 * size
+
+    made = []
+    cache.geometry('0', 'board.gtl', 'copper', lambda: made.append(1) or geom)
+    cache.geometry('3', 'board.gtl', 'copper', lambda: made.append(2) or geom)
+    assert made == [1]
@@ -0,0 +1,89 @@
+import math
+import random
+
+import numpy
+
+from lib.campy import optimize
+
+
+def _random_points(count, seed=1):
+    r = random.Random(seed)
+    return [(r.uniform(0, 4), r.uniform(0, 3)) for i in range(count)]
+
+
+def _ring(x, y, radius, count=8):
+    ring = [
+        (x + radius * math.cos(2 * math.pi * k / count), y + radius * math.sin(2 * math.pi * k / count))
+        for k in range(count)
+    ]
+    return ring + [ring[0]]
+
+
+def test_nearest_matches_brute_force():
+    points = numpy.array(_random_points(300))
+    index = optimize.GridIndex(points)
+    alive = set(range(len(points)))
+
+    r = random.Random(2)
+    for i in range(100):
+        # query points inside and well outside the grid
+        x, y = r.uniform(-2, 6), r.uniform(-2, 5)
+        live = sorted(alive)
+        d = numpy.hypot(points[live, 0] - x, points[live, 1] - y)
+        assert index.nearest(x, y) == live[d.argmin()]
+
+        gone = r.choice(live)
+        index.remove_owner(gone)
+        alive.remove(gone)
+
+
+def test_nearest_with_everything_removed():
+    index = optimize.GridIndex([(0, 0), (1, 1)], owners=[0, 0])
+    index.remove_owner(0)
+    assert index.nearest(0, 0) is None
+
+
+def test_two_opt_uncrosses():
+    # 0 -> 2 -> 1 -> 3 doubles back on itself, reversing the middle fixes it
+    points = [(1, 0), (2, 0), (3, 0), (4, 0)]
+    order = optimize.two_opt(points, (0, 0), order=[0, 2, 1, 3])
+    assert list(order) == [0, 1, 2, 3]
+
+
+def test_order_rings():
+    r = random.Random(3)
+    rings = [_ring(r.uniform(0, 4), r.uniform(0, 3), 0.05) for i in range(50)]
+    out, stats = optimize.order_rings(rings, start=(0, 0))
+
+    assert len(out) == len(rings)
+    assert stats['travel_after'] < stats['travel_before']
+    assert abs(stats['travel_after'] - optimize.path_length([ring[0] for ring in out], start=(0, 0))) < 1e-9
+
+    # every ring is still there and closed, maybe entered at a different vertex
+    assert sorted(sorted(ring[:-1]) for ring in out) == sorted(sorted(ring[:-1]) for ring in rings)
+    assert all(ring[0] == ring[-1] for ring in out)
+
+    assert optimize.order_rings(rings, start=(0, 0)) == (out, stats)
+
+
+def test_order_points():
+    points = _random_points(200)
+    for method in ('tsp', 'serpentine'):
+        order, stats = optimize.order_points(points, method=method)
+        assert sorted(order) == range(len(points))
+        assert stats['travel_after'] < stats['travel_before']
+
+    assert optimize.order_points([], method='tsp')[0] == []
+
+
+def test_order_holes_groups_by_size():
+    r = random.Random(4)
+    holes = [(x, y, r.choice((0.02, 0.01, 0.015))) for x, y in _random_points(60)]
+    groups, stats = optimize.order_holes(holes)
+
+    assert [size for size, indexes in groups] == [0.01, 0.015, 0.02]
+    assert sorted(i for size, indexes in groups for i in indexes) == range(len(holes))
+    assert all(holes[i][2] == size for size, indexes in groups for i in indexes)
+
+    groups, stats = optimize.order_holes(holes, group=False)
+    assert [size for size, indexes in groups] == [None]
@@ -0,0 +1,164 @@
+import re
+
+import gerber.primitives as primitives
+import shapely.affinity
+import shapely.geometry
+import shapely.ops
+from gerber.render import theme
+
+from lib.campy.operations.pcb import GerberGeometryContext, GerberSVGContext, pcb_layer
+
+
+# what _render_circle and _render_rectangle made for every flash before the shapes were made once and moved
+def _circle(prim):
+    geom = shapely.geometry.Point(*prim.position).buffer(distance=prim.radius)
+    if prim.hole_diameter:
+        geom = geom.difference(shapely.geometry.Point(*prim.position).buffer(distance=prim.hole_diameter))
+    return geom
+
+
+def _rectangle(prim):
+    (x, y), w, h = prim.position, prim.width, prim.height
+    geom = shapely.affinity.rotate(shapely.geometry.box(x - w/2., y - h/2., x + w/2., y + h/2.), prim.rotation, origin=(x, y))
+    if prim.hole_diameter:
+        geom = geom.difference(shapely.geometry.Point(x, y).buffer(distance=prim.hole_diameter))
+    return geom
+
+
+def test_flashes_match_per_flash_shapes():
+    flashes = []
+    for k, (x, y) in enumerate([(0.1, 0.2), (0.5, 0.3), (1.25, -0.5)]):
+        flashes += [
+            (primitives.Circle((x, y), 0.06), _circle),
+            (primitives.Circle((x, y), 0.06, hole_diameter=0.01), _circle),
+            (primitives.Rectangle((x, y), 0.06, 0.04), _rectangle),
+            (primitives.Rectangle((x, y), 0.06, 0.04, rotation=30), _rectangle),
+            (primitives.Rectangle((x, y), 0.06, 0.04, rotation=90), _rectangle),
+            (primitives.Rectangle((x, y), 0.08, 0.05, hole_diameter=0.01, rotation=45), _rectangle),
+        ]
+
+    ctx = GerberGeometryContext()
+    for prim, per_flash in flashes:
+        ctx.polys = []
+        ctx.render(prim)
+        expected = per_flash(prim)
+        assert ctx.polys[0].symmetric_difference(expected).area < 1e-12
+
+    # every aperture was made once
+    assert len(ctx.templates) == 6
+
+
+def test_process_layers_in_processes():
+    from conftest import synthetic_gerber
+    from lib.campy.operations.pcb import PCBProject
+
+    def _processed(processes):
+        pcb = PCBProject()
+        pcb.layers = {
+            ('top', 'copper'): {'filename': 'board.gtl', 'data': synthetic_gerber(seed=1)},
+            ('bottom', 'copper'): {'filename': 'board.gbl', 'data': synthetic_gerber(seed=2, width=1.2)},
+            ('top', 'silk'): {'filename': 'board.gto', 'data': 'not looked at'},
+        }
+        pcb.process_layers(processes=processes)
+        return pcb
+
+    serial = _processed(1)
+    for processes in (None, 2):
+        pcb = _processed(processes)
+        assert pcb.bounds == serial.bounds
+        for key in ('top', 'copper'), ('bottom', 'copper'):
+            assert pcb.layers[key]['geometry'].wkb == serial.layers[key]['geometry'].wkb
+        assert 'geometry' not in pcb.layers['top', 'silk']
+
+
+# the subpaths of a batched path: fills are closed (a circle is two half circles), strokes are open lines
+def _path_geometry(d, stroke_width=None):
+    shapes = []
+    for sub in re.findall(r'M[^M]*', d):
+        tokens = re.findall(r'[A-Za-z]|-?[0-9.]+', sub)
+        points, circle, command, k = [], None, None, 0
+        while k < len(tokens):
+            if tokens[k].isalpha():
+                command = tokens[k]
+                k += 1
+            elif command in 'ML':
+                points.append((float(tokens[k]), float(tokens[k+1])))
+                k += 2
+            elif command in 'hv':
+                x, y = points[-1]
+                points.append((x + float(tokens[k]), y) if command == 'h' else (x, y + float(tokens[k])))
+                k += 1
+            elif command == 'a':
+                x, y = points[-1]
+                dx, dy = float(tokens[k+5]), float(tokens[k+6])
+                circle = circle or ((x + dx/2., y + dy/2.), float(tokens[k]))
+                points.append((x + dx, y + dy))
+                k += 7
+
+        if stroke_width is not None:
+            line = shapely.geometry.LineString(points) if len(set(points)) > 1 else shapely.geometry.Point(points[0])
+            shapes.append(line.buffer(stroke_width / 2.))
+        elif circle:
+            shapes.append(shapely.geometry.Point(*circle[0]).buffer(circle[1]))
+        else:
+            shapes.append(shapely.geometry.Polygon(points))
+    return shapely.ops.unary_union(shapes)
+
+
+# what a layer mask covers, painting its elements in order - white adds to it and black takes away
+def _mask_geometry(mask):
+    geom = shapely.geometry.Polygon()
+    for e in mask.elements:
+        a = e.attribs
+        if e.elementname == 'rect':
+            shape = shapely.geometry.box(a['x'], a['y'], a['x'] + a['width'], a['y'] + a['height'])
+        elif e.elementname == 'circle':
+            shape = shapely.geometry.Point(a['cx'], a['cy']).buffer(a['r'])
+        elif e.elementname == 'polygon':
+            shape = shapely.geometry.Polygon(e.points)
+        elif e.elementname == 'line':
+            points = [(a['x1'], a['y1']), (a['x2'], a['y2'])]
+            line = shapely.geometry.LineString(points) if points[0] != points[1] else shapely.geometry.Point(points[0])
+            shape = line.buffer(a['stroke-width'] / 2.)
+        elif e.elementname == 'polyline':
+            shape = shapely.geometry.LineString(e.points).buffer(a['stroke-width'] / 2.)
+        else:
+            shape = _path_geometry(e.get_xml().get('d'), a['stroke-width'] if a['fill'] == 'none' else None)
+
+        color = a['stroke'] if a.get('fill', 'none') == 'none' else a['fill']
+        geom = geom.union(shape) if color == 'white' else geom.difference(shape)
+    return geom
+
+
+# arcs each way round and a line, none of which synthetic_gerber has
+def _arc_gerber():
+    return '\n'.join([
+        '%FSLAX24Y24*%', '%MOIN*%', '%ADD10C,0.0200*%', '%LPD*%', 'D10*', 'G75*',
+        'X002000Y001000D02*', 'G03X004000Y003000I000000J002000D01*',
+        'X005000Y005000D02*', 'G02X006000Y004000I001000J000000D01*',
+        'X001000Y006000D02*', 'G01X003000Y006000D01*', 'M02*',
+    ]) + '\n'
+
+
+def test_batched_svg_matches_unbatched():
+    from conftest import synthetic_gerber
+
+    for gerber_data in synthetic_gerber(), _arc_gerber():
+        layer = pcb_layer(gerber_data=gerber_data, gerber_file='synthetic.gtl')
+        for size in 200, 800:
+            ctxs = {}
+            for batch in False, True:
+                ctxs[batch] = GerberSVGContext(width=size, height=size, batch=batch)
+                ctxs[batch].render_layers([layer], theme=theme.THEMES['default'])
+
+            assert ctxs[True].dwg.attribs['viewBox'] == ctxs[False].dwg.attribs['viewBox']
+            unbatched, = ctxs[False].dwg.defs.elements
+            batched, = ctxs[True].dwg.defs.elements
+            assert len(batched.elements) < len(unbatched.elements)
+
+            # batched coordinates are rounded to number_format, so no edge can move by more than its last digit
+            expected, got = _mask_geometry(unbatched), _mask_geometry(batched)
+            rounding = 10 ** -int(ctxs[True].number_format.strip('%.f'))
+            assert expected.area > 0.01
+            assert got.boundary.hausdorff_distance(expected.boundary) < rounding
+            assert got.symmetric_difference(expected).area < expected.boundary.length * rounding
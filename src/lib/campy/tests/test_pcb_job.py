@@ -0,0 +1,125 @@
+import json
+import os
+import re
+
+from conftest import synthetic_board
+from lib.campy import constants, gcode
+from lib.campy import toolpath as tp
+from lib.campy.tools import StraightRouterBit
+
+datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# data/pcb_job has what pcb_job wrote for this job before boards could be copied or files made in worker processes.
+# Whatever it's given now, a job that doesn't ask for those has to come out exactly the same
+old_board = synthetic_board(count=6, holes=10)
+old_job = dict(
+    side='both', drill='top', cutout='bottom', posts='x', fixture_width=3, flip='x', panelx=2, panely=1,
+    post_bit=StraightRouterBit(diameter=1/8., tool_material='hss', flutes=2), outline_separation=0.010,
+)
+
+
+def _old_files():
+    path = os.path.join(datadir, 'pcb_job')
+    return dict((name, open(os.path.join(path, name)).read()) for name in sorted(os.listdir(path)))
+
+
+def _comment_points(txt):
+    return [(float(x), float(y)) for x, y in re.findall(r'HelicalDrill at \[([-\d.e]+), ([-\d.e]+)\]', txt)]
+
+
+def test_panel_matches_old_output(tmpdir, run_job):
+    assert run_job(str(tmpdir), board=old_board, **old_job) == _old_files()
+
+
+def test_panel_copy(tmpdir, run_job):
+    made = run_job(str(tmpdir.join('made')), board=old_board, **old_job)
+    copied = run_job(str(tmpdir.join('copied')), board=old_board, panel_copy=True, **old_job)
+    assert sorted(copied) == sorted(made)
+
+    # copies cut the same holes and outline, and say where they are in the comments
+    for name in ('pcb_top_2_drill.ngc', 'pcb_bottom_3_cutout.ngc'):
+        assert gcode.compare(made[name].splitlines(), copied[name].splitlines(), tolerance=1e-6) == []
+
+        points = zip(_comment_points(made[name]), _comment_points(copied[name]))
+        assert len(points) == len(_comment_points(made[name]))
+        assert all(abs(a[0] - b[0]) < 1e-9 and abs(a[1] - b[1]) < 1e-9 for a, b in points)
+
+    # and there's one copy of the isolation passes for every board
+    for name in ('pcb_top_1_iso.ngc', 'pcb_bottom_1_iso.ngc'):
+        assert abs(len(copied[name].splitlines()) - len(made[name].splitlines())) < len(made[name].splitlines()) / 20
+
+
+def test_translated_moves_comment_points():
+    path = tp.Toolpath()
+    path.append(
+        tp.TEXT, 0.5, -0.25, flags=tp.COMMENT_POINT,
+        text="(Cutting HelicalDrill at [0.5, -0.25], outter_rad=0.040, depth=0.067)",
+    )
+    path.append(tp.TEXT, text="(PCB Cutout bounds=[0.0, 0.0, 1.0, 0.75])")
+    path.append(tp.TEXT, text="(user note at [0.5, -0.25])")
+    path.append(tp.TEXT, text="#500=[#5422+0.5]")
+    path.append(tp.RAPID, 0.5, -0.25, z="[#500+0.1]")
+
+    moved = list(path.translated(1, 2))
+    assert moved[0].text == "(Cutting HelicalDrill at [1.5, 1.75], outter_rad=0.040, depth=0.067)"
+    # only marked points are moved
+    for k in (1, 2, 3):
+        assert moved[k].text == path.row(k).text
+    assert (moved[4].x, moved[4].y, moved[4].z) == (1.5, 1.75, "[#500+0.1]")
+
+
+def test_helical_drill_marks_its_point(machine, drill_bit):
+    from lib.campy import helical_drill
+
+    machine.set_tool(drill_bit)
+    with machine.record() as path:
+        helical_drill(center=(0.5, 0.25), outer_rad=0.04, z=0, depth=0.067, stepdown="10%")
+        machine.comment("not a point [0.5, 0.25]")
+
+    marked = [m for m in path if m.kind == tp.TEXT and m.flags & tp.COMMENT_POINT]
+    assert [(m.x, m.y) for m in marked] == [(0.5, 0.25)]
+    assert "[0.5, 0.25]" in marked[0].text
+
+
+def test_serial_and_parallel_match(tmpdir, run_job):
+    for optimize_travel in (False, True):
+        job = dict(side='both', drill='top', cutout='bottom', optimize_travel=optimize_travel)
+        serial = run_job(str(tmpdir.join('serial_%s' % optimize_travel)), **job)
+        parallel = run_job(str(tmpdir.join('parallel_%s' % optimize_travel)), processes=2, **job)
+        assert parallel == serial
+
+
+def test_render_cam_processes(tmpdir, board, iso_bit, drill_bit, cutout_bit):
+    # set up the way PCBApi._render_cam_internal does it, with the estimator watching a deferred machine
+    from lib.campy import PCBProject, Environment, machines, using_machine, estimate
+    from lib.campy.post import CompactGCodePost
+
+    copper, drills = board
+    pcb = PCBProject()
+    pcb.layers = {('top', 'copper'): {'geometry': copper}, ('both', 'drill'): {'geometry': drills}}
+    pcb.bounds = list(copper.bounds)
+
+    def _run(output_directory, processes):
+        with using_machine(Environment(deferred=True, **machines['k2cnc'])) as m:
+            m.set_material('fr4-1oz')
+            m.max_rpm = m.min_rpm = 1000
+            m.set_post(CompactGCodePost())
+            estimator = estimate.Estimator.for_machine(m)
+            m.add_pass(estimator.watch(m))
+
+            pcb.pcb_job(
+                output_directory=output_directory, side='top', drill='top', cutout='top', posts='none',
+                iso_bit=iso_bit, drill_bit=drill_bit, cutout_bit=cutout_bit, flip='x', processes=processes,
+            )
+            for file_name in m.files.keys():
+                m.close_file(file_name)
+
+        files = dict((name, open(os.path.join(output_directory, name)).read()) for name in os.listdir(output_directory))
+
+        # what goes in estimate.json - the files are in the order they were written out, which can differ
+        return files, json.loads(json.dumps(estimator.report()))
+
+    serial = _run(str(tmpdir.join('serial')), None)
+    parallel = _run(str(tmpdir.join('parallel')), 2)
+    assert len(serial[0]) == 3
+    assert parallel == serial
@@ -0,0 +1,65 @@
+from lib.campy import gcode, post
+from lib.campy import toolpath as tp
+
+
+def _drill_path():
+    path = tp.Toolpath()
+    path.append(tp.DRILL, 0.1, 0.2, 0.1, i=0.05, j=-0.07, feed=10, flags=tp.DRILL_START)
+    path.append(tp.DRILL, 0.3, 0.2, flags=tp.DRILL_END)
+    path.append(tp.RAPID, 0.3, 0.2, 0.1)
+    path.append(tp.LINEAR, 0.4, 0.2, 0.1, feed=10)
+    return path
+
+
+# after G80 Z and the motion mode are written again, the feed the cycle set carries on
+def test_drill_cycle_end_resets_modal_state():
+    lines = [line for level, line in post.CompactGCodePost().render(_drill_path())]
+    assert lines[-3:] == ['G80', 'G0 Z0.1', 'G1 X0.4']
+
+
+class RecordingPost(post.GCodePost):
+    def reset(self):
+        self.cancelled = 0
+
+    def cancel_cycle(self):
+        self.cancelled += 1
+
+
+def test_drill_cycle_end_cancels_cycle():
+    p = RecordingPost()
+    lines = [line for level, line in p.render(_drill_path())]
+    assert lines[3] == 'G80'
+    assert p.cancelled == 1
+
+
+# isolation passes with arcs, and drilling, recorded once so both post-processors get exactly the same moves
+def _job(machine, board, iso_bit, drill_bit):
+    from lib.campy import constants, pcb_drill, pcb_isolation_mill
+
+    copper, drills = board
+    with machine.record() as path:
+        machine.set_tool(iso_bit)
+        pcb_isolation_mill(gerber_geometry=copper, outline_separation=0.020, depth=0.005, arc_tolerance=0.0005)
+        machine.set_tool(drill_bit)
+        pcb_drill(gerber_geometry=drills, depth=1.7*constants.MM)
+    return path
+
+
+def test_compact_moves_the_same(machine, board, iso_bit, drill_bit):
+    path = _job(machine, board, iso_bit, drill_bit)
+    plain = [line for level, line in post.GCodePost().render(path)]
+
+    for units, precision, feed_precision in [('inch', 4, 3), ('inch', 3, 1), ('mm', 3, 1), ('mm', 2, 0)]:
+        compact = post.CompactGCodePost(
+            precision={units: precision}, feed_precision={units: feed_precision}, units=units,
+        )
+        lines = [line for level, line in compact.render(path) if line is not None]
+        # half a unit in the last place kept, plus a little for the 6 places GCodePost rounds to
+        assert gcode.compare(
+            plain, lines, tolerance=0.5 * 10 ** -precision + 1e-6, feed_tolerance=0.5 * 10 ** -feed_precision + 1e-6,
+        ) == []
+
+        stats = compact.stats()
+        assert stats['bytes_before'] == sum(len(line) + 1 for line in plain)
+        assert stats['bytes_after'] == sum(len(line) + 1 for line in lines)
+        assert stats['bytes_saved'] == stats['bytes_before'] - stats['bytes_after'] > 0
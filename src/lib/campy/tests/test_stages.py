@@ -0,0 +1,121 @@
+import datetime
+
+import numpy
+
+from lib.campy.stages import StageCache
+from lib.campy.tools import StraightRouterBit
+
+
+# the load_cache/update_cache half of lib.cache's caches, in a dict
+class DictStore(object):
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.caches = {}
+
+    def load_cache(self, key):
+        return self.caches.get(key)
+
+    def update_cache(self, key, cache):
+        self.caches[key] = cache
+
+
+def test_key():
+    bit = StraightRouterBit(diameter=1/16., tool_material='hss', flutes=2)
+    same = StraightRouterBit(diameter=1/16., tool_material='hss', flutes=2)
+    other = StraightRouterBit(diameter=1/8., tool_material='hss', flutes=2)
+
+    assert StageCache.key('a', {'x': 1, 'y': [1, 2]}) == StageCache.key('a', {'y': (1, 2), 'x': 1})
+    assert StageCache.key('a', bit) == StageCache.key('a', same)
+    assert StageCache.key('a', bit) != StageCache.key('a', other)
+    assert StageCache.key('a', 1) != StageCache.key('b', 1)
+
+
+def test_get_makes_once():
+    made = []
+
+    def _make():
+        made.append(1)
+        return len(made)
+
+    stages = StageCache()
+    assert stages.get('a', (1, 2), _make) == 1
+    assert stages.get('a', (1, 2), _make) == 1
+    assert stages.get('a', (1, 3), _make) == 2
+    assert (stages.hits['a'], stages.misses['a']) == (1, 2)
+
+
+def test_most_recently_used_are_kept():
+    stages = StageCache(max_items=2)
+    for k in range(3):
+        stages.save('a', (k, ), k)
+    stages.load('a', (1, ))
+    stages.save('a', (3, ), 3)
+
+    assert [stages.load('a', (k, )) for k in range(4)] == [None, 1, None, 3]
+
+
+def test_store():
+    store = DictStore()
+    StageCache(store=store).save('a', (1, ), 'value')
+
+    stages = StageCache(store=store)
+    assert stages.load('a', (1, )) == 'value'
+    assert stages.load('a', (2, )) is None
+
+    for cached in store.caches.values():
+        cached['created'] -= datetime.timedelta(seconds=60)
+    store.timeout = 30
+    assert StageCache(store=store).load('a', (1, )) is None
+
+
+def test_pcb_job_only_remakes_what_changed(tmpdir, run_job):
+    job = dict(optimize_travel=True)
+    stages = StageCache()
+    run_job(str(tmpdir.join('first')), stages=stages, **job)
+    assert stages.hits['section'] == 0
+
+    # the same job again comes straight out of stages
+    assert run_job(str(tmpdir.join('again')), stages=stages, **job) == run_job(str(tmpdir.join('plain')), **job)
+    assert stages.hits['section'] == 3
+
+    # a new drill bit doesn't remake the isolation file.  The cutout after it is, a feed the drill leaves unused
+    # carries over to it
+    job['drill_bit'] = StraightRouterBit(diameter=0.035, tool_material='hss', flutes=2)
+    staged = run_job(str(tmpdir.join('drill')), stages=stages, **job)
+    assert staged == run_job(str(tmpdir.join('plain_drill')), **job)
+    assert stages.hits['section'] == 4
+
+    # arcs change the isolation file, but not the offsets it's made from
+    job['arc_tolerance'] = 0.0005
+    hits = stages.hits['offsets']
+    staged = run_job(str(tmpdir.join('arcs')), stages=stages, **job)
+    assert staged == run_job(str(tmpdir.join('plain_arcs')), **job)
+    assert stages.hits['offsets'] == hits + 1
+
+
+def test_pcb_job_staged_is_unchanged(tmpdir, run_job, cutout_bit):
+    # without optimize_travel every file carries on from where the last one left off, staged or not - the files and
+    # the preview come out the same the first time and when they're taken from stages
+    for k, job in enumerate([
+        dict(side='both', drill='top', cutout='bottom'),
+        dict(side='both', drill='top', cutout='bottom', file_per_operation=False, posts='x', post_bit=cutout_bit),
+    ]):
+        plain_files, plain_preview = run_job(str(tmpdir.join('plain%d' % k)), preview=True, **job)
+        stages = StageCache()
+        for run in ('first', 'again'):
+            files, preview = run_job(str(tmpdir.join('%s%d' % (run, k))), preview=True, stages=stages, **job)
+            assert files == plain_files
+            assert numpy.array_equal(preview, plain_preview)
+        assert stages.misses['section'] == stages.hits['section'] > 0
+
+
+def test_pcb_job_serial_and_parallel_share_stages(tmpdir, run_job):
+    job = dict(optimize_travel=True, side='both', drill='top', cutout='top')
+    expected = run_job(str(tmpdir.join('plain')), **job)
+
+    for first, second in [(2, None), (None, 2)]:
+        stages = StageCache()
+        run_job(str(tmpdir.join('first_%s' % first)), stages=stages, processes=first, **job)
+        assert run_job(str(tmpdir.join('second_%s' % first)), stages=stages, processes=second, **job) == expected
+        # files that start from the same machine state are shared, the rest are remade
+        assert stages.hits['section'] > 0
@@ -0,0 +1,158 @@
+import math
+import os
+import struct
+import time
+import zlib
+
+import numpy
+import pytest
+
+from lib.campy import layercache, tiles
+
+# a trace and a pad, an inch by half an inch
+board_gerber = """%FSLAX24Y24*%
+%MOIN*%
+%ADD10C,0.0100*%
+%ADD11R,0.0600X0.0400*%
+D10*
+X0Y0D02*
+X10000Y5000D01*
+D11*
+X5000Y2500D03*
+M02*
+"""
+
+
+def _layers():
+    from lib.campy import pcb_layer
+    return [pcb_layer(gerber_data=board_gerber, gerber_file='board.gtl')]
+
+
+def _png_size(data):
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    return struct.unpack('>II', data[16:24])
+
+
+# the pixels of a PNG that _png wrote: 8 bit RGB, every row filtered none or up
+def _png_pixels(data):
+    width, height = _png_size(data)
+    assert data[24:29] == b'\x08\x02\x00\x00\x00'
+
+    chunks, k = [], 8
+    while k < len(data):
+        length, kind = struct.unpack('>I4s', data[k:k + 8])
+        assert struct.unpack('>I', data[k + 8 + length:k + 12 + length])[0] == zlib.crc32(data[k + 4:k + 8 + length]) & 0xffffffff
+        if kind == b'IDAT':
+            chunks.append(data[k + 8:k + 8 + length])
+        k += 12 + length
+
+    rows = numpy.frombuffer(zlib.decompress(b''.join(chunks)), numpy.uint8).reshape(height, 1 + width * 3)
+    pixels = numpy.zeros((height, width * 3), numpy.uint8)
+    for k, row in enumerate(rows):
+        assert row[0] in (0, 2)
+        pixels[k] = row[1:] + (pixels[k - 1] if row[0] == 2 and k > 0 else 0)
+    return pixels.reshape(height, width, 3)
+
+
+# stands in for the cairo render: the board cut into cells side / 8 across, each its own colour.  A cell is a whole
+# number of pixels on every level from 64 pixel tiles up, so a tile can be drawn straight from where it is and come
+# out the same as one cut out of a band render and halved
+def _cells(info, renders):
+    cell = info['side'] / 8.
+
+    def _render(layers, theme, bounds, scale, size):
+        renders.append(size)
+        (minx, maxx), (miny, maxy) = bounds
+        centers = (numpy.arange(size) + 0.5) / scale
+        columns = numpy.floor((minx + centers - info['bounds'][0]) / cell).astype(int)
+        rows = numpy.floor((info['bounds'][3] - (maxy - centers)) / cell).astype(int)
+        i, j = numpy.meshgrid(columns, rows)
+        return numpy.dstack([i * 37 % 256, j * 59 % 256, (i + j) % 2 * 255]).astype(numpy.uint8)
+
+    return _render
+
+
+def test_bands_are_cut_and_halved(monkeypatch):
+    pyramid = tiles.TilePyramid(tile_size=64, band_levels=2, max_scale=600)
+    key = tiles.TilePyramid.key('board', 1)
+    info = pyramid.info(key, _layers)
+    assert info['max_level'] == 3
+
+    renders = []
+    render = _cells(info, renders)
+    monkeypatch.setattr(tiles, '_render', render)
+
+    # bands are levels 0-1 and 2-3, each render is the area of a tile at the top of a band at the next level's scale
+    cases = [
+        (1, 1, 0, 1), (0, 0, 0, 1), (2, 2, 1, 2), (3, 5, 2, 2), (3, 4, 3, 2), (3, 1, 6, 3), (2, 0, 3, 3), (2, 3, 3, 4),
+    ]
+    for z, x, y, rendered in cases:
+        side = info['side'] / 2 ** z
+        minx, maxy = info['bounds'][0] + x * side, info['bounds'][3] - y * side
+        expected = render(None, None, ((minx, minx + side), (maxy - side, maxy)), 64 / side, 64)
+        renders.pop()
+
+        assert numpy.array_equal(_png_pixels(pyramid.tile(key, z, x, y, _layers)), expected)
+        assert renders == [128] * rendered
+
+
+def test_halve():
+    image = numpy.arange(4 * 4 * 3, dtype=numpy.uint8).reshape(4, 4, 3) * 5
+    half = tiles._halve(image)
+    assert half.shape == (2, 2, 3)
+    assert half[1, 0].tolist() == [int(math.floor(image[2:4, 0:2, c].mean() + 0.5)) for c in range(3)]
+
+
+def test_tile_and_parent(tmpdir):
+    pytest.importorskip('gerber.render.cairo_backend')
+
+    pyramid = tiles.TilePyramid(str(tmpdir), tile_size=64, band_levels=2, max_scale=300)
+    key = tiles.TilePyramid.key('board', 1)
+    info = pyramid.info(key, _layers)
+    assert info['max_level'] >= 2
+
+    # a tile on the second level of a band is cut out of the band's render, its parent is that render halved
+    tile = pyramid.tile(key, 1, 1, 0, _layers)
+    parent = pyramid.tile(key, 0, 0, 0, lambda: pytest.fail("the parent was made with its band"))
+    assert _png_size(tile) == _png_size(parent) == (64, 64)
+    assert tile != parent
+
+    # the next band renders again
+    child = pyramid.tile(key, 2, 2, 1, _layers)
+    assert _png_size(child) == (64, 64)
+    assert pyramid.tile(key, 2, 2, 1, lambda: pytest.fail("tiles are only made once")) == child
+
+
+def _stored(directory):
+    return dict(
+        (name, os.path.getsize(os.path.join(root, name)))
+        for root, dirs, names in os.walk(directory) for name in names if name != layercache.size_file
+    )
+
+
+def test_tiles_are_evicted_by_size(tmpdir, monkeypatch):
+    directory = str(tmpdir)
+    pyramid = tiles.TilePyramid(directory, max_bytes=1000)
+    key = tiles.TilePyramid.key('board', 1)
+
+    def _walk(*args):
+        raise AssertionError("looked through the directory")
+
+    # the first tile finds the directory empty, after that nothing looks through it until it's over max_bytes
+    for k in range(9):
+        if k == 1:
+            monkeypatch.setattr(os, 'walk', _walk)
+        path = pyramid._path(key, 1, k, 0)
+        pyramid._write(path, b'x' * 100)
+        os.utime(path, (time.time() - 100 + k, time.time() - 100 + k))
+    pyramid._write(pyramid._path(key, 1, 0, 1), b'x' * 100)
+    monkeypatch.undo()
+
+    assert int(open(os.path.join(directory, layercache.size_file)).read()) == 1000
+    assert pyramid._read(pyramid._path(key, 1, 0, 0)) == b'x' * 100
+
+    # once it's over, the least recently used go until it's down to three quarters
+    pyramid._write(pyramid._path(key, 1, 0, 2), b'x' * 100)
+    stored = _stored(directory)
+    assert sum(stored.values()) == int(open(os.path.join(directory, layercache.size_file)).read()) == 700
+    assert sorted(stored) == ['1-0-0.png', '1-0-1.png', '1-0-2.png', '1-5-0.png', '1-6-0.png', '1-7-0.png', '1-8-0.png']
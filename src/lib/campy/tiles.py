@@ -0,0 +1,251 @@
+import collections
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+
+import numpy
+from gerber.render import RenderSettings, theme
+
+from . import layercache
+
+logger = logging.getLogger(__name__)
+
+# Raster previews of a board as a pyramid of tile_size square PNG tiles.  Level 0 is the whole board in one tile and
+# every level after that doubles the resolution: 2**z by 2**z tiles, (0, 0) top left, up to the level that gets to
+# max_scale pixels per unit.  Tiles are only made when they're asked for and are kept under the pyramid's key, which
+# the caller makes from whatever decides what's in the picture (project, date modified, side, layers) - so a board
+# that's changed is a new pyramid rather than stale tiles.
+#
+# Levels go in bands of band_levels.  The first tile asked for in a band renders the area of its ancestor at the
+# top of the band once, at the resolution of the band's last level, and every tile in that area on every level of
+# the band is cut out of it, halving the image from one level to the next.  One render fills several levels and is
+# never more than tile_size * 2**(band_levels - 1) pixels across.  Only the render needs cairo: the image comes out
+# of it as a numpy array, and cutting it up, halving it and writing the PNGs are done on that.
+#
+# Tiles go to disk when there's a directory and the least recently used files go once they add up to over
+# max_bytes, down to three quarters of it so there's room for a few more bands.  What they add up to is kept in a
+# file in the directory, with layercache.update_size, so the directory is only looked through when it's over.
+# Without a directory they're kept in memory, max_bytes of them.
+
+
+class TilePyramid(object):
+    def __init__(self, directory=None, tile_size=256, band_levels=3, max_scale=2000, max_bytes=256*1024*1024):
+        self.directory = directory
+        self.tile_size = tile_size
+        self.band_levels = band_levels
+        self.max_scale = max_scale
+        self.max_bytes = max_bytes
+        self.files = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def key(cls, *parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str)).hexdigest()
+
+    # bounds ([minx, miny, maxx, maxy] of the layers), side (of the square level 0 covers) and max_level.  layers() is
+    # only called if the pyramid hasn't been started yet
+    def info(self, key, layers):
+        path = self._path(key, 'info.json')
+        data = self._read(path)
+        if data is not None:
+            return json.loads(data)
+
+        bounds = _layer_bounds(layers())
+        side = float(max(bounds[2] - bounds[0], bounds[3] - bounds[1])) or 1.
+        info = {
+            'bounds': bounds,
+            'side': side,
+            'tile_size': self.tile_size,
+            'max_level': max(0, int(math.floor(math.log(self.max_scale * side / self.tile_size, 2)))),
+        }
+        self._write(path, json.dumps(info))
+        return info
+
+    # PNG data for tile x, y of level z.  layers() gives the pcb-tools layers to draw, bottom first, and is only
+    # called if the tile hasn't been made yet
+    def tile(self, key, z, x, y, layers, theme=theme.THEMES['OSH Park']):
+        path = self._path(key, z, x, y)
+        data = self._read(path)
+        if data is not None:
+            return data
+
+        info = self.info(key, layers)
+        if not (0 <= z <= info['max_level'] and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise Exception("no tile {}/{}/{}, levels go up to {}".format(z, x, y, info['max_level']))
+
+        self._render_band(key, info, z, x, y, layers(), theme)
+        self._evict()
+        return self._read(path)
+
+    def _render_band(self, key, info, z, x, y, layers, theme):
+        top = z - z % self.band_levels
+        last = min(top + self.band_levels - 1, info['max_level'])
+        bx, by = x >> (z - top), y >> (z - top)
+
+        # the area tile (top, bx, by) covers
+        side = info['side'] / float(2 ** top)
+        minx = info['bounds'][0] + bx * side
+        maxy = info['bounds'][3] - by * side
+        size = self.tile_size * 2 ** (last - top)
+        image = _render(layers, theme, ((minx, minx + side), (maxy - side, maxy)), size / side, size)
+
+        for level in range(last, top - 1, -1):
+            count = 2 ** (level - top)
+            for tx in range(count):
+                for ty in range(count):
+                    self._write(
+                        self._path(key, level, bx * count + tx, by * count + ty),
+                        _crop(image, tx * self.tile_size, ty * self.tile_size, self.tile_size),
+                    )
+            if level > top:
+                image = _halve(image)
+
+    def _path(self, key, *parts):
+        name = '-'.join(str(p) for p in parts)
+        if not self.directory:
+            return (key, name)
+        return os.path.join(self.directory, key[:2], key, name if name.endswith('.json') else name + '.png')
+
+    def _read(self, path):
+        if not self.directory:
+            with self.lock:
+                data = self.files.pop(path, None)
+                if data is not None:
+                    self.files[path] = data
+                return data
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+
+        # mark it as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return data
+
+    def _write(self, path, data):
+        if not self.directory:
+            with self.lock:
+                self.files[path] = data
+            return
+
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+
+        # written to the side and moved into place so nobody reads half a tile
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.rename(tmp, path)
+
+        layercache.update_size(self.directory, len(data) - replaced, self.max_bytes, self.max_bytes * 3 // 4)
+
+    def _evict(self):
+        if self.directory:
+            return
+
+        with self.lock:
+            total = sum(len(data) for data in self.files.values())
+            while total > self.max_bytes and self.files:
+                total -= len(self.files.popitem(last=False)[1])
+
+
+def _layer_bounds(layers):
+    bounds = [l.bounds for l in layers if l.bounds is not None]
+    if not bounds:
+        return [0., 0., 1., 1.]
+    return [
+        min(b[0][0] for b in bounds), min(b[1][0] for b in bounds),
+        max(b[0][1] for b in bounds), max(b[1][1] for b in bounds),
+    ]
+
+
+# pcb-tools only has its cairo backend when pycairo or cairocffi is installed, so it's imported when something is
+# drawn rather than when this is
+def _cairo():
+    from gerber.render.cairo_backend import GerberCairoContext, cairo
+    return GerberCairoContext, cairo
+
+
+# the layers drawn over bounds ((minx, maxx), (miny, maxy)) at scale pixels per unit, as a size x size x 3 array
+# of RGB
+def _render(layers, theme, bounds, scale, size):
+    GerberCairoContext, cairo = _cairo()
+    image = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+    ctx = cairo.Context(image)
+    color = theme['background'].color
+    ctx.set_source_rgba(color[0], color[1], color[2], 1.0)
+    ctx.paint()
+
+    if layers:
+        render_ctx = GerberCairoContext(scale=scale)
+        for layer in layers:
+            render_ctx.render_layer(
+                layer, settings=theme.get(layer.layer_class, RenderSettings()), bgsettings=theme['background'],
+                bounds=bounds,
+            )
+        ctx.set_source_surface(render_ctx.surface)
+        ctx.paint()
+
+    # ARGB32 is a native endian word per pixel.  The background is opaque so alpha is always 255 and the colours
+    # aren't changed by being premultiplied
+    image.flush()
+    pixels = numpy.frombuffer(image.get_data(), numpy.uint8).reshape(size, image.get_stride())[:, :size * 4]
+    pixels = pixels.reshape(size, size, 4)
+    return pixels[:, :, [2, 1, 0] if sys.byteorder == 'little' else [1, 2, 3]].copy()
+
+
+def _crop(image, x, y, size):
+    return _png(image[y:y + size, x:x + size])
+
+
+# each pixel the average of the four it covers
+def _halve(image):
+    pixels = image.astype(numpy.uint16)
+    total = pixels[0::2, 0::2] + pixels[1::2, 0::2] + pixels[0::2, 1::2] + pixels[1::2, 1::2]
+    return ((total + 2) // 4).astype(numpy.uint8)
+
+
+# an 8 bit RGB PNG.  Every row is filtered as the difference from the row above, which the big flat areas of a board
+# compress down to almost nothing
+def _png(pixels):
+    height, width = pixels.shape[:2]
+    rows = numpy.ascontiguousarray(pixels, dtype=numpy.uint8).reshape(height, width * 3)
+    up = rows.copy()
+    up[1:] -= rows[:-1]
+    data = numpy.hstack([numpy.full((height, 1), 2, numpy.uint8), up]).tobytes()
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        _png_chunk(b'IDAT', zlib.compress(data, 6)),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+# memory only until it's given a directory
+default = TilePyramid()
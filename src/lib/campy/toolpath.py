@@ -0,0 +1,243 @@
+import array
+import collections
+import math
+
+# Move types.  Everything an Environment can emit is one of these - TEXT covers comments, tool changes, variable
+# assignments and anything else that was written directly rather than as a move.
+RAPID = 0
+LINEAR = 1
+ARC_CW = 2
+ARC_CCW = 3
+PROBE = 4
+DRILL = 5
+TEXT = 6
+
+kind_names = {
+    RAPID: 'rapid',
+    LINEAR: 'linear',
+    ARC_CW: 'arc_cw',
+    ARC_CCW: 'arc_ccw',
+    PROBE: 'probe',
+    DRILL: 'drill',
+    TEXT: 'text',
+}
+
+# flags for DRILL rows - first and last hole of a canned cycle
+DRILL_START = 1
+DRILL_END = 2
+
+# flag for TEXT rows - x and y are a point the text quotes as point_text(x, y), which translated moves along with it
+COMMENT_POINT = 1
+
+# flags for PROBE rows, index into this list
+probe_codes = ['G38.2', 'G38.3', 'G38.4', 'G38.5']
+
+NAN = float('nan')
+
+
+def point_text(x, y):
+    return "[{!r}, {!r}]".format(x, y)
+
+
+Move = collections.namedtuple('Move', ['kind', 'x', 'y', 'z', 'a', 'feed', 'i', 'j', 'flags', 'level', 'op', 'text'])
+
+axes = ('x', 'y', 'z', 'a', 'feed', 'i', 'j')
+
+
+# Compact, array backed list of moves sitting between operations and G-code text.
+#
+# Every row has a kind, target x/y/z/a, feed, arc center offsets i/j (or R/cycle depth for DRILL rows), a flags byte,
+# the indent level it was generated at and the operation that generated it.  Axes that were not given are NaN.
+# Values that aren't plain numbers (G-code expressions like "[#105-0.005]") are kept off to the side in exprs, and
+# TEXT rows keep their text in text.  Use iteration or row() to get Move tuples back with None/expressions filled in.
+class Toolpath(object):
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.kind = array.array('B')
+        self.flags = array.array('B')
+        self.level = array.array('B')
+        self.op = array.array('H')
+        self.columns = dict((axis, array.array('d')) for axis in axes)
+        self.ops = []
+        self.op_index = {}
+        self.current_op = 0
+        self.text = {}
+        self.exprs = {}
+        self.set_operation(None)
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __nonzero__(self):
+        return len(self.kind) > 0
+
+    def set_operation(self, name):
+        if name not in self.op_index:
+            self.op_index[name] = len(self.ops)
+            self.ops.append(name)
+
+        self.current_op = self.op_index[name]
+
+    def append(self, kind, x=None, y=None, z=None, a=None, feed=None, i=None, j=None, flags=0, level=0, text=None):
+        row = len(self.kind)
+        self.kind.append(kind)
+        self.flags.append(flags)
+        self.level.append(max(level, 0))
+        self.op.append(self.current_op)
+
+        for axis, value in zip(axes, (x, y, z, a, feed, i, j)):
+            if value is None:
+                self.columns[axis].append(NAN)
+            elif isinstance(value, basestring):
+                self.columns[axis].append(NAN)
+                self.exprs.setdefault(row, {})[axis] = value
+            else:
+                self.columns[axis].append(value)
+
+        if text is not None:
+            self.text[row] = text
+
+        return row
+
+    def extend(self, other):
+        offset = len(self.kind)
+        op_map = []
+        for name in other.ops:
+            if name not in self.op_index:
+                self.op_index[name] = len(self.ops)
+                self.ops.append(name)
+            op_map.append(self.op_index[name])
+
+        self.kind.extend(other.kind)
+        self.flags.extend(other.flags)
+        self.level.extend(other.level)
+        self.op.extend(array.array('H', [op_map[o] for o in other.op]))
+        for axis in axes:
+            self.columns[axis].extend(other.columns[axis])
+
+        for row, text in other.text.items():
+            self.text[row + offset] = text
+
+        for row, exprs in other.exprs.items():
+            self.exprs[row + offset] = dict(exprs)
+
+    # copy moved by dx, dy - expressions can't be moved and are copied as they are.  Points quoted in comments marked
+    # COMMENT_POINT (see operation's comment_point) are moved too, nothing else in any text is touched
+    def translated(self, dx=0, dy=0):
+        import numpy
+        path = Toolpath()
+        path.extend(self)
+        for axis, offset in (('x', dx), ('y', dy)):
+            if offset:
+                shifted = numpy.frombuffer(path.columns[axis], dtype=numpy.float64) + offset
+                path.columns[axis] = array.array('d', shifted.tostring())
+
+        for row, text in path.text.items():
+            if self.flags[row] & COMMENT_POINT:
+                before = point_text(self.value(row, 'x'), self.value(row, 'y'))
+                path.text[row] = text.replace(before, point_text(path.value(row, 'x'), path.value(row, 'y')), 1)
+
+        return path
+
+    def value(self, row, axis):
+        v = self.columns[axis][row]
+        if math.isnan(v):
+            return self.exprs.get(row, {}).get(axis)
+        return v
+
+    def row(self, row):
+        return Move(
+            self.kind[row],
+            self.value(row, 'x'), self.value(row, 'y'), self.value(row, 'z'), self.value(row, 'a'),
+            self.value(row, 'feed'), self.value(row, 'i'), self.value(row, 'j'),
+            self.flags[row], self.level[row], self.ops[self.op[row]], self.text.get(row),
+        )
+
+    def __iter__(self):
+        for row in xrange(len(self.kind)):
+            yield self.row(row)
+
+    def arrays(self):
+        import numpy
+        data = {
+            'kind': numpy.frombuffer(self.kind, dtype=numpy.uint8),
+            'flags': numpy.frombuffer(self.flags, dtype=numpy.uint8),
+            'level': numpy.frombuffer(self.level, dtype=numpy.uint8),
+            'op': numpy.frombuffer(self.op, dtype=numpy.uint16),
+        }
+        for axis in axes:
+            data[axis] = numpy.frombuffer(self.columns[axis], dtype=numpy.float64)
+
+        return data
+
+
+# Records the xy segments of every move for previews, see Environment.set_save_geoms.  Endpoints go into one flat
+# array of (x1, y1, x2, y2) and the move kind into a byte column - shapely objects are only built if someone asks
+# for them with geoms() or by iterating.
+class MoveRecorder(object):
+    kinds = ['goto', 'cut']
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.coords = array.array('d')
+        self.kind = array.array('B')
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __nonzero__(self):
+        return len(self.kind) > 0
+
+    def append(self, start, end, kind):
+        self.coords.extend((start[0], start[1], end[0], end[1]))
+        self.kind.append(self.kinds.index(kind))
+
+    def extend(self, other):
+        self.coords.extend(other.coords)
+        self.kind.extend(other.kind)
+
+    # copy of the segments from start on, moved by dx, dy
+    def translated(self, dx=0, dy=0, start=0):
+        recorder = MoveRecorder()
+        segments, kinds = self.arrays()
+        recorder.coords = array.array('d', (segments[start:] + (dx, dy, dx, dy)).tostring())
+        recorder.kind = array.array('B', kinds[start:].tostring())
+        return recorder
+
+    # returns an (N, 4) array of segments and an (N, ) array of kind indexes
+    def arrays(self):
+        import numpy
+        segments = numpy.frombuffer(self.coords, dtype=numpy.float64).reshape((-1, 4))
+        kinds = numpy.frombuffer(self.kind, dtype=numpy.uint8)
+        return segments, kinds
+
+    def segments(self, kind=None):
+        segments, kinds = self.arrays()
+        if kind is None:
+            return segments
+        return segments[kinds == self.kinds.index(kind)]
+
+    def bounds(self):
+        segments = self.segments()
+        if not len(segments):
+            return None
+
+        xs = segments[:, 0::2]
+        ys = segments[:, 1::2]
+        return xs.min(), ys.min(), xs.max(), ys.max()
+
+    def geoms(self, kind=None):
+        import shapely.geometry
+        for x1, y1, x2, y2 in self.segments(kind):
+            yield shapely.geometry.LineString([(x1, y1), (x2, y2)])
+
+    # same (geometry, kind) tuples Environment.geometry used to hold
+    def __iter__(self):
+        import shapely.geometry
+        segments, kinds = self.arrays()
+        for (x1, y1, x2, y2), k in zip(segments, kinds):
+            yield shapely.geometry.LineString([(x1, y1), (x2, y2)]), self.kinds[k]